@@ -1,16 +1,495 @@
 # -*- coding: utf-8 -*-
+import contextvars
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy
+except ImportError:  # run_many falls back to one run per input
+    numpy = None
+
+
+# the Instrumentation enabled in the current context (thread or asyncio task), if any
+_current_instrumentation = contextvars.ContextVar("instrumentation", default=None)
+# None while no Instrumentation is enabled in any context, so that the check costs one global lookup;
+# otherwise the _ContextInstrumentation which forwards the statistics to the one of the current context
+_instrumentation = None
+_enabled_instrumentations = 0
+_instrumentation_lock = threading.Lock()
+
+
+class Instrumentation(object):
+    """
+    opt-in statistics of the construction and the runs of automata: counters, timers, maxima and callbacks.
+    while it is enabled, every construction phase (compile, determinize, hopcroft, minimize, eps_closures)
+    adds its time and its sizes to the statistics and calls the callbacks with them, and the runs of the
+    compiled automata count the symbols they read (and the NFAs their active states per symbol).
+    while none is enabled, each of those operations only checks one global variable.
+    an Instrumentation is enabled for the current context only: other threads and asyncio tasks which
+    were not started from it do not add to it. the instrumentations enabled in one context are disabled
+    in the reverse order. the threads running in copies of the context update it under a lock.
+
+    >>> with Instrumentation() as stats:
+    ...     dfa = nfa.convert_to_dfa()
+    >>> stats.export()["counters"]["determinize.dfa_states"] == len(dfa.states)
+    True
+    """
+
+    __slots__ = ("counters", "timers", "maxima", "callbacks", "progress_interval", "_token", "_lock")
+
+    def __init__(self, callbacks=(), progress_interval=1 << 12):
+        """
+        :param callbacks: functions of (event name, dict of data), called at the end of each construction phase
+        :param progress_interval: number of DFA states between two 'determinize.progress' events
+        """
+        self.callbacks = list(callbacks)
+        self.progress_interval = progress_interval
+        self._token = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        set every statistic back to zero.
+        :return:
+        """
+        with self._lock:
+            self.counters = {}
+            self.timers = {}  # name -> [calls, seconds]
+            self.maxima = {}
+        return self
+
+    def enable(self):
+        """
+        start collecting the statistics of every automaton in the current context, until disable().
+        :return:
+        """
+        global _instrumentation, _enabled_instrumentations
+        if self._token is not None:
+            raise RuntimeError("this Instrumentation is already enabled")
+        self._token = _current_instrumentation.set(self)
+        with _instrumentation_lock:
+            _enabled_instrumentations += 1
+            _instrumentation = _context_instrumentation
+        return self
+
+    def disable(self):
+        """
+        stop collecting, and give the collection back to the Instrumentation enabled before this one, if any.
+        it does nothing when this one is not enabled.
+        :return:
+        """
+        global _instrumentation, _enabled_instrumentations
+        if self._token is None:
+            return self
+        if _current_instrumentation.get() is not self:
+            raise RuntimeError("an Instrumentation enabled after this one in the same context is still enabled")
+        _current_instrumentation.reset(self._token)
+        self._token = None
+        with _instrumentation_lock:
+            _enabled_instrumentations -= 1
+            if _enabled_instrumentations == 0:
+                _instrumentation = None
+        return self
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def maximum(self, name, value):
+        with self._lock:
+            if value > self.maxima.get(name, value - 1):
+                self.maxima[name] = value
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            timer = self.timers.setdefault(name, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+    def event(self, name, **data):
+        """
+        call the callbacks with the event.
+        :param name:
+        :param data:
+        :return:
+        """
+        for callback in self.callbacks:
+            callback(name, data)
+
+    def finish(self, phase, start, **sizes):
+        """
+        record the end of a construction phase begun at time.perf_counter() 'start': its time, and each of
+        its sizes both as a counter (summed over the calls) and as a maximum, then call the callbacks.
+        :param phase:
+        :param start:
+        :param sizes:
+        :return:
+        """
+        seconds = time.perf_counter() - start
+        self.add_time(phase, seconds)
+        for key, value in sizes.items():
+            self.count("%s.%s" % (phase, key), value)
+            self.maximum("%s.%s" % (phase, key), value)
+        self.event(phase, seconds=seconds, **sizes)
+
+    def export(self):
+        """
+        return the statistics as a dict of plain values, ready for json.dumps.
+        :return:
+        """
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "timers": dict((name, {"calls": calls, "seconds": seconds})
+                                   for name, (calls, seconds) in self.timers.items()),
+                    "maxima": dict(self.maxima)}
+
+
+class _NoInstrumentation(object):
+    """
+    drops the statistics of a context in which no Instrumentation is enabled.
+    """
+
+    progress_interval = 1 << 12
+
+    def count(self, name, value=1):
+        pass
+
+    def maximum(self, name, value):
+        pass
+
+    def add_time(self, name, seconds):
+        pass
+
+    def event(self, name, **data):
+        pass
+
+    def finish(self, phase, start, **sizes):
+        pass
+
+
+class _ContextInstrumentation(object):
+    """
+    the value of _instrumentation while some Instrumentation is enabled: its attributes are the ones of
+    the Instrumentation enabled in the current context.
+    """
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        current = _current_instrumentation.get()
+        return getattr(current if current is not None else _no_instrumentation, name)
+
+
+_no_instrumentation = _NoInstrumentation()
+_context_instrumentation = _ContextInstrumentation()
+
+
 class Automaton(object):
     """
     the base class of automaton
     """
 
+    # attributes which define the automaton.
+    # tables derived from them (compiled forms, closures, ...) are cached until one of them is reassigned.
+    _definition = frozenset(["states", "alphabet", "transitions", "initial_state", "final_states",
+                             "on_unknown", "default_symbol"])
+
+    # what a run does with a symbol outside of the alphabet, one of UNKNOWN_POLICIES.
+    # the policy is compiled into the tables, so it costs nothing per symbol.
+    on_unknown = "reject"
+    default_symbol = None  # the symbol read instead of an unknown one under the "default" policy
+
     # Initialize automaton with given arguments.
-    def __init__(self, states, alphabet, transitions, initial_state, final_state):
+    def __init__(self, states, alphabet, transitions, initial_state, final_state, on_unknown="reject",
+                 default_symbol=None):
         self.states = frozenset(states)
         self.alphabet = frozenset(alphabet)
         self.transitions = transitions
         self.initial_state = initial_state
         self.final_states = frozenset(final_state)
+        self.on_unknown = on_unknown
+        self.default_symbol = default_symbol
+
+    def __setattr__(self, name, value):
+        if name in self._definition:
+            self.__dict__["_cache"] = {}
+        object.__setattr__(self, name, value)
+
+    def run_many(self, strings):
+        """
+        check whether each of the inputs is the language of this automaton.
+        :param strings:
+        :return: list of bool
+        """
+        return [self.run(input_string) for input_string in strings]
+
+    accepts_batch = run_many
+
+    def compiled(self):
+        """
+        return the compiled form of this automaton. it is built once and cached.
+        :return:
+        """
+        compiled = self._cache.get("compiled")
+        if compiled is None:
+            stats = _instrumentation
+            start = time.perf_counter() if stats is not None else None
+            compiled = self._cache["compiled"] = self._compile()
+            if stats is not None:
+                stats.finish("compile", start, states=len(compiled.labels), classes=compiled.unknown)
+        return compiled
+
+    def _known_symbols(self, input_string):
+        """
+        return the symbols of the input as the reference runs read them, the symbols outside of the alphabet
+        being handled by the unknown-symbol policy, or None when the input is rejected.
+        :param input_string:
+        :return: list of symbols, or None
+        """
+        symbols = []
+        for position, character in enumerate(input_string):
+            if character not in self.alphabet:
+                if _instrumentation is not None:
+                    _instrumentation.count("unknown_symbols")
+                if self.on_unknown == "raise":
+                    raise UnknownSymbolError(character, position)
+                if self.on_unknown == "skip":
+                    continue
+                if self.on_unknown != "default":
+                    return None
+                character = self.default_symbol
+            symbols.append(character)
+        return symbols
+
+    def verify_compiled(self, inputs):
+        """
+        return the inputs for which the compiled form and the transitions dict disagree.
+        :param inputs:
+        :return:
+        """
+        compiled = self.compiled()
+        return [x for x in inputs if compiled.run(x) != self.run_reference(x)]
+
+    def finditer(self, text, starts=False):
+        """
+        yield the end offset of every substring of the text which is the language of this automaton.
+        :param text:
+        :param starts: yield (start offset, end offset) instead, with the leftmost start (see Searcher)
+        :return:
+        """
+        searcher = self._cache.get("searcher")
+        if searcher is None:
+            searcher = self._cache["searcher"] = Searcher([self])
+        for match in searcher.finditer(text, starts):
+            yield match[:2] if starts else match[0]
+
+    def matcher(self):
+        """
+        return a Matcher which runs this automaton over input given in chunks.
+        :return:
+        """
+        return Matcher(self.compiled())
+
+    def is_empty(self):
+        """
+        check whether the language of this automaton is empty.
+        when it is not, the counterexample is one of its shortest inputs.
+        :return: LanguageCheck
+        """
+        word = self._compiled_nfa().shortest_accepted()
+        return LanguageCheck(word is None, None if word is None else _word(word))
+
+    def is_equivalent(self, other):
+        """
+        check whether self and other accept the same language, by the union-find algorithm of Hopcroft and Karp.
+        both automata are run side by side (NFAs through their subset construction, built on the fly), and
+        pairs of states already known to be merged are not searched again. the search stops at the first
+        pair of states of which exactly one is final; the input leading to it is the counterexample.
+        :param other:
+        :return: LanguageCheck
+        """
+        a, b = self.compiled(), other.compiled()
+        columns = [(members[0], class_a, class_b)
+                   for (class_a, class_b), members in _joint_classes(a, b, set(a.classes).union(b.classes))]
+        parent = {}
+
+        def find(x):
+            while parent.get(x, x) != x:
+                parent[x] = parent.get(parent[x], parent[x])
+                x = parent[x]
+            return x
+
+        parent[(0, a.start)] = (1, b.start)
+        searched = [(a.start, b.start, -1, None)]  # (state of a, state of b, previous entry, symbol)
+        for i, (p, q, _, _) in enumerate(searched):  # searched grows while it is searched
+            if a.accepts(p) != b.accepts(q):
+                return LanguageCheck(False, _word(_path(searched, i)))
+            for symbol, class_a, class_b in columns:
+                p_next, q_next = a.step(p, class_a), b.step(q, class_b)
+                root_a, root_b = find((0, p_next)), find((1, q_next))
+                if root_a != root_b:
+                    parent[root_a] = root_b
+                    searched.append((p_next, q_next, i, symbol))
+        return LanguageCheck(True)
+
+    def is_subset_of(self, other):
+        """
+        check whether the language of self is included in the language of other.
+        the search runs over pairs of a state of self and a set of states of other, and keeps an antichain:
+        a pair is not searched when a pair with the same state of self and a subset of its set was.
+        the counterexample is an input accepted by self and rejected by other.
+        :param other:
+        :return: LanguageCheck
+        """
+        a, b = self._compiled_nfa(), other._compiled_nfa()
+        columns = [(members[0], class_a, class_b) for (class_a, class_b), members in _joint_classes(a, b, a.classes)]
+        antichain = {}  # state of self -> minimal sets of states of other searched with it
+
+        def subsumed(p, states):
+            kept = antichain.setdefault(p, [])
+            if any(seen & ~states == 0 for seen in kept):
+                return True
+            kept[:] = [seen for seen in kept if states & ~seen != 0]
+            kept.append(states)
+            return False
+
+        searched = []  # (state of self, states of other, previous entry, symbol)
+        for p in _bits(a.initial):
+            if not subsumed(p, b.initial):
+                searched.append((p, b.initial, -1, None))
+        for i, (p, states, _, _) in enumerate(searched):  # searched grows while it is searched
+            if a.final >> p & 1 and not b.accepts(states):
+                return LanguageCheck(False, _word(_path(searched, i)))
+            for symbol, class_a, class_b in columns:
+                successors = a.successors[p * a.width + class_a]
+                if not successors:
+                    continue
+                next_states = b.step(states, class_b)
+                for p_next in _bits(successors):
+                    if not subsumed(p_next, next_states):
+                        searched.append((p_next, next_states, i, symbol))
+        return LanguageCheck(True)
+
+    def _compiled_nfa(self):
+        """
+        return the bitset form of this automaton (its compiled form, unless it is a DFA).
+        :return:
+        """
+        compiled = self.compiled()
+        if isinstance(compiled, CompiledNFA):
+            return compiled
+        nfa = self._cache.get("compiled_nfa")
+        if nfa is None:
+            nfa = self._cache["compiled_nfa"] = CompiledNFA(self)
+        return nfa
+
+    def fingerprint(self):
+        """
+        return a hash of the definition of this automaton, which does not depend on the order of its sets
+        and dicts, so it is the same in every process (see DFACache).
+        :return: hex str
+        """
+        fingerprint = self._cache.get("fingerprint")
+        if fingerprint is None:
+            definition = (self._base_class().__name__, self.states, self.alphabet, self.transitions, self.initial_state,
+                          self.final_states, self.on_unknown, self.default_symbol)
+            fingerprint = hashlib.sha256(_canonical(definition).encode("utf-8")).hexdigest()
+            self._cache["fingerprint"] = fingerprint
+        return fingerprint
+
+    def _expanded_transitions(self):
+        """
+        return the transitions dict with its SymbolRange labels expanded against the alphabet (see
+        _transition_rows). the reference runs and the algorithms working on the dict read this one, so that
+        they agree with the compiled forms. it is cached like them.
+        :return:
+        """
+        expanded = self._cache.get("expanded_transitions")
+        if expanded is None:
+            labels = list(self.transitions)
+            rows = _transition_rows(self, labels, isinstance(self, DeterministicFiniteAutomaton))
+            expanded = self._cache["expanded_transitions"] = dict(zip(labels, rows))
+        return expanded
+
+    def _base_class(self):
+        """
+        return the class of this module which this automaton is an instance of.
+        :return:
+        """
+        return next(cls for cls in type(self).__mro__ if cls.__module__ == __name__)
+
+    def trimmed(self):
+        """
+        return the automaton without its useless states: the states which cannot be reached from the
+        initial state, and those from which no final state can be reached. the transitions to them are
+        dropped, so they all go to the implicit dead state. the initial state is always kept.
+        self is returned when every state is useful.
+        :return:
+        """
+        deterministic = isinstance(self, DeterministicFiniteAutomaton)
+        successors = dict((state, set()) for state in self.states)
+        for state, trans_dict in self._expanded_transitions().items():
+            if state in successors:
+                for targets in trans_dict.values():
+                    successors[state].update((targets,) if deterministic else targets)
+
+        reachable = {self.initial_state}
+        predecessors = {}  # state -> reachable states moving to it
+        stack = [self.initial_state]
+        while stack:
+            state = stack.pop()
+            for target in successors.get(state, ()):
+                predecessors.setdefault(target, []).append(state)
+                if target not in reachable:
+                    reachable.add(target)
+                    stack.append(target)
+        useful = set(self.final_states.intersection(reachable))
+        stack = list(useful)
+        while stack:
+            for state in predecessors.get(stack.pop(), ()):
+                if state not in useful:
+                    useful.add(state)
+                    stack.append(state)
+        useful.add(self.initial_state)
+        if useful == self.states:
+            return self
+
+        transitions = {}
+        for state in useful:
+            trans_dict = self.transitions.get(state, {})
+            if deterministic:
+                transitions[state] = dict((symbol, target) for symbol, target in trans_dict.items() if target in useful)
+            else:
+                transitions[state] = dict((symbol, useful.intersection(targets)) for symbol, targets in trans_dict.items()
+                                          if not useful.isdisjoint(targets))
+        return self._base_class()(useful, self.alphabet, transitions, self.initial_state,
+                                  self.final_states.intersection(useful), self.on_unknown, self.default_symbol)
+
+    def invalidate(self):
+        """
+        drop every table derived from this automaton.
+        call this after modifying 'transitions' in place.
+        :return:
+        """
+        self.__dict__["_cache"] = {}
 
     def __eq__(self, other):
         return self.states == other.states and \
@@ -56,52 +535,229 @@ class Automaton(object):
         return ans
 
 
+# longest str input which DeterministicFiniteAutomaton.run walks with its inline loop; longer inputs are
+# translated in one pass by classify(), which is faster past that length
+_SHORT_INPUT = 32
+
+
 class DeterministicFiniteAutomaton(Automaton):
     """
     Deterministic Finite Automaton
     """
 
+    def _compile(self):
+        return CompiledDFA(self)
+
     def run(self, input_string):
         """
         check whether the input is the language of this DFA.
+        short str inputs are walked through the compiled table right here, one dict lookup per character,
+        which saves the calls down to the compiled form; the parts of the table are cached for that.
+        :param input_string:
+        :return:
+        """
+        if type(input_string) is str and len(input_string) <= _SHORT_INPUT and _instrumentation is None:
+            parts = self._cache.get("run_parts")
+            if parts is not None:
+                table, classes, unknown, final_rows = parts
+                state = 0
+                for character in input_string:
+                    state = table[state + classes.get(character, unknown)]
+                return state in final_rows
+        compiled = self.compiled()
+        if compiled.on_unknown != "raise" and "run_parts" not in self._cache:
+            final_rows = frozenset(q * compiled.width for q in range(compiled.dead) if compiled.accepting[q])
+            self._cache["run_parts"] = (compiled.table, compiled.classes, compiled.unknown, final_rows)
+        return compiled.run(input_string)
+
+    def run_many(self, strings, lengths=None):
+        """
+        check whether each of the inputs is the language of this DFA.
+        all the inputs are stepped through the compiled table together, one position at a time.
+        :param strings: sequence of inputs, or a NumPy array: 2-d of integer symbol codes with one input per row,
+        or 1-d of str or bytes
+        :param lengths: the length of each row when strings is a NumPy array of codes (default: the full row)
+        :return: NumPy array of bool (list of bool when NumPy is not installed)
+        """
+        return self.compiled().run_many(strings, lengths)
+
+    accepts_batch = run_many
+
+    def run_parallel(self, input_string, workers=None, mp_context=None):
+        """
+        check whether the input is the language of this DFA, splitting it across several processes.
+        :param input_string:
+        :param workers: number of processes (default: the number of CPUs)
+        :param mp_context: multiprocessing context of the processes (default: the one of the start method)
+        :return:
+        """
+        return self.compiled().run_parallel(input_string, workers, mp_context=mp_context)
+
+    def run_reference(self, input_string):
+        """
+        check whether the input is the language of this DFA by walking the transitions dict directly.
+        this is the reference implementation the compiled table is checked against.
         :param input_string:
         :return:
         """
+        symbols = self._known_symbols(input_string)
+        if symbols is None:
+            return False
+        transitions = self._expanded_transitions()
         state = self.initial_state  # set initial state
-        for character in input_string:
-            if character not in self.alphabet:
-                print("ERROR: %s not in alphabet" % character)
-                return False
-            else:
-                state = self.transitions[state][character]  # move to next state
+        for character in symbols:
+            trans_dict = transitions.get(state, {})
+            if character not in trans_dict:
+                return False  # a missing transition goes to the implicit dead state
+            state = trans_dict[character]  # move to next state
         return state in self.final_states  # if you are in one of final states, the input_string is accepted
 
     def flipped_dfa(self):
         """
-        return a DFA whose language is flipped over
+        return a DFA whose language is flipped over (within the alphabet).
+        its missing transitions are made explicit first (see completed), as the implicit dead state becomes final.
+        :return:
+        """
+        dfa = self.completed()
+        final_states = set([x for x in dfa.states if x not in dfa.final_states])
+        return DeterministicFiniteAutomaton(dfa.states,
+                                            dfa.alphabet,
+                                            dfa.transitions,
+                                            dfa.initial_state,
+                                            final_states,
+                                            dfa.on_unknown,
+                                            dfa.default_symbol)
+
+    def completed(self, sink=None):
+        """
+        return the DFA with a transition on every symbol of the alphabet from every state: the missing
+        transitions go to the new non-final state 'sink', which loops on every symbol. this makes the
+        implicit dead state explicit. self is returned when no transition is missing.
+        :param sink: name of the new state
+        :return:
+        """
+        labels = list(self.states)
+        rows = _transition_rows(self, labels, True)
+        if all(symbol in row for row in rows for symbol in self.alphabet):
+            return self
+        if sink in self.states:
+            raise ValueError("the sink %r is already a state" % (sink,))
+        transitions = dict((state, dict((symbol, row.get(symbol, sink)) for symbol in self.alphabet))
+                           for state, row in zip(labels, rows))
+        transitions[sink] = dict.fromkeys(self.alphabet, sink)
+        return DeterministicFiniteAutomaton(self.states.union([sink]), self.alphabet, transitions, self.initial_state,
+                                            self.final_states, self.on_unknown, self.default_symbol)
+
+    def product(self, other, accept, minimize=False):
+        """
+        return the product DFA of self and other, whose final states are chosen by 'accept'.
+        only the pairs of states reachable from the pair of initial states are built (see CompiledDFA.product).
+        the states of the result are numbered from 0 (the initial state).
+        :param other:
+        :param accept: function of (final in self, final in other) -> bool
+        :param minimize: minimize both DFAs before and the result after the construction
+        :return:
+        """
+        if minimize:
+            self, other = self.minimized(), other.minimized()
+        result = self.compiled().product(other.compiled(), accept)
+        if minimize:
+            result = result.minimized()
+        return result.to_automaton(labels=False)
+
+    def intersection(self, other, minimize=False):
+        """
+        return a DFA whose language is the intersection of the languages of self and other.
+        """
+        return self.product(other, lambda x, y: x and y, minimize)
+
+    def union(self, other, minimize=False):
+        """
+        return a DFA whose language is the union of the languages of self and other.
+        """
+        return self.product(other, lambda x, y: x or y, minimize)
+
+    def difference(self, other, minimize=False):
+        """
+        return a DFA whose language is the language of self minus the language of other.
+        """
+        return self.product(other, lambda x, y: x and not y, minimize)
+
+    def symmetric_difference(self, other, minimize=False):
+        """
+        return a DFA whose language holds the inputs accepted by exactly one of self and other.
+        """
+        return self.product(other, lambda x, y: x != y, minimize)
+
+    @staticmethod
+    def union_all(dfas, minimize=True):
+        """
+        return a DFA whose language is the union of the languages of all the DFAs.
+        the DFAs are combined pairwise as a balanced tree, so the intermediate products stay small.
+        :param dfas:
+        :param minimize:
+        :return:
+        """
+        return DeterministicFiniteAutomaton._combine_all(dfas, DeterministicFiniteAutomaton.union, minimize)
+
+    @staticmethod
+    def intersection_all(dfas, minimize=True):
+        """
+        return a DFA whose language is the intersection of the languages of all the DFAs.
+        :param dfas:
+        :param minimize:
+        :return:
+        """
+        return DeterministicFiniteAutomaton._combine_all(dfas, DeterministicFiniteAutomaton.intersection, minimize)
+
+    @staticmethod
+    def _combine_all(dfas, operation, minimize):
+        dfas = list(dfas)
+        while len(dfas) > 1:
+            combined = [operation(dfas[i], dfas[i + 1], minimize) for i in range(0, len(dfas) - 1, 2)]
+            dfas = combined + dfas[len(dfas) - len(dfas) % 2:]
+        return dfas[0]
+
+    def renumbered(self):
+        """
+        return the same DFA with its states renamed to 0, 1, ... (the initial state is 0).
         :return:
         """
-        final_states = set([x for x in self.states if x not in self.final_states])
-        return DeterministicFiniteAutomaton(self.states,
-                                            self.alphabet,
-                                            self.transitions,
-                                            self.initial_state,
-                                            final_states)
+        return self.compiled().to_automaton(labels=False)
 
     def minimized(self):
         """
-        return the DFA with the minimized number of states
+        return the DFA with the minimized number of states.
+        the states are merged by Hopcroft's partition refinement on the compiled table, in O(n k log n).
+        every state of the result is the frozenset of the original states merged into it.
+        :return:
+        """
+        return self.compiled().minimized().to_automaton()
+
+    def minimized_by_table_filling(self):
+        """
+        return the DFA with the minimized number of states, computed by marking distinguishable pairs.
+        this is quadratic in space and much slower than minimized(); it is kept as a reference to check against.
+        it runs on the trimmed DFA, whose missing transitions go to an implicit dead state.
         :return:
         """
+        dfa = self.trimmed()
+        dead = object()  # the implicit dead state, left out of the result
+        all_states = set(dfa.states).union([dead])
+        expanded = dfa._expanded_transitions()
+
+        def target(p, s):
+            return dead if p is dead else expanded.get(p, {}).get(s, dead)
+
         marked = set()  # marked is a set of distinguishable pair of states
         unmarked = set()  # unmarked is a set of not-distinguishable pair of states
         checked = set()
-        for p in self.states:
-            for q in self.states:
+        for p in all_states:
+            for q in all_states:
                 if frozenset({p, q}) in checked or p == q:
                     continue
-                if (p in self.final_states and q not in self.final_states) or \
-                        (q in self.final_states and p not in self.final_states):
+                if (p in dfa.final_states and q not in dfa.final_states) or \
+                        (q in dfa.final_states and p not in dfa.final_states):
                     marked.add(frozenset({p, q}))
                 else:
                     unmarked.add(frozenset({p, q}))
@@ -112,8 +768,8 @@ class DeterministicFiniteAutomaton(Automaton):
         while flag:
             flag = False
             for p, q in unmarked:
-                for s in self.alphabet:
-                    if frozenset({self.transitions[p][s], self.transitions[q][s]}) in marked:
+                for s in dfa.alphabet:
+                    if frozenset({target(p, s), target(q, s)}) in marked:
                         flag = True
                         marked.add(frozenset({p, q}))
                         unmarked.remove(frozenset({p, q}))
@@ -122,10 +778,10 @@ class DeterministicFiniteAutomaton(Automaton):
                     break
 
         states_dict = {}
-        for p in self.states:
+        for p in all_states:
             states_dict[p] = {p}
-        for p in self.states:
-            for q in self.states:
+        for p in all_states:
+            for q in all_states:
                 if frozenset({p, q}) in unmarked:
                     states_dict[p].add(q)
                     states_dict[q].add(p)
@@ -134,190 +790,2243 @@ class DeterministicFiniteAutomaton(Automaton):
         initial_state = None
         final_states = set()
         transitions = {}
-        for p in self.states:
-            state = frozenset(states_dict[p])
+        for p in dfa.states:
+            if dead in states_dict[p] and dfa.initial_state not in states_dict[p]:
+                continue
+            state = frozenset(states_dict[p].difference([dead]))
             if state in states:
                 continue
             states.add(state)
             transitions[state] = {}
-            for s in self.alphabet:
-                transitions[state][s] = states_dict[self.transitions[next(iter(state))][s]]
-            if self.initial_state in state:
+            for s in dfa.alphabet:
+                next_state = target(next(iter(state)), s)
+                if dead not in states_dict[next_state]:
+                    transitions[state][s] = frozenset(states_dict[next_state])
+            if dfa.initial_state in state:
                 initial_state = state
-            if len(self.final_states.intersection(state)) != 0:
+            if len(dfa.final_states.intersection(state)) != 0:
                 final_states.add(state)
-        alphabet = self.alphabet
+        alphabet = dfa.alphabet
         return DeterministicFiniteAutomaton(states, alphabet, transitions, initial_state, final_states)
 
 
-class NonDeterministicFiniteAutomaton(Automaton):
+class SymbolRange(object):
     """
-    Non Deterministic Finite Automaton
+    transition label standing for every symbol of the alphabet from 'first' to 'last', both included.
+    it saves listing the symbols one by one over large alphabets:
+
+    >>> transitions = {0: {SymbolRange("a", "z"): 1, "_": 1}, 1: {SymbolRange("0", "9"): 1}}
+
+    ranges are expanded against the alphabet when the automaton is compiled. in a DFA, a symbol given by
+    itself wins over a range covering it; in an NFA, their targets are put together.
     """
 
-    def run(self, input_string):
+    __slots__ = ("first", "last")
+
+    def __init__(self, first, last):
+        self.first = first
+        self.last = last
+
+    def covered(self, alphabet, ordered=None):
         """
-        check whether the input is the language of this NFA.
-        :param input_string:
+        return the symbols of the alphabet in this range.
+        :param alphabet:
+        :param ordered: the alphabet sorted, to find the range by bisection (None when it cannot be sorted)
         :return:
         """
-        states = {self.initial_state}
-        for character in input_string:
-            if character not in self.alphabet:
-                print("ERROR: %s not in alphabet" % character)
-                return False
+        if ordered is not None:
+            return ordered[bisect_left(ordered, self.first):bisect_right(ordered, self.last)]
+        return [symbol for symbol in alphabet if symbol in self]
+
+    def __contains__(self, symbol):
+        try:
+            return self.first <= symbol <= self.last
+        except TypeError:
+            return False
+
+    def __eq__(self, other):
+        return isinstance(other, SymbolRange) and (self.first, self.last) == (other.first, other.last)
+
+    def __hash__(self):
+        return hash((SymbolRange, self.first, self.last))
+
+    def __repr__(self):
+        return "SymbolRange(%r, %r)" % (self.first, self.last)
+
+
+def _transition_rows(automaton, labels, deterministic):
+    """
+    return the transitions dict of each state in labels, with the SymbolRange labels expanded.
+    """
+    rows = [automaton.transitions.get(label, {}) for label in labels]
+    if not any(isinstance(symbol, SymbolRange) for row in rows for symbol in row):
+        return rows
+    try:
+        ordered = sorted(automaton.alphabet)
+    except TypeError:
+        ordered = None
+    expanded = []
+    for row in rows:
+        expanded_row = {}
+        for symbol, target in row.items():
+            if not isinstance(symbol, SymbolRange):
+                continue
+            for covered in symbol.covered(automaton.alphabet, ordered):
+                if deterministic:
+                    expanded_row[covered] = target
+                else:
+                    expanded_row.setdefault(covered, set()).update(target)
+        for symbol, target in row.items():
+            if isinstance(symbol, SymbolRange):
+                continue
+            if deterministic or symbol not in expanded_row:
+                expanded_row[symbol] = target
             else:
-                states = self.next_states(states, character)
-        return len(states.intersection(self.final_states)) != 0
+                expanded_row[symbol].update(target)
+        expanded.append(expanded_row)
+    return expanded
 
-    def next_states(self, states, character):
-        """
-        return set of next states.
-        :param states:
-        :param character:
-        :return: next_state:
-        """
-        next_states = set()
-        for state in states:
-            next_states = next_states.union(self.transitions[state].get(character, frozenset()))
-        return frozenset(next_states)
 
-    def convert_to_dfa(self):
-        """
-        convert self to equivalent DFA.
-        :return:
-        """
-        states = {frozenset({self.initial_state})}
-        transitions = {}
-        to_search = {frozenset({self.initial_state})}
-        searched = set()
-        while len(to_search) != 0:
-            searching = to_search.pop()
-            searched.add(searching)
-            for char in self.alphabet:
-                reachable_states = self.next_states(searching, char)
-                states.add(reachable_states)
-                if reachable_states not in searched:
-                    to_search.add(reachable_states)
-                if not transitions.get(searching):
-                    transitions[searching] = {}
-                transitions[searching][char] = frozenset(reachable_states)
-
-        final_states = set([x for x in states if len(self.final_states.intersection(x)) != 0])
-        initial_state = frozenset({self.initial_state})
-        alphabet = self.alphabet
-        return DeterministicFiniteAutomaton(states, alphabet, transitions, initial_state, final_states)
+def _partition(alphabet, rows):
+    """
+    return the classes of the symbols on which every row moves the same way, each as a list of symbols.
+    the classes are refined row by row: the symbols of a class which a row sends to different targets
+    (or only some of which it has) are split apart. this is linear in the number of transitions.
+    :param alphabet:
+    :param rows: transitions dict of each state
+    :return:
+    """
+    class_of = dict.fromkeys(alphabet, 0)
+    sizes = [len(class_of)]
+    for row in rows:
+        split = {}
+        for symbol, target in row.items():
+            if symbol in class_of:
+                if isinstance(target, (set, list)):
+                    target = frozenset(target)
+                split.setdefault((class_of[symbol], target), []).append(symbol)
+        for (old, _), symbols in split.items():
+            if len(symbols) == sizes[old]:
+                continue
+            sizes[old] -= len(symbols)
+            sizes.append(len(symbols))
+            for symbol in symbols:
+                class_of[symbol] = len(sizes) - 1
+    members = {}
+    for symbol in sorted(alphabet, key=repr):
+        members.setdefault(class_of[symbol], []).append(symbol)
+    return list(members.values())
 
 
-class NFAWithEpsTransition(Automaton):
+def _joint_classes(a, b, symbols):
     """
-    NFA with epsilon transition
+    return the classes of the symbols as seen by two compiled automata together.
+    :param a:
+    :param b:
+    :param symbols:
+    :return: list of ((class in a, class in b), symbols)
     """
+    joint = {}
+    for symbol in sorted(symbols, key=repr):
+        joint.setdefault((a.classes.get(symbol, a.unknown), b.classes.get(symbol, b.unknown)), []).append(symbol)
+    return list(joint.items())
 
-    def reachable_states_with_one_eps_from(self, state):
-        """
-        return a set of states which are reachable from input 'state' with one epsilon transition.
-        :param state:
-        :return:
-        """
-        return frozenset(self.transitions[state].get(-1, {}))
 
-    def reachable_states_with_multi_eps_from(self, state):
-        """
-        return a set of states which are reachable from input 'state' with multi epsilon transitions.
-        :param state:
-        :return:
-        """
-        ans = frozenset([state])
-        reachable_states = self.reachable_states_with_one_eps_from(state)
-        while not reachable_states.issubset(ans):
-            ans = ans.union(reachable_states)
-            new_reachable_states = frozenset()
-            for reachable_state in reachable_states:
-                new_reachable_states \
-                    = new_reachable_states.union(self.reachable_states_with_one_eps_from(reachable_state))
-            reachable_states = new_reachable_states
-        return ans
+# what a run may do with a symbol outside of the alphabet: reject the input, skip the symbol,
+# read it as the default symbol, or raise UnknownSymbolError
+UNKNOWN_POLICIES = ("reject", "skip", "default", "raise")
 
-    def next_states(self, states, character):
-        """
-        return a set of states which is the next state from 'states' when read 'character'
+
+class UnknownSymbolError(ValueError):
+    """
+    raised by a run under the "raise" policy when the input holds a symbol outside of the alphabet.
+    """
+
+    def __init__(self, symbol, position):
+        super().__init__("%r at position %d is not in the alphabet" % (symbol, position))
+        self.symbol = symbol  # None when the input cannot be indexed
+        self.position = position
+
+    def __reduce__(self):  # so that it comes back from a worker process
+        return type(self), (self.symbol, self.position)
+
+
+class _Compiled(object):
+    """
+    the base class of compiled automata: symbols are renumbered to integer classes.
+    symbols on which every state moves the same way share a class, so the tables have one column per
+    class instead of one per symbol. the last class is taken by every symbol outside of the alphabet,
+    and its column carries the unknown-symbol policy: it goes to the dead sink (reject and raise), back
+    to the same state (skip) or where the class of the default symbol goes (default).
+    compiled automata use __slots__ and flat arrays, and keep the original names of their states in a
+    side table ('labels'), so they are much smaller than the dicts of the Automaton classes.
+    """
+
+    __slots__ = ("members", "symbols", "classes", "width", "unknown", "on_unknown", "default_symbol",
+                 "default_class", "_str_map", "_byte_map")
+
+    def _init_classes(self, members, on_unknown="reject", default_symbol=None):
+        """
+        :param members: the symbols of each class, in the order of the class numbers
+        :param on_unknown: one of UNKNOWN_POLICIES
+        :param default_symbol: the symbol read instead of an unknown one under the "default" policy
+        """
+        members = [tuple(symbols) for symbols in members]
+        classes = dict((symbol, i) for i, symbols in enumerate(members) for symbol in symbols)
+        self.members = members  # class number -> original symbols
+        self.symbols = [symbols[0] for symbols in members]  # class number -> one of its symbols
+        self.classes = classes  # original symbol -> class number
+        self.width = len(members) + 1
+        self.unknown = self.width - 1  # class of symbols outside of the alphabet
+        self._str_map = _ClassMap(self.unknown)
+        for symbol, symbol_class in classes.items():
+            if isinstance(symbol, str) and len(symbol) == 1:
+                self._str_map[ord(symbol)] = chr(symbol_class)
+        # byte -> class, read as the character of the same code (latin-1) or else as the int
+        self._byte_map = [classes.get(chr(b), classes.get(b, self.unknown)) for b in range(256)]
+        if self.width <= 256:
+            self._byte_map = bytes(self._byte_map)
+
+        if on_unknown not in UNKNOWN_POLICIES:
+            raise ValueError("unknown-symbol policy %r is not one of %s" % (on_unknown, ", ".join(UNKNOWN_POLICIES)))
+        self.on_unknown = on_unknown
+        self.default_symbol = default_symbol
+        self.default_class = None
+        if on_unknown == "default":
+            if default_symbol not in classes:
+                raise ValueError("the default symbol %r is not in the alphabet" % (default_symbol,))
+            self.default_class = classes[default_symbol]
+
+    def classify(self, input_string):
+        """
+        translate the input into an iterable of symbol classes.
+        str and bytes inputs are translated in one pass of C code, other sequences symbol by symbol.
+        :param input_string:
+        :return:
+        """
+        if isinstance(input_string, str):
+            translated = input_string.translate(self._str_map)
+            classes = translated.encode("latin-1") if self.width <= 256 else list(map(ord, translated))
+        elif isinstance(input_string, (bytes, bytearray)):
+            if self.width <= 256:
+                classes = input_string.translate(self._byte_map)
+            else:
+                classes = list(map(self._byte_map.__getitem__, input_string))
+        else:
+            symbol_classes, unknown = self.classes, self.unknown
+            classes = [symbol_classes.get(character, unknown) for character in input_string]
+        if self.on_unknown == "raise" or _instrumentation is not None:
+            self._check_unknown(input_string, classes)
+        return classes
+
+    def _check_unknown(self, input_string, classes):
+        """
+        count the symbols outside of the alphabet in the classified input, and raise UnknownSymbolError
+        for the first of them under the "raise" policy. the classes are searched by C code.
+        :param input_string:
+        :param classes: the classes of the input, as returned by classify()
+        :return:
+        """
+        unknown = self.unknown
+        if unknown not in classes:
+            return
+        if _instrumentation is not None:
+            _instrumentation.count("unknown_symbols", classes.count(unknown))
+        if self.on_unknown == "raise":
+            position = classes.index(unknown)
+            try:
+                symbol = input_string[position]
+            except TypeError:
+                symbol = None
+            raise UnknownSymbolError(symbol, position)
+
+
+class CompiledDFA(_Compiled):
+    """
+    table-driven form of a DFA.
+    states are renumbered to dense integers (the initial state is 0) and symbols to integer classes.
+    the table holds one row of 'width' entries per state, and every entry is the premultiplied
+    offset (state * width) of the row of the next state, so one step of the DFA is a single index.
+    the last row is a dead sink, and the last class of every row is taken by symbols outside of the alphabet.
+    """
+
+    __slots__ = ("labels", "dead", "table", "accepting")
+
+    # binary format of save() and load(), little-endian:
+    # header, classes of symbols and unknown-symbol policy as UTF-8 JSON, padding to 8 bytes, table,
+    # one byte per state (1 when final). version 1 had the classes alone in the JSON.
+    format_version = 2
+    _magic = b"ADFA"
+    _header = struct.Struct("<4sHHIIQ")  # magic, version, table item size, width, rows, size of the JSON
+
+    def __init__(self, dfa):
+        labels = [dfa.initial_state] + [s for s in dfa.states if s != dfa.initial_state]
+        index = dict((label, i) for i, label in enumerate(labels))
+        rows = _transition_rows(dfa, labels, True)
+        self._init_classes(_partition(dfa.alphabet, rows), dfa.on_unknown, dfa.default_symbol)
+        classes = self.classes
+        width = self.width
+        dead = len(labels)
+
+        table = _table_array((dead + 1) * width, dead * width)
+        for i, row in enumerate(rows):
+            for symbol, target in row.items():
+                if symbol in classes and target in index:
+                    table[i * width + classes[symbol]] = index[target] * width
+
+        accepting = bytearray(dead + 1)
+        for label in dfa.final_states:
+            if label in index:
+                accepting[index[label]] = 1
+
+        self.labels = labels  # state number -> original state
+        self.dead = dead
+        self.table = table
+        self.accepting = accepting
+        self._fill_unknown()
+
+    @classmethod
+    def from_table(cls, members, table, accepting, labels, on_unknown="reject", default_symbol=None):
+        """
+        build a compiled DFA from its parts.
+        :param members: the symbols of each class, in the order of the class numbers
+        :param table: premultiplied transitions, with one more class for unknown symbols and a last dead row
+        :param accepting: bytearray with 1 for the final states, dead row included
+        :param labels: state number -> original state, dead row excluded
+        :param on_unknown: the unknown-symbol policy the table was built for (see _fill_unknown)
+        :param default_symbol:
+        :return:
+        """
+        compiled = cls.__new__(cls)
+        compiled._init_classes(members, on_unknown, default_symbol)
+        compiled.labels = labels
+        compiled.dead = len(labels)
+        compiled.table = table
+        compiled.accepting = accepting
+        return compiled
+
+    def __reduce__(self):
+        # a loaded DFA holds memoryviews of its file, which cannot be pickled: they are copied
+        table = self.table
+        if isinstance(table, memoryview):
+            table = array(table.format, table.tobytes())
+        return CompiledDFA.from_table, (self.members, table, bytearray(self.accepting), self.labels,
+                                        self.on_unknown, self.default_symbol)
+
+    def _fill_unknown(self):
+        """
+        write the column of unknown symbols of every row according to the unknown-symbol policy.
+        :return:
+        """
+        table, width, unknown = self.table, self.width, self.unknown
+        dead = self.dead * width
+        for row in range(0, len(self.accepting) * width, width):
+            if self.on_unknown == "skip":
+                table[row + unknown] = row
+            elif self.on_unknown == "default":
+                table[row + unknown] = table[row + self.default_class]
+            else:
+                table[row + unknown] = dead
+
+    def save(self, file):
+        """
+        write this DFA in the binary format read by load(). the labels of the states are not saved.
+        :param file: path, or binary file object
+        :return:
+        """
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "wb") as opened:
+                return self.save(opened)
+        for symbols in self.members:
+            for symbol in symbols:
+                if not isinstance(symbol, (str, int)) or isinstance(symbol, bool):
+                    raise ValueError("cannot save the symbol %r: only str and int symbols can be saved" % (symbol,))
+        alphabet = json.dumps({"classes": [list(symbols) for symbols in self.members], "on_unknown": self.on_unknown,
+                               "default_symbol": self.default_symbol}).encode("utf-8")
+        table = memoryview(self.table)
+        header = self._header.pack(self._magic, self.format_version, table.itemsize, self.width,
+                                   len(self.accepting), len(alphabet))
+        file.write(header)
+        file.write(alphabet)
+        file.write(bytes(-(len(header) + len(alphabet)) % 8))
+        file.write(table if sys.byteorder == "little" else _swapped(table))
+        file.write(bytes(self.accepting))
+
+    @classmethod
+    def load(cls, file):
+        """
+        read a DFA written by save(). a file is memory-mapped, and its table and final states are used in
+        place, without being copied or parsed: processes which load the same file share its pages.
+        the states are labelled by their numbers.
+        :param file: path, or bytes-like object holding the saved DFA (such as an mmap object)
+        :return:
+        """
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "rb") as opened:
+                return cls.load(mmap.mmap(opened.fileno(), 0, access=mmap.ACCESS_READ))
+        view = memoryview(file).cast("B")
+        if len(view) < cls._header.size:
+            raise ValueError("not a compiled DFA: too short")
+        magic, version, itemsize, width, rows, alphabet_size = cls._header.unpack_from(view)
+        if magic != cls._magic:
+            raise ValueError("not a compiled DFA: bad magic number")
+        if version not in (1, cls.format_version):
+            raise ValueError("unsupported format version %d (expected %d)" % (version, cls.format_version))
+        offset = cls._header.size
+        alphabet = json.loads(bytes(view[offset:offset + alphabet_size]).decode("utf-8"))
+        if version == 1:
+            alphabet = {"classes": alphabet, "on_unknown": "reject", "default_symbol": None}
+        members = alphabet["classes"]
+        offset += alphabet_size
+        offset += -offset % 8
+        table_size = rows * width * itemsize
+        if len(members) + 1 != width or len(view) != offset + table_size + rows:
+            raise ValueError("not a compiled DFA: bad size")
+        table = view[offset:offset + table_size].cast("i" if itemsize == 4 else "q")
+        if sys.byteorder != "little":
+            table = _swapped(table)
+        accepting = view[offset + table_size:]
+        return cls.from_table(members, table, accepting, range(rows - 1), alphabet["on_unknown"],
+                              alphabet["default_symbol"])
+
+    def to_automaton(self, labels=True):
+        """
+        return the DeterministicFiniteAutomaton of this table. transitions to the dead sink are left out.
+        :param labels: name the states by their labels (by their numbers when False)
+        :return:
+        """
+        names = self.labels if labels else range(self.dead)
+        width = self.width
+        dead = self.dead * width
+        transitions = {}
+        for q in range(self.dead):
+            row = q * width
+            transitions[names[q]] = dict((symbol, names[self.table[row + c] // width])
+                                         for c, symbols in enumerate(self.members) if self.table[row + c] != dead
+                                         for symbol in symbols)
+        final_states = [names[q] for q in range(self.dead) if self.accepting[q]]
+        dfa = DeterministicFiniteAutomaton(names, self.classes, transitions, names[0], final_states,
+                                           self.on_unknown, self.default_symbol)
+        dfa._cache["compiled"] = self
+        return dfa
+
+    def trimmed(self):
+        """
+        return the compiled DFA without its useless states: the states which cannot be reached from the
+        initial state, and those from which no final state can be reached. their rows are dropped and the
+        transitions to them go to the dead row, which stands for all of them. the initial state is always kept.
+        self is returned when every state is useful.
+        :return:
+        """
+        stats = _instrumentation
+        start = time.perf_counter() if stats is not None else None
+        width, table, dead = self.width, self.table, self.dead
+        reachable = bytearray(dead + 1)
+        reachable[0] = 1
+        predecessors = [[] for _ in range(dead + 1)]  # state -> reachable states moving to it
+        stack = [0]
+        while stack:
+            q = stack.pop()
+            row = q * width
+            for symbol_class in range(width):
+                target = table[row + symbol_class] // width
+                predecessors[target].append(q)
+                if not reachable[target]:
+                    reachable[target] = 1
+                    stack.append(target)
+
+        useful = bytearray(dead + 1)
+        stack = [q for q in range(dead) if reachable[q] and self.accepting[q]]
+        for q in stack:
+            useful[q] = 1
+        while stack:
+            for p in predecessors[stack.pop()]:
+                if not useful[p]:
+                    useful[p] = 1
+                    stack.append(p)
+        useful[0] = 1
+        kept = [q for q in range(dead) if useful[q]]
+        if len(kept) == dead:
+            return self
+
+        trimmed_dead = len(kept)
+        number = [trimmed_dead] * (dead + 1)  # state -> state of the result, the dead row for useless ones
+        for n, q in enumerate(kept):
+            number[q] = n
+        trimmed_table = _table_array((trimmed_dead + 1) * width, trimmed_dead * width)
+        accepting = bytearray(trimmed_dead + 1)
+        for n, q in enumerate(kept):
+            row = q * width
+            accepting[n] = self.accepting[q]
+            for symbol_class in range(width):
+                trimmed_table[n * width + symbol_class] = number[table[row + symbol_class] // width] * width
+        if stats is not None:
+            stats.finish("trim", start, states=dead, trimmed_states=trimmed_dead)
+        return CompiledDFA.from_table(self.members, trimmed_table, accepting, [self.labels[q] for q in kept],
+                                      self.on_unknown, self.default_symbol)
+
+    def minimized(self):
+        """
+        return the compiled DFA with the minimized number of states, by Hopcroft's partition refinement.
+        the useless states are trimmed first (see trimmed), so only the states which matter are refined.
+        each state is labelled by the frozenset of the original states merged into it.
+        :return:
+        """
+        stats = _instrumentation
+        start = time.perf_counter() if stats is not None else None
+        states = self.dead
+        self = self.trimmed()
+        blocks = self.equivalence_classes()
+        block_of = [0] * len(self.accepting)
+        for i, block in enumerate(blocks):
+            for q in block:
+                block_of[q] = i
+        # the blocks holding original states are numbered from the initial one; the sink alone gets the dead row
+        order = [block_of[0]] + [i for i, block in enumerate(blocks)
+                                 if i != block_of[0] and (len(block) > 1 or self.dead not in block)]
+        number = dict((b, n) for n, b in enumerate(order))
+        dead = len(order)
+        width = self.width
+        table = _table_array((dead + 1) * width, dead * width)
+        accepting = bytearray(dead + 1)
+        labels = []
+        for n, b in enumerate(order):
+            q = next(iter(blocks[b]))
+            labels.append(frozenset(self.labels[x] for x in blocks[b] if x != self.dead))
+            accepting[n] = self.accepting[q]
+            for c in range(self.unknown):
+                table[n * width + c] = number.get(block_of[self.table[q * width + c] // width], dead) * width
+        if stats is not None:
+            stats.finish("minimize", start, states=states, minimized_states=dead)
+        minimized = CompiledDFA.from_table(self.members, table, accepting, labels, self.on_unknown, self.default_symbol)
+        minimized._fill_unknown()
+        return minimized
+
+    def product(self, other, accept):
+        """
+        return the compiled product of two compiled DFAs, whose final states are chosen by 'accept'.
+        only the pairs of states reachable from the pair of initial states are built, each pair being
+        encoded as one integer. a symbol outside of the alphabet of one DFA sends it to its dead sink,
+        and the pair of dead sinks is the dead row of the result. both DFAs are trimmed first (see trimmed),
+        so that the pairs with a useless state are not built.
+        the classes of the result are the pairs of a class of self and a class of other which share a symbol,
+        and its unknown-symbol policy is the one of self.
+        each state is labelled by the pair of the original states (None for a dead sink).
+        :param other:
+        :param accept: function of (final in self, final in other) -> bool
+        :return:
+        """
+        self, other = self.trimmed(), other.trimmed()
+        joint = _joint_classes(self, other, set(self.classes).union(other.classes))
+        columns = [pair for pair, _ in joint]
+        width = len(joint) + 1
+        rows = len(other.accepting)
+        dead_pair = self.dead * rows + other.dead
+        ids = {0: 0}
+        pairs = [0]
+        successors = []
+        for pair in pairs:  # pairs grows while it is searched
+            p, q = divmod(pair, rows)
+            row_a, row_b = p * self.width, q * other.width
+            row = []
+            for class_a, class_b in columns:
+                target = self.table[row_a + class_a] // self.width * rows + other.table[row_b + class_b] // other.width
+                if target == dead_pair:
+                    row.append(-1)
+                    continue
+                target_state = ids.get(target)
+                if target_state is None:
+                    target_state = ids[target] = len(pairs)
+                    pairs.append(target)
+                row.append(target_state)
+            successors.append(row)
+
+        dead = len(pairs)
+        table = _table_array((dead + 1) * width, dead * width)
+        accepting = bytearray(dead + 1)
+        labels = []
+        for n, (pair, row) in enumerate(zip(pairs, successors)):
+            p, q = divmod(pair, rows)
+            labels.append((self.labels[p] if p != self.dead else None, other.labels[q] if q != other.dead else None))
+            accepting[n] = 1 if accept(self.accepting[p] == 1, other.accepting[q] == 1) else 0
+            for c, target in enumerate(row):
+                if target >= 0:
+                    table[n * width + c] = target * width
+        product = CompiledDFA.from_table([members for _, members in joint], table, accepting, labels,
+                                         self.on_unknown, self.default_symbol)
+        product._fill_unknown()
+        return product
+
+    start = 0
+
+    def step(self, state, symbol_class):
+        return self.table[state + symbol_class]
+
+    def advance(self, state, input_string):
+        """
+        return the state reached from 'state' by reading the input.
+        :param state: premultiplied row offset
+        :param input_string:
+        :return:
+        """
+        table = self.table
+        classes = self.classify(input_string)
+        if _instrumentation is not None:
+            _instrumentation.count("dfa.symbols", len(classes))
+        for symbol_class in classes:
+            state = table[state + symbol_class]
+        return state
+
+    def accepts(self, state):
+        return self.accepting[state // self.width] == 1
+
+    def run(self, input_string):
+        """
+        check whether the input is the language of the compiled DFA.
+        :param input_string:
+        :return:
+        """
+        if _instrumentation is not None:
+            _instrumentation.count("dfa.runs")
+        return self.accepts(self.advance(0, input_string))
+
+    def run_many(self, strings, lengths=None):
+        """
+        check whether each of the inputs is the language of the compiled DFA.
+        the inputs are sorted by length, and at every position one vectorized gather advances all of
+        the inputs which are not exhausted yet.
+        :param strings: sequence of inputs, or a NumPy array: 2-d of integer symbol codes with one input per row,
+        or 1-d of str or bytes
+        :param lengths: the length of each row when strings is a NumPy array of codes (default: the full row)
+        :return: NumPy array of bool (list of bool when NumPy is not installed)
+        """
+        if numpy is None:
+            return [self.run(input_string) for input_string in strings]
+        classes, starts, lengths = self._flat_classes(strings, lengths)
+        table = numpy.asarray(self.table, dtype=numpy.intp)
+        order = numpy.argsort(-lengths, kind="stable")
+        starts = starts[order]
+        # inputs still running at each position: they come first once sorted by decreasing length
+        active = numpy.searchsorted(-lengths[order], -numpy.arange(lengths.max(initial=0)), side="left")
+        states = numpy.zeros(len(order), dtype=numpy.intp)
+        for position, running in enumerate(active):
+            states[:running] = table[states[:running] + classes[starts[:running] + position]]
+        accepting = numpy.frombuffer(bytes(self.accepting), dtype=numpy.uint8)
+        accepted = numpy.empty(len(order), dtype=bool)
+        accepted[order] = accepting[states // self.width] == 1
+        return accepted
+
+    def _flat_classes(self, strings, lengths):
+        """
+        return the symbol classes of all the inputs laid end to end in one NumPy array,
+        together with the start offset and the length of every input.
+        :param strings:
+        :param lengths:
+        :return:
+        """
+        if isinstance(strings, numpy.ndarray):
+            if strings.dtype.kind in "US":  # fixed-width str or bytes: one row of code points or bytes per input
+                if strings.ndim != 1:
+                    raise TypeError("an array of str or bytes must have one dimension")
+                if lengths is None:
+                    lengths = numpy.char.str_len(strings)
+                code_type = numpy.uint32 if strings.dtype.kind == "U" else numpy.uint8
+                strings = numpy.ascontiguousarray(strings).view(code_type).reshape(len(strings), -1)
+            elif strings.dtype.kind not in "iu":
+                raise TypeError("cannot run an array of %s: use integer symbol codes, str or bytes" % strings.dtype)
+            codes = strings.astype(numpy.intp).reshape(len(strings), -1)
+            code_map = self._code_map()
+            outside = (codes < 0) | (codes >= len(code_map))
+            classes = numpy.where(outside, self.unknown, code_map[numpy.clip(codes, 0, len(code_map) - 1)])
+            if lengths is None:
+                lengths = numpy.full(len(codes), codes.shape[1], dtype=numpy.intp)
+            if self.on_unknown == "raise" or _instrumentation is not None:
+                read = numpy.arange(codes.shape[1]) < numpy.asarray(lengths)[:, None]
+                found = numpy.flatnonzero((classes == self.unknown) & read)
+                if _instrumentation is not None and len(found) != 0:
+                    _instrumentation.count("unknown_symbols", len(found))
+                if self.on_unknown == "raise" and len(found) != 0:
+                    raise UnknownSymbolError(int(codes.flat[found[0]]), int(found[0] % codes.shape[1]))
+            starts = numpy.arange(len(codes), dtype=numpy.intp) * codes.shape[1]
+            return classes.ravel(), starts, numpy.asarray(lengths, dtype=numpy.intp)
+
+        strings = list(strings)
+        lengths = numpy.fromiter(map(len, strings), dtype=numpy.intp, count=len(strings))
+        if all(isinstance(input_string, str) for input_string in strings):
+            classes = self.classify("".join(strings))  # one translate over the whole batch
+        elif all(isinstance(input_string, (bytes, bytearray)) for input_string in strings):
+            classes = self.classify(b"".join(strings))
+        else:
+            classes = [c for input_string in strings for c in self.classify(input_string)]
+        if isinstance(classes, bytes):
+            classes = numpy.frombuffer(classes, dtype=numpy.uint8)
+        else:
+            classes = numpy.fromiter(classes, dtype=numpy.intp, count=int(lengths.sum()))
+        return classes, numpy.cumsum(lengths) - lengths, lengths
+
+    def _code_map(self):
+        """
+        return the NumPy array sending every symbol code (byte or code point) to its class.
+        :return:
+        """
+        characters = [symbol for symbol in self.classes if isinstance(symbol, str) and len(symbol) == 1]
+        code_map = numpy.full(max([256] + [ord(c) + 1 for c in characters]), self.unknown, dtype=numpy.intp)
+        for symbol, symbol_class in self.classes.items():
+            if isinstance(symbol, int) and 0 <= symbol < 256:
+                code_map[symbol] = symbol_class
+        for symbol in characters:
+            code_map[ord(symbol)] = self.classes[symbol]
+        return code_map
+
+    def run_parallel(self, input_string, workers=None, min_chunk=1 << 16, mp_context=None):
+        """
+        check whether the input is the language of the compiled DFA, using several processes.
+        the input is cut into one chunk per worker, and each worker maps every state to the state it
+        reaches by reading its chunk (see transition_map). composing the maps in order from the
+        initial state gives the state at the end of the input.
+        with the fork start method the workers inherit the table and the input without copying them;
+        with the other ones (spawn, the default on macOS and Windows, and forkserver) the DFA is pickled
+        to every worker once, and every worker is sent its own chunk only.
+        :param input_string:
+        :param workers: number of processes (default: the number of CPUs)
+        :param min_chunk: shortest chunk worth a process; shorter inputs are run in this process
+        :param mp_context: multiprocessing context of the processes (default: the one of the start method)
+        :return:
+        """
+        classes = self.classify(input_string)
+        workers = min(workers or os.cpu_count() or 1, len(classes) // min_chunk)
+        if workers <= 1:
+            return self.accepts(self._walk(0, classes))
+        if not isinstance(classes, bytes):
+            classes = array("l", classes)
+        bounds = [len(classes) * i // workers for i in range(workers + 1)]
+        context = mp_context or multiprocessing.get_context()
+        if context.get_start_method() == "fork":
+            shared, chunks = classes, [None] * workers
+        else:
+            shared, chunks = None, [classes[start:end] for start, end in zip(bounds, bounds[1:])]
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_parallel_worker,
+                                 initargs=(self, shared)) as executor:
+            first = executor.submit(_parallel_walk, bounds[0], bounds[1], chunks[0])
+            maps = executor.map(_parallel_transition_map, bounds[1:-1], bounds[2:], chunks[1:])
+            state = first.result()
+            for transition_map in maps:
+                state = transition_map[state // self.width]
+        return self.accepts(state)
+
+    def _walk(self, state, classes):
+        table = self.table
+        for symbol_class in classes:
+            state = table[state + symbol_class]
+        return state
+
+    def transition_map(self, classes):
+        """
+        return the list of the states (as row offsets) reached from each state by reading the symbol classes.
+        the runs from all the states go through the classes block by block, and the runs which meet
+        at the end of a block are merged, so the work shrinks as the states synchronize.
+        the blocks grow geometrically, to spend little before the first merges and to merge seldom after.
+        :param classes: symbol classes, as returned by classify()
+        :return:
+        """
+        width = self.width
+        rows = len(self.accepting)
+        current = list(range(0, rows * width, width))
+        origins = [[q] for q in range(rows)]
+        position = 0
+        block = 32
+        while position < len(classes) and len(current) > 1:
+            symbol_classes = classes[position:position + block]
+            current = [self._walk(state, symbol_classes) for state in current]
+            position += block
+            block = min(2 * block, 1 << 16)
+            merged = {}
+            for state, group in zip(current, origins):
+                merged.setdefault(state, []).extend(group)
+            current = list(merged)
+            origins = list(merged.values())
+        if position < len(classes):
+            current = [self._walk(current[0], classes[position:])]
+        transition_map = [0] * rows
+        for state, group in zip(current, origins):
+            for q in group:
+                transition_map[q] = state
+        return transition_map
+
+    def equivalence_classes(self):
+        """
+        return the partition of the states (the dead sink included) into classes of equivalent states.
+        this is Hopcroft's partition refinement: a block is split by the predecessors of a splitter block,
+        and only the smaller half of a split block is queued as a new splitter.
+        :return: list of sets of state numbers
+        """
+        stats = _instrumentation
+        start = time.perf_counter() if stats is not None else None
+        n = len(self.accepting)
+        width = self.width
+        table = self.table
+        inverse = [{} for _ in range(self.unknown)]  # class -> target state -> source states
+        for q in range(n):
+            row = q * width
+            for symbol_class, predecessors in enumerate(inverse):
+                predecessors.setdefault(table[row + symbol_class] // width, []).append(q)
+
+        final = set(q for q in range(n) if self.accepting[q])
+        non_final = set(range(n)).difference(final)
+        blocks = [block for block in (final, non_final) if len(block) != 0]
+        block_of = [0] * n
+        for i, block in enumerate(blocks):
+            for q in block:
+                block_of[q] = i
+        if len(blocks) == 1:
+            return blocks
+
+        splitter = 0 if len(blocks[0]) <= len(blocks[1]) else 1
+        waiting = set((splitter, symbol_class) for symbol_class in range(self.unknown))
+        rounds = 0
+        while waiting:
+            rounds += 1
+            splitter, symbol_class = waiting.pop()
+            predecessors = inverse[symbol_class]
+            touched = {}
+            for q in blocks[splitter]:
+                for p in predecessors.get(q, ()):
+                    touched.setdefault(block_of[p], []).append(p)
+            for b, moved in touched.items():
+                block = blocks[b]
+                if len(moved) == len(block):
+                    continue
+                new_block = set(moved)
+                block.difference_update(new_block)
+                new = len(blocks)
+                blocks.append(new_block)
+                for p in moved:
+                    block_of[p] = new
+                for c in range(self.unknown):
+                    if (b, c) in waiting or len(new_block) <= len(block):
+                        waiting.add((new, c))
+                    else:
+                        waiting.add((b, c))
+        if stats is not None:
+            stats.finish("hopcroft", start, states=n, blocks=len(blocks), rounds=rounds)
+        return blocks
+
+
+# the DFA and the symbol classes of the input, set in each worker process of CompiledDFA.run_parallel
+_parallel_dfa = None
+_parallel_classes = None
+
+
+def _init_parallel_worker(dfa, classes):
+    """
+    :param classes: the whole input, inherited by fork, or None when every worker is sent its chunk
+    """
+    global _parallel_dfa, _parallel_classes
+    _parallel_dfa = dfa
+    _parallel_classes = None if classes is None else memoryview(classes)
+
+
+def _parallel_walk(start, end, chunk=None):
+    return _parallel_dfa._walk(0, _parallel_classes[start:end] if chunk is None else chunk)
+
+
+def _parallel_transition_map(start, end, chunk=None):
+    return _parallel_dfa.transition_map(_parallel_classes[start:end] if chunk is None else chunk)
+
+
+def _swapped(table):
+    """
+    return a copy of the table with the bytes of every item swapped, to read or write the little-endian format
+    on a big-endian machine.
+    """
+    swapped = array("i" if table.itemsize == 4 else "q", table)
+    swapped.byteswap()
+    return swapped
+
+
+def _canonical(value):
+    """
+    return a repr of the value which does not depend on the order of its sets and dicts.
+    """
+    if isinstance(value, dict):
+        return "{%s}" % ",".join(sorted("%s:%s" % (_canonical(k), _canonical(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return "{%s}" % ",".join(sorted(_canonical(v) for v in value))
+    if isinstance(value, (tuple, list)):
+        return "(%s)" % ",".join(_canonical(v) for v in value)
+    return repr(value)
+
+
+class DFACache(object):
+    """
+    on-disk cache of compiled DFAs, keyed by a hash of what they are built from.
+    every entry is a file written by CompiledDFA.save and memory-mapped by CompiledDFA.load, so the
+    processes which start from the same cache share its tables instead of each rebuilding them.
+    """
+
+    __slots__ = ("directory",)
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def path(self, key):
+        """
+        return the path of the entry of the key.
+        :param key: str
+        :return:
+        """
+        digest = hashlib.sha256(("%d:%s" % (CompiledDFA.format_version, key)).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".dfa")
+
+    def get(self, key, build):
+        """
+        return the compiled DFA cached under the key. the first time, it is built by build() and saved.
+        :param key: str naming what is built, e.g. a pattern and its alphabet
+        :param build: function returning a CompiledDFA
+        :return:
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            temporary = "%s.%d.tmp" % (path, os.getpid())
+            build().save(temporary)
+            os.replace(temporary, path)  # no process ever loads a partly written entry
+        return CompiledDFA.load(path)
+
+    def dfa(self, automaton, minimize=True):
+        """
+        return the compiled DFA of the automaton, determinized when it is not a DFA, through the cache.
+        the entry is keyed by automaton.fingerprint().
+        :param automaton:
+        :param minimize: minimize the DFA before it is saved
+        :return:
+        """
+        return self.get("%s:%s" % (automaton.fingerprint(), minimize), lambda: _compiled_dfa(automaton, minimize))
+
+
+def _compiled_dfa(automaton, minimize=True):
+    """
+    return the compiled DFA of the automaton, determinized when it is not a DFA.
+    """
+    compiled = automaton.compiled()
+    if isinstance(compiled, CompiledNFA):
+        compiled = compiled.determinized()
+    return compiled.minimized() if minimize else compiled
+
+
+class WordDFA(object):
+    """
+    minimal acyclic DFA of a set of words, updated in place when a word is added or removed
+    (the incremental construction of Daciuk et al. for unsorted words, after Carrasco and Forcada).
+    the states which hold the same language are found through a register keyed by their finality and
+    transitions. an update first clones the confluence states (those with several incoming transitions)
+    on the path of the word, so that the other words are not touched, then changes the path, and finally
+    merges the states of the path, deepest first, into the equivalent registered states.
+    an update costs time proportional to the length of the word; the DFA is minimal after every update.
+    the initial state is 0, and states removed by an update are reused by the next ones.
+    """
+
+    __slots__ = ("alphabet", "_transitions", "_final", "_indegree", "_register", "_free", "_size", "_compiled")
+
+    def __init__(self, words=(), alphabet=()):
+        """
+        :param words:
+        :param alphabet: symbols of the DFA besides those of its words
+        """
+        self.alphabet = set(alphabet)
+        self._transitions = [{}]  # state -> symbol -> state
+        self._final = bytearray(1)
+        self._indegree = [0]
+        self._register = {}  # (final, transitions) -> state, for every state but the initial one
+        self._free = []
+        self._size = 0
+        self._compiled = None
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, word):
+        state = self._walk(word)
+        return state is not None and self._final[state] == 1
+
+    run = __contains__
+
+    @property
+    def state_count(self):
+        """
+        the number of states of the DFA.
+        """
+        return len(self._transitions) - len(self._free)
+
+    def _walk(self, word):
+        state = 0
+        for symbol in word:
+            state = self._transitions[state].get(symbol)
+            if state is None:
+                return None
+        return state
+
+    def _signature(self, state):
+        return self._final[state], frozenset(self._transitions[state].items())
+
+    def _new_state(self):
+        if self._free:
+            state = self._free.pop()
+        else:
+            state = len(self._transitions)
+            self._transitions.append({})
+            self._final.append(0)
+            self._indegree.append(0)
+        return state
+
+    def _delete(self, state):
+        for target in self._transitions[state].values():
+            self._indegree[target] -= 1
+        self._transitions[state] = {}
+        self._final[state] = 0
+        self._indegree[state] = 0
+        self._free.append(state)
+
+    def _path(self, word):
+        """
+        return the states from the initial one along the longest prefix of the word in the DFA.
+        """
+        path = [0]
+        for symbol in word:
+            state = self._transitions[path[-1]].get(symbol)
+            if state is None:
+                break
+            path.append(state)
+        return path
+
+    def _detach(self, path, word):
+        """
+        take the states of the path out of the register, cloning the confluence states and the states after
+        them, so that the path belongs to the word alone and can be changed.
+        """
+        for i in range(1, len(path)):
+            state = path[i]
+            if self._indegree[state] == 1:
+                signature = self._signature(state)
+                if self._register.get(signature) == state:
+                    del self._register[signature]
+                continue
+            clone = self._new_state()
+            self._transitions[clone] = dict(self._transitions[state])
+            self._final[clone] = self._final[state]
+            for target in self._transitions[clone].values():
+                self._indegree[target] += 1
+            self._transitions[path[i - 1]][word[i - 1]] = clone
+            self._indegree[state] -= 1
+            self._indegree[clone] = 1
+            path[i] = clone
+
+    def _attach(self, path, word):
+        """
+        put the states of the path back into the register, deepest first, each one being merged into the
+        registered state with the same finality and transitions when there is one.
+        """
+        for i in range(len(path) - 1, 0, -1):
+            state = path[i]
+            signature = self._signature(state)
+            registered = self._register.setdefault(signature, state)
+            if registered != state:
+                self._transitions[path[i - 1]][word[i - 1]] = registered
+                self._indegree[registered] += 1
+                self._delete(state)
+
+    def add(self, word):
+        """
+        add a word (a str or a sequence of symbols) to the set.
+        :param word:
+        :return: True when the word was not in the set
+        """
+        path = self._path(word)
+        if len(path) == len(word) + 1 and self._final[path[-1]]:
+            return False
+        self._detach(path, word)
+        for symbol in word[len(path) - 1:]:
+            state = self._new_state()
+            self._transitions[path[-1]][symbol] = state
+            self._indegree[state] = 1
+            path.append(state)
+        self._final[path[-1]] = 1
+        self._attach(path, word)
+        self.alphabet.update(word)
+        self._size += 1
+        self._compiled = None
+        return True
+
+    def remove(self, word):
+        """
+        remove a word from the set. the states which led to it alone are deleted.
+        :param word:
+        :return: True when the word was in the set
+        """
+        path = self._path(word)
+        if len(path) != len(word) + 1 or not self._final[path[-1]]:
+            return False
+        self._detach(path, word)
+        self._final[path[-1]] = 0
+        while len(path) > 1 and not self._final[path[-1]] and not self._transitions[path[-1]]:
+            state = path.pop()
+            del self._transitions[path[-1]][word[len(path) - 1]]
+            self._delete(state)
+        self._attach(path, word)
+        self._size -= 1
+        self._compiled = None
+        return True
+
+    def compiled(self):
+        """
+        return the CompiledDFA of the current set. it is built once per update, when first needed.
+        :return:
+        """
+        if self._compiled is None:
+            self._compiled = CompiledDFA(self.to_automaton())
+        return self._compiled
+
+    def to_automaton(self):
+        """
+        return the DeterministicFiniteAutomaton of the current set; its states are those of this DFA.
+        :return:
+        """
+        free = set(self._free)
+        states = [q for q in range(len(self._transitions)) if q not in free]
+        transitions = dict((q, dict(self._transitions[q])) for q in states)
+        final_states = [q for q in states if self._final[q]]
+        return DeterministicFiniteAutomaton(states, self.alphabet, transitions, 0, final_states)
+
+
+class PatternSet(object):
+    """
+    union of a changing set of automata (DFAs, NFAs or eps-NFAs), each added and removed under a key.
+    the automata, determinized and minimized, are the leaves of a balanced binary tree, and every node
+    holds the minimized product DFA of the union of its two children. adding or removing an automaton
+    rebuilds the nodes above its leaf only, log n unions instead of n.
+    """
+
+    __slots__ = ("_leaves", "_free", "_tree")
+
+    def __init__(self, automata=None):
+        """
+        :param automata: dict from key to automaton
+        """
+        self._leaves = {}  # key -> leaf
+        self._free = [1]
+        self._tree = [None, None]  # node i has the children 2i and 2i + 1; the leaves are the second half
+        for key, automaton in (automata or {}).items():
+            self.add(key, automaton)
+
+    def __len__(self):
+        return len(self._leaves)
+
+    def __contains__(self, key):
+        return key in self._leaves
+
+    def add(self, key, automaton):
+        """
+        add the automaton under the key, in place of the automaton already there if any.
+        :param key:
+        :param automaton:
+        :return:
+        """
+        leaf = self._leaves.get(key)
+        if leaf is None:
+            if not self._free:
+                self._grow()
+            leaf = self._leaves[key] = self._free.pop()
+        self._tree[leaf] = _unlabelled(_compiled_dfa(automaton))
+        self._update(leaf)
+
+    def remove(self, key):
+        """
+        remove the automaton of the key.
+        :param key:
+        :return:
+        """
+        leaf = self._leaves.pop(key)
+        self._tree[leaf] = None
+        self._free.append(leaf)
+        self._update(leaf)
+
+    def _grow(self):
+        """
+        double the number of leaves. the old tree becomes the left half of the new one, unchanged.
+        """
+        capacity = len(self._tree) // 2
+        tree = [None] * (4 * capacity)
+        for i in range(1, 2 * capacity):
+            tree[i + (1 << (i.bit_length() - 1))] = self._tree[i]
+        self._tree = tree
+        self._leaves = dict((key, leaf + capacity) for key, leaf in self._leaves.items())
+        self._free = [leaf + capacity for leaf in self._free]
+        self._free.extend(range(4 * capacity - 1, 3 * capacity - 1, -1))
+
+    def _update(self, leaf):
+        tree = self._tree
+        i = leaf // 2
+        while i >= 1:
+            left, right = tree[2 * i], tree[2 * i + 1]
+            if left is None or right is None:
+                tree[i] = right if left is None else left
+            else:
+                tree[i] = _unlabelled(left.product(right, lambda x, y: x or y).minimized())
+            i //= 2
+
+    def compiled(self):
+        """
+        return the minimized CompiledDFA of the union, None when the set is empty.
+        :return:
+        """
+        return self._tree[1]
+
+    def run(self, input_string):
+        """
+        check whether the input is the language of one of the automata.
+        :param input_string:
+        :return:
+        """
+        compiled = self._tree[1]
+        return compiled is not None and compiled.run(input_string)
+
+
+def _unlabelled(compiled):
+    """
+    return the compiled DFA with its states labelled by their numbers, so that the labels of nested
+    products and minimizations do not pile up.
+    """
+    return CompiledDFA.from_table(compiled.members, compiled.table, compiled.accepting, range(compiled.dead),
+                                  compiled.on_unknown, compiled.default_symbol)
+
+
+def _table_array(size, fill):
+    """
+    return an array of 'size' integers set to 'fill', of 4-byte integers when the values fit.
+    """
+    return array("i" if size < 1 << 31 else "l", [fill]) * size
+
+
+class DeterminizationAborted(Exception):
+    """
+    raised when a subset construction goes over its limit of states or of time.
+    """
+
+    def __init__(self, message, states):
+        super().__init__(message)
+        self.message = message
+        self.states = states  # number of DFA states built so far
+
+    def __reduce__(self):
+        return type(self), (self.message, self.states)
+
+
+class LanguageCheck(object):
+    """
+    result of a language check (is_empty, is_equivalent, is_subset_of).
+    it is true when the property holds; otherwise 'counterexample' is an input which shows that it does not.
+    """
+
+    __slots__ = ("holds", "counterexample")
+
+    def __init__(self, holds, counterexample=None):
+        self.holds = holds
+        self.counterexample = counterexample
+
+    def __bool__(self):
+        return self.holds
+
+    def __repr__(self):
+        if self.holds:
+            return "LanguageCheck(True)"
+        return "LanguageCheck(False, counterexample=%r)" % (self.counterexample,)
+
+
+def _bits(mask):
+    """
+    yield the positions of the bits set in mask.
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _path(searched, i):
+    """
+    return the symbols on the way to entry i of a search whose entries end with (previous entry, symbol).
+    """
+    word = []
+    while searched[i][-2] != -1:
+        word.append(searched[i][-1])
+        i = searched[i][-2]
+    return word[::-1]
+
+
+def _word(symbols):
+    """
+    return the symbols as a str when they are all str, as a tuple otherwise.
+    """
+    if all(isinstance(symbol, str) for symbol in symbols):
+        return "".join(symbols)
+    return tuple(symbols)
+
+
+class _ClassMap(dict):
+    """
+    str.translate table which sends every character missing from it to the unknown class.
+    """
+
+    def __init__(self, unknown):
+        super().__init__()
+        self.unknown = chr(unknown)
+
+    def __missing__(self, key):
+        return self.unknown
+
+
+class CompiledNFA(_Compiled):
+    """
+    bitset form of an NFA, with or without epsilon transitions.
+    states are renumbered to bit positions, and a set of states is the integer whose bits are its members.
+    the transitions are kept in CSR arrays: the targets of state q on class c are
+    targets[offsets[q * width + c]:offsets[q * width + c + 1]], and the epsilon closures likewise.
+    successors[q * width + c] is the set of states reachable from q by reading a symbol of class c,
+    epsilon closures included, so one step of the NFA is an OR over the active states.
+    for large NFAs, whose bitsets are large too, they are built from the arrays the first time they are needed.
+    """
+
+    # largest NFA whose successor bitsets are all built up front
+    eager_states = 1024
+
+    __slots__ = ("labels", "offsets", "targets", "closure_offsets", "closure_targets",
+                 "successors", "initial", "final")
+
+    def __init__(self, automaton, closures=None):
+        """
+        :param automaton:
+        :param closures: dict from each state to its epsilon closure (None when there is no epsilon transition)
+        """
+        labels = [automaton.initial_state] + [s for s in automaton.states if s != automaton.initial_state]
+        index = dict((label, i) for i, label in enumerate(labels))
+        deterministic = isinstance(automaton, DeterministicFiniteAutomaton)
+        rows = _transition_rows(automaton, labels, deterministic)
+        self._init_classes(_partition(automaton.alphabet, rows), automaton.on_unknown, automaton.default_symbol)
+
+        offsets = array("l", [0])
+        targets = array("i")
+        for q, trans_dict in enumerate(rows):
+            for symbol in self.symbols:
+                if symbol in trans_dict:
+                    states = (trans_dict[symbol],) if deterministic else trans_dict[symbol]
+                    targets.extend(index[state] for state in states if state in index)
+                offsets.append(len(targets))
+            # unknown symbols: no transition, unless they are skipped or read as the default symbol
+            if self.on_unknown == "skip":
+                targets.append(q)
+            elif self.on_unknown == "default":
+                default = q * self.width + self.default_class
+                targets.extend(targets[offsets[default]:offsets[default + 1]])
+            offsets.append(len(targets))
+
+        self.closure_offsets = None
+        self.closure_targets = None
+        if closures:
+            self.closure_offsets = array("l", [0])
+            self.closure_targets = array("i")
+            for label in labels:
+                self.closure_targets.extend(index[state] for state in closures[label] if state in index)
+                self.closure_offsets.append(len(self.closure_targets))
+
+        self.labels = labels  # bit position -> original state
+        self.offsets = offsets
+        self.targets = targets
+        if len(labels) <= self.eager_states:
+            self.successors = [self.mask_of(self.successor_states(i)) for i in range(len(offsets) - 1)]
+        else:
+            self.successors = _SuccessorSets(self)
+        self.initial = self.mask_of(self.closure(0))
+        self.final = self.mask_of(index[state] for state in automaton.final_states if state in index)
+
+    def mask_of(self, positions):
+        """
+        return the bitset of the state positions.
+        :param positions:
+        :return:
+        """
+        bits = bytearray((len(self.labels) + 7) // 8)
+        for i in positions:
+            bits[i >> 3] |= 1 << (i & 7)
+        return int.from_bytes(bits, "little")
+
+    def closure(self, q):
+        """
+        return the positions of the states in the epsilon closure of state q.
+        :param q:
+        :return:
+        """
+        if self.closure_offsets is None:
+            return (q,)
+        return self.closure_targets[self.closure_offsets[q]:self.closure_offsets[q + 1]]
+
+    def successor_states(self, i):
+        """
+        yield the positions of the states in successors[i], maybe more than once.
+        :param i: q * width + c
+        :return:
+        """
+        for target in self.targets[self.offsets[i]:self.offsets[i + 1]]:
+            yield from self.closure(target)
+
+    def states_of(self, mask):
+        """
+        return the original states whose bits are set in mask.
+        :param mask:
+        :return:
+        """
+        labels = self.labels
+        return frozenset(labels[i] for i in _bits(mask))
+
+    def shortest_accepted(self):
+        """
+        return one of the shortest inputs (as a list of symbols) which reach a final state, or None.
+        the states are searched one by one, breadth first, so this is linear in the size of the NFA.
+        :return:
+        """
+        searched = dict((p, (-1, None)) for p in _bits(self.initial))  # state -> (previous state, symbol)
+        queue = deque(searched)
+        while queue:
+            p = queue.popleft()
+            if self.final >> p & 1:
+                word = []
+                while searched[p][0] != -1:
+                    p, symbol = searched[p]
+                    word.append(symbol)
+                return word[::-1]
+            for symbol_class, symbol in enumerate(self.symbols):
+                for q in self.successor_states(p * self.width + symbol_class):
+                    if q not in searched:
+                        searched[q] = (p, symbol)
+                        queue.append(q)
+        return None
+
+    def determinized(self, max_states=None, timeout=None):
+        """
+        return the CompiledDFA of the subset construction of this NFA.
+        every subset is a bitset, numbered the first time it is reached, and the subsets are expanded
+        once each in the order of their numbers, so the list of subsets is also the worklist.
+        the rows are written straight into the premultiplied table of the DFA. the empty subset is not a
+        state: the transitions to it go to the dead row.
+        every state is labelled by the frozenset of the original states in its subset.
+        :param max_states: raise DeterminizationAborted when the DFA gets more states (default: no limit)
+        :param timeout: raise DeterminizationAborted after this many seconds (default: no limit)
+        :return:
+        """
+        successors, width, unknown = self.successors, self.width, self.unknown
+        deadline = None if timeout is None else time.monotonic() + timeout
+        stats = _instrumentation
+        start = time.perf_counter() if stats is not None else None
+        ids = {self.initial: 0}
+        subsets = [self.initial]
+        labels = []
+        table = array("l")
+        for states in subsets:  # subsets grows while it is searched
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeterminizationAborted("subset construction timed out", len(subsets))
+            if stats is not None and len(labels) % stats.progress_interval == 0 and labels:
+                stats.event("determinize.progress", dfa_states=len(subsets), done=len(labels),
+                            seconds=time.perf_counter() - start)
+            positions = list(_bits(states))
+            labels.append(frozenset([self.labels[q] for q in positions]))
+            rows = [q * width for q in positions]
+            for symbol_class in range(unknown):
+                next_states = 0
+                for row in rows:
+                    next_states |= successors[row + symbol_class]
+                if not next_states:
+                    table.append(-1)  # the empty subset, sent to the dead row below
+                    continue
+                target = ids.get(next_states)
+                if target is None:
+                    target = ids[next_states] = len(subsets)
+                    if max_states is not None and target >= max_states:
+                        raise DeterminizationAborted("more than %d DFA states" % max_states, len(subsets))
+                    subsets.append(next_states)
+                table.append(target * width)
+            table.append(-1)  # unknown symbols, filled in by the policy below
+
+        dead = len(subsets)
+        table = array("l", [dead * width if target < 0 else target for target in table])
+        table.extend([dead * width] * width)
+        if len(table) < 1 << 31:
+            table = array("i", table)
+        accepting = bytearray(dead + 1)
+        for n, states in enumerate(subsets):
+            accepting[n] = states & self.final != 0
+        if stats is not None:
+            stats.finish("determinize", start, nfa_states=len(self.labels), dfa_states=dead, classes=unknown)
+        dfa = CompiledDFA.from_table(self.members, table, accepting, labels, self.on_unknown, self.default_symbol)
+        dfa._fill_unknown()
+        return dfa
+
+    def step(self, states, symbol_class):
+        """
+        return the set of states reached from 'states' by reading a symbol of the class.
+        :param states: bitset
+        :param symbol_class:
+        :return: bitset
+        """
+        successors, width = self.successors, self.width
+        next_states = 0
+        while states:
+            low = states & -states
+            next_states |= successors[(low.bit_length() - 1) * width + symbol_class]
+            states ^= low
+        return next_states
+
+    @property
+    def start(self):
+        return self.initial
+
+    def advance(self, states, input_string):
+        """
+        return the set of states reached from 'states' by reading the input.
+        :param states: bitset
+        :param input_string:
+        :return: bitset
+        """
+        if _instrumentation is not None:
+            return self._advance_counted(states, input_string, _instrumentation)
+        successors, width = self.successors, self.width
+        for symbol_class in self.classify(input_string):
+            next_states = 0
+            while states:
+                low = states & -states
+                next_states |= successors[(low.bit_length() - 1) * width + symbol_class]
+                states ^= low
+            if not next_states:
+                return 0
+            states = next_states
+        return states
+
+    def _advance_counted(self, states, input_string, stats):
+        """
+        advance(), counting the symbols read and the states active before each of them.
+        """
+        classes = self.classify(input_string)
+        active = 0
+        most = 0
+        for read, symbol_class in enumerate(classes):
+            count = bin(states).count("1")
+            active += count
+            most = max(most, count)
+            states = self.step(states, symbol_class)
+            if not states:
+                classes = classes[:read + 1]
+                break
+        stats.count("nfa.symbols", len(classes))
+        stats.count("nfa.active_states", active)
+        stats.maximum("nfa.active_states", most)
+        return states
+
+    def accepts(self, states):
+        return states & self.final != 0
+
+    def run(self, input_string):
+        """
+        check whether the input is the language of the compiled NFA.
+        :param input_string:
+        :return:
+        """
+        if _instrumentation is not None:
+            _instrumentation.count("nfa.runs")
+        return self.accepts(self.advance(self.initial, input_string))
+
+
+class _SuccessorSets(dict):
+    """
+    CompiledNFA.successors: the bitsets of successors, built from the CSR arrays when first looked up.
+    """
+
+    __slots__ = ("nfa",)
+
+    def __init__(self, nfa):
+        super().__init__()
+        self.nfa = nfa
+
+    def __missing__(self, i):
+        mask = self[i] = self.nfa.mask_of(self.nfa.successor_states(i))
+        return mask
+
+
+class LazyDFA(object):
+    """
+    DFA built on the fly from an NFA, in the way of RE2.
+    a DFA state is a bitset of NFA states, and it is only created when some input reaches it.
+    the DFA states live in a cache of bounded size: when it is full it is cleared and refilled from the
+    current state on. a run which still clears the cache too often finishes as a plain NFA simulation.
+    """
+
+    __slots__ = ("nfa", "max_states", "max_flushes_per_run", "steps", "misses", "flushes", "fallbacks",
+                 "_ids", "_sets", "_table", "_accepting")
+
+    # estimated bytes held by one cached DFA state besides its row of transitions
+    state_overhead = 200
+
+    def __init__(self, automaton, max_memory=1 << 22, max_flushes_per_run=3):
+        """
+        :param automaton: NFA, eps-NFA or their CompiledNFA
+        :param max_memory: budget of the state cache in bytes
+        :param max_flushes_per_run: number of cache clears a run may cause before it falls back to NFA simulation
+        """
+        self.nfa = automaton if isinstance(automaton, CompiledNFA) else automaton.compiled()
+        state_size = self.state_overhead + 8 * self.nfa.width + len(self.nfa.labels) // 8
+        self.max_states = max(3, max_memory // state_size)
+        self.max_flushes_per_run = max_flushes_per_run
+        self.steps = 0
+        self.misses = 0
+        self.flushes = 0
+        self.fallbacks = 0
+        self._clear()
+
+    def _clear(self):
+        self._ids = {}  # bitset -> DFA state
+        self._sets = []  # DFA state -> bitset
+        self._table = []  # DFA state * width + class -> DFA state, -1 while unknown
+        self._accepting = []
+        self._intern(0)  # the dead state is 0
+        self._intern(self.nfa.initial)  # the start state is 1
+        self._table[:self.nfa.width] = [0] * self.nfa.width
+
+    def _intern(self, states):
+        state = self._ids.get(states)
+        if state is None:
+            state = self._ids[states] = len(self._sets)
+            self._sets.append(states)
+            self._table.extend([-1] * self.nfa.width)
+            self._accepting.append(states & self.nfa.final != 0)
+        return state
+
+    def _flush(self):
+        self.flushes += 1
+        if _instrumentation is not None:
+            _instrumentation.count("lazy_dfa.flushes")
+            _instrumentation.event("lazy_dfa.flush", states=len(self._sets))
+        self._clear()
+
+    @property
+    def hits(self):
+        return self.steps - self.misses
+
+    def stats(self):
+        """
+        return the counters of the state cache.
+        :return:
+        """
+        return {"hits": self.hits, "misses": self.misses, "flushes": self.flushes,
+                "fallbacks": self.fallbacks, "states": len(self._sets), "max_states": self.max_states}
+
+    @property
+    def start(self):
+        return self.nfa.initial
+
+    def _enter(self, states):
+        """
+        return the DFA state of a bitset, making room in the cache for it when needed.
+        :param states:
+        :return:
+        """
+        if states not in self._ids and len(self._sets) >= self.max_states:
+            self._flush()
+        return self._intern(states)
+
+    def _miss(self, state, symbol_class):
+        """
+        compute the transition of a DFA state which is not in the cache yet.
+        when the target is a new state and the cache is full, the cache is cleared first, and the returned
+        state belongs to the new cache.
+        :param state:
+        :param symbol_class:
+        :return:
+        """
+        self.misses += 1
+        if _instrumentation is not None:
+            _instrumentation.count("lazy_dfa.misses")
+        next_states = self.nfa.step(self._sets[state], symbol_class)
+        if next_states not in self._ids and len(self._sets) >= self.max_states:
+            self._flush()
+            return self._intern(next_states)
+        target = self._table[state * self.nfa.width + symbol_class] = self._intern(next_states)
+        return target
+
+    def advance(self, states, input_string):
+        """
+        return the set of NFA states reached from 'states' by reading the input.
+        :param states: bitset
+        :param input_string:
+        :return: bitset
+        """
+        nfa = self.nfa
+        width = nfa.width
+        classes = nfa.classify(input_string)
+        self.steps += len(classes)
+        if _instrumentation is not None:
+            _instrumentation.count("lazy_dfa.symbols", len(classes))
+        state = self._enter(states)
+        table = self._table
+        flushes = 0
+        symbol_classes = iter(classes)
+        for symbol_class in symbol_classes:
+            target = table[state * width + symbol_class]
+            if target < 0:
+                target = self._miss(state, symbol_class)
+                if table is not self._table:  # the cache was cleared
+                    table = self._table
+                    flushes += 1
+                    if flushes > self.max_flushes_per_run:
+                        self.fallbacks += 1
+                        states = self._sets[target]
+                        for symbol_class in symbol_classes:
+                            self.misses += 1
+                            states = nfa.step(states, symbol_class)
+                        return states
+            state = target
+        return self._sets[state]
+
+    def scan(self, input_string, states=None):
+        """
+        yield (offset, bitset) for every prefix of the input, the empty one included, after which
+        the NFA is in a final state. offset is the length of the prefix.
+        :param input_string:
+        :param states: bitset to start from (default: the initial states)
+        :return:
+        """
+        nfa = self.nfa
+        width = nfa.width
+        final = nfa.final
+        if states is None:
+            states = nfa.initial
+        if states & final:
+            yield 0, states
+        classes = nfa.classify(input_string)
+        self.steps += len(classes)
+        state = self._enter(states)
+        table = self._table
+        accepting = self._accepting
+        flushes = 0
+        symbol_classes = enumerate(classes, 1)
+        for offset, symbol_class in symbol_classes:
+            target = table[state * width + symbol_class]
+            if target < 0:
+                target = self._miss(state, symbol_class)
+                if table is not self._table:  # the cache was cleared
+                    table = self._table
+                    accepting = self._accepting
+                    flushes += 1
+                    if flushes > self.max_flushes_per_run:
+                        self.fallbacks += 1
+                        states = self._sets[target]
+                        if states & final:
+                            yield offset, states
+                        for offset, symbol_class in symbol_classes:
+                            self.misses += 1
+                            states = nfa.step(states, symbol_class)
+                            if states & final:
+                                yield offset, states
+                        return
+            state = target
+            if accepting[state]:
+                yield offset, self._sets[state]
+
+    def accepts(self, states):
+        return states & self.nfa.final != 0
+
+    def run(self, input_string):
+        """
+        check whether the input is the language of the NFA.
+        :param input_string:
+        :return:
+        """
+        return self.accepts(self.advance(self.nfa.initial, input_string))
+
+    def matcher(self):
+        """
+        return a Matcher which runs this lazy DFA over input given in chunks.
+        :return:
+        """
+        return Matcher(self)
+
+    def run_many(self, strings):
+        """
+        check whether each of the inputs is the language of the NFA.
+        :param strings:
+        :return: list of bool
+        """
+        return [self.run(input_string) for input_string in strings]
+
+
+# the symbol which the symbols outside of the alphabets of the patterns of a Searcher are read as:
+# only its start state moves on it
+_OTHER = object()
+
+
+class Searcher(object):
+    """
+    finds every occurrence of a set of patterns in a text, in one pass.
+    the patterns are put side by side in one eps-NFA whose start state loops on every symbol (a prefix of
+    Sigma*), so a match ending at any offset is found without restarting, and that NFA runs as a LazyDFA.
+    a symbol of the text outside of the alphabets of the patterns ends the matches going on, but not the search.
+    a match is reported by its end offset, the length of the text up to and including its last symbol, and
+    on request by its start offset: the reversed pattern is run back from the end offset to the leftmost
+    start of the matches ending there. that costs the length of the longest such match for each match.
+    """
+
+    __slots__ = ("patterns", "pattern_finals", "lazy", "_matched", "_reversed")
+
+    def __init__(self, patterns, max_memory=1 << 22):
+        """
+        :param patterns: DFAs, NFAs or eps-NFAs
+        :param max_memory: budget of the lazy DFA state cache in bytes
+        """
+        patterns = self.patterns = list(patterns)
+        start = None
+        alphabet = set()
+        states = {start}
+        transitions = {start: {-1: set()}}
+        final_states = set()
+        for i, pattern in enumerate(patterns):
+            alphabet.update(pattern.alphabet)
+            states.update((i, state) for state in pattern.states)
+            transitions.update(_renamed_transitions(i, pattern))
+            transitions[start][-1].add((i, pattern.initial_state))
+            final_states.update((i, state) for state in pattern.final_states)
+        alphabet.add(_OTHER)
+        for character in alphabet:
+            transitions[start][character] = {start}
+        nfa = NFAWithEpsTransition(states, alphabet, transitions, start, final_states, "default", _OTHER).compiled()
+
+        index = dict((label, i) for i, label in enumerate(nfa.labels))
+        self.pattern_finals = []  # pattern -> bitset of its final states
+        for i, pattern in enumerate(patterns):
+            mask = 0
+            for state in pattern.final_states:
+                if (i, state) in index:
+                    mask |= 1 << index[(i, state)]
+            self.pattern_finals.append(mask)
+        self.lazy = LazyDFA(nfa, max_memory)
+        self._matched = {}  # bitset -> patterns whose final states it holds
+        self._reversed = {}  # pattern -> compiled reversed pattern, built for the first start offset
+
+    def _patterns_in(self, states):
+        matched = self._matched.get(states)
+        if matched is None:
+            matched = self._matched[states] = tuple(i for i, mask in enumerate(self.pattern_finals) if states & mask)
+        return matched
+
+    def _start(self, pattern, text, end, classes):
+        """
+        return the leftmost start offset of the matches of the pattern which end at 'end'.
+        :param pattern: pattern index
+        :param text:
+        :param end: end offset of a match of the pattern
+        :param classes: dict of pattern -> the text classified for its reversed pattern, filled on demand
+        :return:
+        """
+        nfa = self._reversed.get(pattern)
+        if nfa is None:
+            nfa = self._reversed[pattern] = _reversed_automaton(self.patterns[pattern]).compiled()
+        symbol_classes = classes.get(pattern)
+        if symbol_classes is None:
+            symbol_classes = classes[pattern] = nfa.classify(text)
+        states = nfa.initial
+        start = end
+        position = end
+        while states and position > 0:
+            position -= 1
+            states = nfa.step(states, symbol_classes[position])
+            if states & nfa.final:
+                start = position
+        return start
+
+    def finditer(self, text, starts=False):
+        """
+        yield (end offset, pattern index) for every match in the text, in the order of the end offsets.
+        :param text: str, bytes or sequence of symbols
+        :param starts: yield (start offset, end offset, pattern index) instead, with the leftmost start of
+        the matches of the pattern ending there
+        :return:
+        """
+        classes = {}
+        for offset, states in self.lazy.scan(text):
+            for pattern in self._patterns_in(states):
+                if starts:
+                    yield self._start(pattern, text, offset, classes), offset, pattern
+                else:
+                    yield offset, pattern
+
+    def findall(self, text, starts=False):
+        """
+        return the list of (end offset, pattern index) of every match in the text.
+        :param text: str, bytes or sequence of symbols
+        :param starts: return (start offset, end offset, pattern index) instead (see finditer)
+        :return:
+        """
+        return list(self.finditer(text, starts))
+
+
+class Matcher(object):
+    """
+    resumable run of a compiled automaton (CompiledDFA, CompiledNFA or LazyDFA) over input given in chunks.
+    only the current state and the number of symbols read are kept between chunks, so the memory used does
+    not grow with the input. an UnknownSymbolError gives the position of the symbol in the whole input.
+
+    >>> matcher = dfa.matcher()
+    >>> matcher.feed("0010").feed("0").is_accepting()
+    True
+    """
+
+    __slots__ = ("engine", "state", "offset")
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.state = engine.start
+        self.offset = 0  # number of symbols read
+
+    def reset(self):
+        """
+        go back to the initial state.
+        :return:
+        """
+        self.state = self.engine.start
+        self.offset = 0
+        return self
+
+    def feed(self, chunk):
+        """
+        read the next chunk of the input.
+        :param chunk: str, bytes, bytearray or sequence of symbols
+        :return:
+        """
+        try:
+            self.state = self.engine.advance(self.state, chunk)
+        except UnknownSymbolError as error:
+            raise UnknownSymbolError(error.symbol, self.offset + error.position) from None
+        self.offset += len(chunk)
+        return self
+
+    def is_accepting(self):
+        """
+        check whether the input read so far is the language of the automaton.
+        :return:
+        """
+        return self.engine.accepts(self.state)
+
+    def scan_file(self, file, chunk_size=1 << 16):
+        """
+        read a binary file object to its end, one chunk at a time, and return is_accepting().
+        the chunks are read into one reused buffer.
+        :param file:
+        :param chunk_size:
+        :return:
+        """
+        buffer = bytearray(chunk_size)
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            self.feed(buffer if size == chunk_size else buffer[:size])
+        return self.is_accepting()
+
+    def scan_mmap(self, source, chunk_size=1 << 16):
+        """
+        read a memory-mapped file, one chunk at a time, and return is_accepting().
+        :param source: mmap object, or the path of a file to map
+        :param chunk_size:
+        :return:
+        """
+        if not isinstance(source, mmap.mmap):
+            with open(source, "rb") as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    return self.is_accepting()
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return self.scan_mmap(mapped, chunk_size)
+        for start in range(0, len(source), chunk_size):
+            self.feed(source[start:start + chunk_size])
+        return self.is_accepting()
+
+    async def scan_stream(self, reader, chunk_size=1 << 16):
+        """
+        read an asynchronous stream (anything with a coroutine read(n), like asyncio.StreamReader)
+        to its end and return is_accepting().
+        :param reader:
+        :param chunk_size:
+        :return:
+        """
+        while True:
+            chunk = await reader.read(chunk_size)
+            if not chunk:
+                break
+            self.feed(chunk)
+        return self.is_accepting()
+
+
+class NonDeterministicFiniteAutomaton(Automaton):
+    """
+    Non Deterministic Finite Automaton
+    """
+
+    def _compile(self):
+        return CompiledNFA(self)
+
+    def run(self, input_string):
+        """
+        check whether the input is the language of this NFA.
+        the states are simulated as a bitset on the compiled form.
+        :param input_string:
+        :return:
+        """
+        return self.compiled().run(input_string)
+
+    def run_reference(self, input_string):
+        """
+        check whether the input is the language of this NFA by walking the transitions dict directly.
+        :param input_string:
+        :return:
+        """
+        symbols = self._known_symbols(input_string)
+        if symbols is None:
+            return False
+        states = {self.initial_state}
+        for character in symbols:
+            states = self.next_states(states, character)
+        return len(states.intersection(self.final_states)) != 0
+
+    def next_states(self, states, character):
+        """
+        return set of next states.
+        :param states:
+        :param character:
+        :return: next_state:
+        """
+        transitions = self._expanded_transitions()
+        next_states = set()
+        for state in states:
+            next_states.update(transitions.get(state, {}).get(character, ()))
+        return frozenset(next_states)
+
+    def lazy_dfa(self, max_memory=1 << 22):
+        """
+        return a DFA which is built from this automaton on the fly while it runs.
+        :param max_memory: budget of its state cache in bytes
+        :return:
+        """
+        return LazyDFA(self, max_memory)
+
+    def convert_to_dfa(self, max_states=None, timeout=None):
+        """
+        convert self to equivalent DFA.
+        the subset construction runs on the compiled form (see CompiledNFA.determinized), and every state
+        of the result is the frozenset of the states of self it stands for.
+        :param max_states: raise DeterminizationAborted when the DFA gets more states (default: no limit)
+        :param timeout: raise DeterminizationAborted after this many seconds (default: no limit)
+        :return:
+        """
+        return self.compiled().determinized(max_states, timeout).to_automaton()
+
+
+class NFAWithEpsTransition(Automaton):
+    """
+    NFA with epsilon transition
+    """
+
+    def reachable_states_with_one_eps_from(self, state):
+        """
+        return a set of states which are reachable from input 'state' with one epsilon transition.
+        :param state:
+        :return:
+        """
+        return frozenset(self.transitions[state].get(-1, {}))
+
+    def reachable_states_with_multi_eps_from(self, state):
+        """
+        return a set of states which are reachable from input 'state' with multi epsilon transitions.
+        :param state:
+        :return:
+        """
+        return self.eps_closures()[state]
+
+    def eps_closures(self):
+        """
+        return a dict from every state to the set of states reachable from it with multi epsilon transitions.
+        the closures are computed together, once: Tarjan's algorithm finds the strongly connected components
+        of the epsilon graph in reverse topological order, so the closure of a component is its members plus
+        the closures of the components it points to, which are already known.
+        they are cached until the automaton is redefined (see invalidate()).
+        :return:
+        """
+        closures = self._cache.get("eps_closures")
+        if closures is not None:
+            return closures
+
+        stats = _instrumentation
+        start = time.perf_counter() if stats is not None else None
+        closures = {}
+        successors = dict((state, trans_dict.get(-1, ())) for state, trans_dict in self.transitions.items())
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        for root in self.states:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(successors.get(root, ())))]
+            while work:
+                state, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(successors.get(child, ()))))
+                        break
+                    elif child in on_stack:
+                        low[state] = min(low[state], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[state])
+                    if low[state] != index[state]:
+                        continue
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == state:
+                            break
+                    closure = set(component)
+                    for member in component:
+                        for child in successors.get(member, ()):
+                            if child not in closure:
+                                closure.update(closures[child])
+                    closure = frozenset(closure)
+                    for member in component:
+                        closures[member] = closure
+
+        if stats is not None:
+            stats.finish("eps_closures", start, states=len(closures),
+                         closure_states=sum(len(closure) for closure in closures.values()))
+        self._cache["eps_closures"] = closures
+        return closures
+
+    def next_states(self, states, character):
+        """
+        return a set of states which is the next state from 'states' when read 'character'
         :param states:
         :param character:
         :return:
         """
-        next_states = frozenset()
+        closures = self.eps_closures()
+        transitions = self._expanded_transitions()
+        next_states = set()
         for state in states:
-            for reachable_state in self.transitions[state].get(character, frozenset()):
-                next_states = next_states.union(self.reachable_states_with_multi_eps_from(reachable_state))
+            for reachable_state in transitions.get(state, {}).get(character, ()):
+                next_states.update(closures[reachable_state])
         return frozenset(next_states)
 
+    def _compile(self):
+        return CompiledNFA(self, self.eps_closures())
+
+    def eps_removed(self):
+        """
+        return the NFA without epsilon transitions which accepts the same language.
+        a state moves by a character to the closures of everything its own closure moves to,
+        and it is final when its closure holds a final state.
+        :return:
+        """
+        closures = self.eps_closures()
+        members = self.compiled().members
+        transitions = {}
+        for state in self.states:
+            transitions[state] = {}
+            for symbols in members:
+                reachable_states = self.next_states(closures[state], symbols[0])
+                if len(reachable_states) != 0:
+                    for character in symbols:
+                        transitions[state][character] = reachable_states
+        final_states = set([x for x in self.states if not closures[x].isdisjoint(self.final_states)])
+        return NonDeterministicFiniteAutomaton(self.states, self.alphabet, transitions, self.initial_state,
+                                               final_states)
+
     def run(self, input_string):
         """
         check whether the eps-NFA can accept the input.
+        the states are simulated as a bitset on the compiled form, with the epsilon closures folded in.
         :param input_string:
         :return:
         """
+        return self.compiled().run(input_string)
+
+    def run_reference(self, input_string):
+        """
+        check whether the eps-NFA can accept the input by walking the transitions dict directly.
+        :param input_string:
+        :return:
+        """
+        symbols = self._known_symbols(input_string)
+        if symbols is None:
+            return False
         states = self.reachable_states_with_multi_eps_from(self.initial_state)
-        for character in input_string:
-            if character not in self.alphabet:
-                print("ERROR: %s not in alphabet" % character)
-                return False
-            else:
-                states = self.next_states(states, character)
+        for character in symbols:
+            states = self.next_states(states, character)
         return len(states.intersection(self.final_states)) != 0
 
-    def convert_to_dfa(self):
+    def lazy_dfa(self, max_memory=1 << 22):
         """
-        convert self to equivalent DFA.
+        return a DFA which is built from this automaton on the fly while it runs.
+        :param max_memory: budget of its state cache in bytes
         :return:
         """
-        states = {self.reachable_states_with_multi_eps_from(self.initial_state)}
-        transitions = {}
-        to_search = {self.reachable_states_with_multi_eps_from(self.initial_state)}
-        searched = set()
-        while len(to_search) != 0:
-            searching = to_search.pop()
-            searched.add(searching)
-            for character in self.alphabet:
-                reachable_states = self.next_states(searching, character)
-                states.add(reachable_states)
-                if reachable_states not in searched:
-                    to_search.add(reachable_states)
-                if not transitions.get(searching):
-                    transitions[searching] = {}
-                transitions[searching][character] = frozenset(reachable_states)
-
-        final_states = set([x for x in states if len(self.final_states.intersection(x)) != 0])
-        initial_state = self.reachable_states_with_multi_eps_from(self.initial_state)
-        alphabet = self.alphabet
-        return DeterministicFiniteAutomaton(states, alphabet, transitions, initial_state, final_states)
+        return LazyDFA(self, max_memory)
 
+    def convert_to_dfa(self, max_states=None, timeout=None):
+        """
+        convert self to equivalent DFA.
+        the subset construction runs on the compiled form (see CompiledNFA.determinized), and every state
+        of the result is the frozenset of the states of self it stands for.
+        :param max_states: raise DeterminizationAborted when the DFA gets more states (default: no limit)
+        :param timeout: raise DeterminizationAborted after this many seconds (default: no limit)
+        :return:
+        """
+        return self.compiled().determinized(max_states, timeout).to_automaton()
 
     @staticmethod
     def connect_serially(automata):
         """
-        connect multiple automatata serially.
-        :param automata:
+        connect multiple automatata serially: the result accepts an input of the first automaton followed by
+        an input of the second, and so on. the states of the i-th automaton are renamed (i, state).
+        :param automata: DFAs, NFAs or eps-NFAs
         :return:
         """
+        automata = list(automata)
         alphabet = set()
         states = set()
         transitions = {}
         for i, automaton in enumerate(automata):
-            alphabet = alphabet.union(automaton.alphabet)
-            states = states.union(set([(i, state) for state in automaton.states]))
-            for final_state in automaton.final_states:
-                transitions[(i, final_state)] = {}
-            for state, trans_dict in automaton.transitions.items():
-                transitions[(i, state)] = {}
-                for character, states_transit_to in trans_dict.items():
-                    transitions[(i, state)][character] = frozenset([(i, state) for state in states_transit_to])
-
+            alphabet.update(automaton.alphabet)
+            states.update((i, state) for state in automaton.states)
+            transitions.update(_renamed_transitions(i, automaton))
             if i == 0:
                 continue
-            for pre_final_state in automata[i-1].final_state:
-                transitions[(i - 1, pre_final_state)][-1] = frozenset([(i, automaton.init_state)])
+            for pre_final_state in automata[i - 1].final_states:
+                trans_dict = transitions[(i - 1, pre_final_state)]
+                trans_dict[-1] = trans_dict.get(-1, frozenset()).union([(i, automaton.initial_state)])
 
         initial_state = (0, automata[0].initial_state)
         final_states = set([(len(automata) - 1, f) for f in automata[-1].final_states])
@@ -326,23 +3035,77 @@ class NFAWithEpsTransition(Automaton):
     @staticmethod
     def connect_parallel(automata):
         """
-        connect multiple automata parallel.
-        :param automata:
+        connect multiple automata parallel: the result accepts the inputs of any of the automata.
+        the states of the i-th automaton are renamed (i, state), and a new initial state None moves to
+        their initial states with epsilon transitions.
+        :param automata: DFAs, NFAs or eps-NFAs
         :return:
         """
-        initial_state = 1
+        initial_state = None
         alphabet = set()
-        states = {(initial_state, -1)}
-        transitions = {}
+        states = {initial_state}
+        transitions = {initial_state: {-1: set()}}
         final_states = set()
         for i, automaton in enumerate(automata):
-            alphabet = alphabet.union(automaton.alphabet)
-            states = states.union(set([(i, state) for state in automaton.states]))
-            for state, trans_dict in automaton.transitions.items():
-                transitions[(i, state)] = {}
-                for character, states_transit_to in trans_dict.items():
-                    transitions[(i, state)][character] = frozenset([(i, state) for state in states_transit_to])
-            final_states = final_states.union(set([(i, final_state) for final_state in automaton.final_states]))
-        transitions[initial_state] = {}
-        transitions[initial_state][-1] = frozenset([(i, automaton.init_state) for i, automaton in enumerate(automata)])
-        return NFAWithEpsTransition(states, alphabet, transitions, initial_state, final_states)
\ No newline at end of file
+            alphabet.update(automaton.alphabet)
+            states.update((i, state) for state in automaton.states)
+            transitions.update(_renamed_transitions(i, automaton))
+            transitions[initial_state][-1].add((i, automaton.initial_state))
+            final_states.update((i, final_state) for final_state in automaton.final_states)
+        return NFAWithEpsTransition(states, alphabet, transitions, initial_state, final_states)
+
+    @staticmethod
+    def star(automaton):
+        """
+        return the eps-NFA accepting any number of inputs of the automaton one after another (Kleene star).
+        the states of the automaton are renamed (0, state), and a new initial state None, which is the only
+        final state, moves to its initial state; its final states move back to None.
+        :param automaton: DFA, NFA or eps-NFA
+        :return:
+        """
+        initial_state = None
+        states = {initial_state}.union((0, state) for state in automaton.states)
+        transitions = _renamed_transitions(0, automaton)
+        transitions[initial_state] = {-1: {(0, automaton.initial_state)}}
+        for final_state in automaton.final_states:
+            trans_dict = transitions[(0, final_state)]
+            trans_dict[-1] = trans_dict.get(-1, frozenset()).union([initial_state])
+        return NFAWithEpsTransition(states, automaton.alphabet, transitions, initial_state, {initial_state})
+
+
+def _reversed_automaton(automaton):
+    """
+    return the eps-NFA accepting the inputs of the automaton read backwards: every transition is turned
+    around, and a new initial state None moves to the final states, which are renamed (0, state) like the
+    other states. the initial state of the automaton is the only final state.
+    :param automaton: DFA, NFA or eps-NFA
+    :return:
+    """
+    deterministic = isinstance(automaton, DeterministicFiniteAutomaton)
+    initial_state = None
+    transitions = dict(((0, state), {}) for state in automaton.states)
+    transitions[initial_state] = {-1: set((0, state) for state in automaton.final_states)}
+    for state, trans_dict in automaton._expanded_transitions().items():
+        for character, targets in trans_dict.items():
+            for target in ([targets] if deterministic else targets):
+                transitions[(0, target)].setdefault(character, set()).add((0, state))
+    return NFAWithEpsTransition(set(transitions), automaton.alphabet, transitions, initial_state,
+                                {(0, automaton.initial_state)})
+
+
+def _renamed_transitions(i, automaton):
+    """
+    return the transitions of the automaton with every state renamed (i, state), as the transitions dict
+    of an eps-NFA. every state gets an entry, with or without transitions. the SymbolRange labels are
+    expanded against the alphabet of this automaton, not the one of the automaton they are combined into.
+    :param i:
+    :param automaton: DFA, NFA or eps-NFA
+    :return:
+    """
+    deterministic = isinstance(automaton, DeterministicFiniteAutomaton)
+    transitions = dict(((i, state), {}) for state in automaton.states)
+    for state, trans_dict in automaton._expanded_transitions().items():
+        transitions[(i, state)] = dict(
+            (character, frozenset([(i, targets)] if deterministic else [(i, t) for t in targets]))
+            for character, targets in trans_dict.items())
+    return transitions
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+regular expressions compiled into automata.
+
+    >>> nfa = Regex.compile("(0|1)*00")
+    >>> nfa.run("1100")
+    True
+
+the syntax is a subset of the one of the re module, matched against the whole input:
+    ab          concatenation
+    a|b         union
+    a* a+ a?    repetition (zero or more, one or more, zero or one)
+    a{m} a{m,} a{m,n}
+    (a)         grouping
+    .           any symbol of the alphabet
+    [a-z_] [^0] set of symbols, negated by ^ (against the alphabet)
+    \\d \\w \\s    digits, word characters, white space
+    \\x          the character x itself, for any other x
+
+the states of the Glushkov NFA are the positions of the symbols in the pattern (0 being the initial state),
+so it has no epsilon transition and one state more than the pattern has symbols. Thompson's construction
+gives an NFAWithEpsTransition instead, with two states per symbol and operator.
+"""
+import functools
+
+from Automaton import NonDeterministicFiniteAutomaton as NFA
+from Automaton import NFAWithEpsTransition
+from Automaton import SymbolRange
+
+_SHORTHANDS = {
+    "d": "0123456789",
+    "w": "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz",
+    "s": " \t\n\r\f\v",
+}
+
+
+class RegexError(ValueError):
+    """
+    raised for a pattern which cannot be parsed.
+    """
+
+    def __init__(self, message, pattern, position):
+        super().__init__("%s at position %d of %r" % (message, position, pattern))
+        self.message = message
+        self.pattern = pattern
+        self.position = position
+
+    def __reduce__(self):  # so that it comes back from a worker process
+        return type(self), (self.message, self.pattern, self.position)
+
+
+def compile(pattern, alphabet=None, epsilon=False):
+    """
+    return the automaton accepting the inputs matched by the pattern.
+    the automata are cached by pattern, alphabet and construction, so compiling a pattern again is a
+    dict lookup. the cached automaton is shared: do not modify it.
+    :param pattern: str
+    :param alphabet: symbols of the automaton (default: the symbols written in the pattern).
+    it is needed by . and [^...]
+    :param epsilon: build an NFAWithEpsTransition by Thompson's construction instead of a Glushkov NFA
+    :return:
+    """
+    return _compile(pattern, None if alphabet is None else frozenset(alphabet), epsilon)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(pattern, alphabet, epsilon):
+    tree = parse(pattern, alphabet)
+    if alphabet is None:
+        alphabet = frozenset(_symbols_in(tree))
+    return thompson(tree, alphabet) if epsilon else glushkov(tree, alphabet)
+
+
+def purge():
+    """
+    clear the cache of compiled patterns.
+    :return:
+    """
+    _compile.cache_clear()
+
+
+def parse(pattern, alphabet=None):
+    """
+    return the syntax tree of the pattern. a node is one of
+    ("symbols", frozenset of symbols), ("epsilon",), ("concat", nodes), ("union", nodes) and ("star", node).
+    :param pattern:
+    :param alphabet: symbols . and [^...] stand for, and which the sets of symbols are restricted to
+    :return:
+    """
+    return _Parser(pattern, alphabet).parse()
+
+
+class _Parser(object):
+    """
+    recursive descent parser of the patterns, one level per operator precedence.
+    """
+
+    def __init__(self, pattern, alphabet):
+        self.pattern = pattern
+        self.alphabet = alphabet
+        self.position = 0
+
+    def error(self, message, position=None):
+        return RegexError(message, self.pattern, self.position if position is None else position)
+
+    def peek(self):
+        return self.pattern[self.position] if self.position < len(self.pattern) else None
+
+    def parse(self):
+        tree = self.union()
+        if self.position < len(self.pattern):
+            raise self.error("unbalanced parenthesis")
+        return tree
+
+    def union(self):
+        branches = [self.concat()]
+        while self.peek() == "|":
+            self.position += 1
+            branches.append(self.concat())
+        return branches[0] if len(branches) == 1 else ("union", tuple(branches))
+
+    def concat(self):
+        items = []
+        while self.peek() is not None and self.peek() not in "|)":
+            items.append(self.repeat())
+        if not items:
+            return ("epsilon",)
+        return items[0] if len(items) == 1 else ("concat", tuple(items))
+
+    def repeat(self):
+        node = self.atom()
+        while self.peek() is not None and self.peek() in "*+?{":
+            operator = self.pattern[self.position]
+            self.position += 1
+            if operator == "*":
+                node = ("star", node)
+            elif operator == "+":
+                node = ("concat", (node, ("star", node)))
+            elif operator == "?":
+                node = ("union", (node, ("epsilon",)))
+            else:
+                node = self.counted(node)
+        return node
+
+    def counted(self, node):
+        """
+        parse the rest of {m}, {m,} or {m,n} and return the node repeated accordingly.
+        """
+        start = self.position - 1
+        end = self.pattern.find("}", self.position)
+        if end < 0:
+            raise self.error("missing }", start)
+        bounds = self.pattern[self.position:end].split(",")
+        self.position = end + 1
+        try:
+            low = int(bounds[0])
+            high = low if len(bounds) == 1 else None if bounds[1] == "" else int(bounds[1])
+        except ValueError:
+            raise self.error("bad repetition", start)
+        if len(bounds) > 2 or low < 0 or (high is not None and high < low):
+            raise self.error("bad repetition", start)
+        items = [node] * low
+        if high is None:
+            items.append(("star", node))
+        else:
+            items.extend([("union", (node, ("epsilon",)))] * (high - low))
+        if not items:
+            return ("epsilon",)
+        return items[0] if len(items) == 1 else ("concat", tuple(items))
+
+    def atom(self):
+        character = self.pattern[self.position]
+        self.position += 1
+        if character == "(":
+            node = self.union()
+            if self.peek() != ")":
+                raise self.error("missing )")
+            self.position += 1
+            return node
+        if character == "[":
+            return ("symbols", self.symbol_set())
+        if character == ".":
+            return ("symbols", self.everything("."))
+        if character == "\\":
+            return ("symbols", self.escape())
+        if character in "*+?{":
+            raise self.error("nothing to repeat", self.position - 1)
+        return ("symbols", self.literal(character))
+
+    def everything(self, operator):
+        if self.alphabet is None:
+            raise self.error("%s needs an alphabet" % operator, self.position - 1)
+        return self.alphabet
+
+    def literal(self, character):
+        if self.alphabet is not None and character not in self.alphabet:
+            raise self.error("%r is not in the alphabet" % character, self.position - 1)
+        return frozenset(character)
+
+    def escape(self):
+        if self.position >= len(self.pattern):
+            raise self.error("bad escape")
+        character = self.pattern[self.position]
+        self.position += 1
+        if character in _SHORTHANDS:
+            return self.restricted(_SHORTHANDS[character])
+        return self.literal(character)
+
+    def restricted(self, symbols):
+        if self.alphabet is None:
+            return frozenset(symbols)
+        return self.alphabet.intersection(symbols)
+
+    def symbol_set(self):
+        """
+        parse the rest of [...] and return its symbols.
+        """
+        start = self.position - 1
+        negated = self.peek() == "^"
+        if negated:
+            self.position += 1
+        symbols = set()
+        first = True
+        while True:
+            character = self.peek()
+            if character is None:
+                raise self.error("missing ]", start)
+            if character == "]" and not first:
+                self.position += 1
+                break
+            first = False
+            self.position += 1
+            if character == "\\":
+                if self.position >= len(self.pattern):
+                    raise self.error("bad escape")
+                character = self.pattern[self.position]
+                self.position += 1
+                if character in _SHORTHANDS:
+                    symbols.update(self.restricted(_SHORTHANDS[character]))
+                    continue
+            if self.peek() == "-" and self.position + 1 < len(self.pattern) and \
+                    self.pattern[self.position + 1] != "]":
+                last = self.pattern[self.position + 1]
+                self.position += 2
+                if last == "\\" and self.position < len(self.pattern):
+                    last = self.pattern[self.position]
+                    self.position += 1
+                if last < character:
+                    raise self.error("bad range %s-%s" % (character, last), start)
+                symbols.update(self.range(character, last))
+            else:
+                symbols.add(character)
+        if negated:
+            return self.everything("[^...]").difference(symbols)
+        return self.restricted(symbols)
+
+    def range(self, first, last):
+        if self.alphabet is None:
+            return [chr(code) for code in range(ord(first), ord(last) + 1)]
+        return SymbolRange(first, last).covered(self.alphabet)
+
+
+def _symbols_in(tree):
+    """
+    yield the symbols written in the syntax tree.
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node[0] == "symbols":
+            yield from node[1]
+        elif node[0] in ("concat", "union"):
+            stack.extend(node[1])
+        elif node[0] == "star":
+            stack.append(node[1])
+
+
+def glushkov(tree, alphabet):
+    """
+    return the Glushkov NFA of the syntax tree.
+    every occurrence of a symbol set in the tree is a position, and a state; a position moves to every
+    position which may follow it, on the symbols of that position. the initial state 0 moves to the
+    positions which may come first, and the final states are the positions which may come last.
+    :param tree:
+    :param alphabet:
+    :return:
+    """
+    positions = [frozenset()]  # state -> symbols of the position (none for the initial state)
+    follow = [set()]
+    nullable, first, last = _positions(tree, positions, follow)
+
+    transitions = {}
+    for state, targets in enumerate([first] + follow[1:]):
+        trans_dict = transitions[state] = {}
+        for target in targets:
+            for symbol in positions[target]:
+                trans_dict.setdefault(symbol, set()).add(target)
+    final_states = set(last)
+    if nullable:
+        final_states.add(0)
+    return NFA(range(len(positions)), alphabet, transitions, 0, final_states)
+
+
+def _positions(node, positions, follow):
+    """
+    number the positions of the node and fill in the positions which may follow each of them.
+    :return: (whether the node matches the empty input, positions which may come first, which may come last)
+    """
+    kind = node[0]
+    if kind == "symbols":
+        positions.append(node[1])
+        follow.append(set())
+        position = len(positions) - 1
+        return False, {position}, {position}
+    if kind == "epsilon":
+        return True, set(), set()
+    if kind == "star":
+        _, first, last = _positions(node[1], positions, follow)
+        for position in last:
+            follow[position].update(first)
+        return True, first, last
+    if kind == "union":
+        nullable, first, last = False, set(), set()
+        for child in node[1]:
+            child_nullable, child_first, child_last = _positions(child, positions, follow)
+            nullable = nullable or child_nullable
+            first.update(child_first)
+            last.update(child_last)
+        return nullable, first, last
+    nullable, first, last = True, set(), set()  # concat
+    for child in node[1]:
+        child_nullable, child_first, child_last = _positions(child, positions, follow)
+        for position in last:
+            follow[position].update(child_first)
+        if nullable:
+            first.update(child_first)
+        last = last.union(child_last) if child_nullable else child_last
+        nullable = nullable and child_nullable
+    return nullable, first, last
+
+
+def thompson(tree, alphabet):
+    """
+    return the eps-NFA of the syntax tree by Thompson's construction.
+    every node becomes a fragment with one entry and one exit state, joined by epsilon transitions.
+    :param tree:
+    :param alphabet:
+    :return:
+    """
+    transitions = []
+    entry, exit_state = _fragment(tree, transitions)
+    return NFAWithEpsTransition(range(len(transitions)), alphabet, dict(enumerate(transitions)), entry,
+                                {exit_state})
+
+
+def _fragment(node, transitions):
+    """
+    add the states of the node to transitions (a list indexed by state) and return its entry and exit states.
+    """
+    kind = node[0]
+    entry = len(transitions)
+    transitions.append({})
+    if kind == "concat":
+        exit_state = entry
+        for child in node[1]:
+            child_entry, child_exit = _fragment(child, transitions)
+            transitions[exit_state][-1] = {child_entry}
+            exit_state = child_exit
+        return entry, exit_state
+    exit_state = len(transitions)
+    transitions.append({})
+    if kind == "symbols":
+        for symbol in node[1]:
+            transitions[entry][symbol] = {exit_state}
+    elif kind == "epsilon":
+        transitions[entry][-1] = {exit_state}
+    elif kind == "union":
+        transitions[entry][-1] = set()
+        for child in node[1]:
+            child_entry, child_exit = _fragment(child, transitions)
+            transitions[entry][-1].add(child_entry)
+            transitions[child_exit][-1] = {exit_state}
+    else:  # star
+        child_entry, child_exit = _fragment(node[1], transitions)
+        transitions[entry][-1] = {child_entry, exit_state}
+        transitions[child_exit][-1] = {child_entry, exit_state}
+    return entry, exit_state
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+matching service: runs a compiled automaton for an asyncio program, off the event loop.
+
+    >>> async with MatchService(Regex.compile("(0|1)*00").convert_to_dfa()) as service:
+    ...     await service.match("1100")
+    True
+
+the requests run in a pool of threads or processes, so a long input does not block the event loop.
+small inputs are grouped in batches, one pool task per batch, to save the cost of a task per request;
+a batch is sent once it is full or when the event loop has nothing else to do. at most 'max_pending'
+requests are in flight: match() waits for a slot, which holds back the callers when the pool falls behind.
+
+the compiled automata are read-only while they run, so one of them is shared by all the threads.
+the threads of CPython run the tables one at a time, though: they keep the event loop free, and processes
+add throughput. with processes the compiled DFA is copied to every worker once, or mapped by every worker
+from the same file when it is given by path (see CompiledDFA.save), so they share its pages.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from Automaton import Automaton
+from Automaton import CompiledDFA
+from Automaton import LazyDFA
+
+# the compiled automaton of a worker process of MatchService
+_worker_engine = None
+
+
+def _init_worker(source):
+    global _worker_engine
+    _worker_engine = CompiledDFA.load(source) if isinstance(source, (str, os.PathLike)) else source
+
+
+def _run_batch(engine, inputs):
+    """
+    run the inputs on the compiled automaton (on the one of the worker process when engine is None).
+    :return: list of bool, or of the exception raised by the input
+    """
+    if engine is None:
+        engine = _worker_engine
+    if isinstance(engine, CompiledDFA) and len(inputs) > 1:
+        try:
+            return [bool(accepted) for accepted in engine.run_many(inputs)]
+        except Exception:  # one of the inputs failed: run them one by one to find it
+            pass
+    results = []
+    for input_string in inputs:
+        try:
+            results.append(engine.run(input_string))
+        except Exception as error:
+            results.append(error)
+    return results
+
+
+class MatchService(object):
+    """
+    runs match requests on one compiled automaton in a thread or process pool, for asyncio callers.
+    """
+
+    def __init__(self, automaton, workers=None, processes=False, max_pending=1024, batch_size=256,
+                 batch_delay=0.0, small_input=1 << 12, latency_samples=1 << 14):
+        """
+        :param automaton: automaton, CompiledDFA or CompiledNFA, or the path of a saved CompiledDFA
+        :param workers: size of the pool (default: the one of concurrent.futures)
+        :param processes: run in a process pool instead of a thread pool
+        :param max_pending: number of requests in flight above which match() waits
+        :param batch_size: largest number of small inputs run by one pool task
+        :param batch_delay: seconds a batch which is not full waits for more inputs
+        (default: until the event loop has nothing else to do)
+        :param small_input: length under which an input is batched
+        :param latency_samples: number of the latest latencies kept for the percentiles
+        """
+        if isinstance(automaton, LazyDFA):
+            raise TypeError("a LazyDFA changes while it runs and cannot be shared: pass its NFA instead")
+        source = automaton
+        if isinstance(automaton, (str, os.PathLike)):
+            automaton = CompiledDFA.load(automaton)
+        elif isinstance(automaton, Automaton):
+            automaton = source = automaton.compiled()
+        self.engine = automaton
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.small_input = small_input
+        self.max_pending = max_pending
+        if processes:
+            self.executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(source,))
+        else:
+            self.executor = ThreadPoolExecutor(workers)
+        self._processes = processes
+        self._slots = asyncio.Semaphore(max_pending)
+        self._batch = []  # (input, future) waiting to be sent
+        self._flush_handle = None
+        self._running = set()  # pool tasks not finished yet
+        self._latencies = deque(maxlen=latency_samples)
+        self.reset()
+
+    def reset(self):
+        """
+        clear the metrics.
+        :return:
+        """
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.symbols = 0
+        self.pending = 0
+        self.most_pending = 0
+        self._latencies.clear()
+        self._started = time.perf_counter()
+
+    async def match(self, input_string):
+        """
+        check whether the input is the language of the automaton, without blocking the event loop.
+        :param input_string: str, bytes or sequence of symbols
+        :return:
+        """
+        start = time.perf_counter()
+        async with self._slots:
+            self.pending += 1
+            self.most_pending = max(self.most_pending, self.pending)
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            try:
+                if len(input_string) < self.small_input:
+                    self._batch.append((input_string, future))
+                    if len(self._batch) >= self.batch_size:
+                        self._flush()
+                    elif self._flush_handle is None:
+                        self._flush_handle = loop.call_later(self.batch_delay, self._flush) if self.batch_delay \
+                            else loop.call_soon(self._flush)
+                else:
+                    self._submit(loop, [(input_string, future)])
+                return await future
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.pending -= 1
+                self.requests += 1
+                self.symbols += len(input_string)
+                self._latencies.append(time.perf_counter() - start)
+
+    def _flush(self):
+        """
+        send the waiting small inputs to the pool.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._batch = self._batch, []
+        if batch:
+            self._submit(asyncio.get_running_loop(), batch)
+
+    def _submit(self, loop, batch):
+        """
+        run a batch of (input, future) in the pool, and set the futures to the results.
+        """
+        self.batches += 1
+        inputs = [x for x, _ in batch]
+        if self._processes:
+            run = functools.partial(_run_batch, None, inputs)
+        else:  # in the context of the caller, so that its Instrumentation counts the batch
+            run = functools.partial(contextvars.copy_context().run, _run_batch, self.engine, inputs)
+        try:
+            task = loop.run_in_executor(self.executor, run)
+        except Exception as error:  # broken or shut down pool: fail the batch rather than leave it waiting
+            task = loop.create_future()
+            task.set_exception(error)
+        self._running.add(task)
+        task.add_done_callback(functools.partial(self._resolve, batch))
+
+    def _resolve(self, batch, task):
+        self._running.discard(task)
+        if task.cancelled():
+            results = [asyncio.CancelledError()] * len(batch)
+        elif task.exception() is not None:
+            results = [task.exception()] * len(batch)
+        else:
+            results = task.result()
+        for (_, future), result in zip(batch, results):
+            if future.done():  # the request was cancelled
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        """
+        return the metrics since the service was started or reset: counters, throughput per second,
+        and latencies of the latest requests in seconds, from the call of match() to its result.
+        :return:
+        """
+        seconds = time.perf_counter() - self._started
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+        return {"requests": self.requests, "errors": self.errors, "batches": self.batches, "symbols": self.symbols,
+                "pending": self.pending, "most_pending": self.most_pending, "seconds": seconds,
+                "requests_per_second": self.requests / seconds if seconds else 0.0,
+                "symbols_per_second": self.symbols / seconds if seconds else 0.0,
+                "latency": {"mean": sum(latencies) / len(latencies) if latencies else 0.0, "p50": percentile(0.5),
+                            "p95": percentile(0.95), "p99": percentile(0.99), "max": percentile(1.0)}}
+
+    async def close(self):
+        """
+        wait for the requests in flight and shut the pool down.
+        :return:
+        """
+        self._flush()
+        if self._running:
+            await asyncio.wait(list(self._running))
+        self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
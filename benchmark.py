@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks for the automaton operations.
+
+    $ python benchmark.py minimize --sizes 100 1000 10000
+
+the suite times a fixed set of cases and compares them with stored results, to catch regressions:
+
+    $ python benchmark.py suite --save benchmark_baseline.json
+    $ python benchmark.py suite --compare benchmark_baseline.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+import Regex
+from Automaton import CompiledDFA, CompiledNFA
+from Automaton import DFACache
+from Automaton import DeterministicFiniteAutomaton as DFA
+from Automaton import NonDeterministicFiniteAutomaton as NFA
+from Automaton import NFAWithEpsTransition
+from Service import MatchService
+
+
+def random_dfa(n, alphabet="01", seed=0, final_ratio=0.5):
+    """
+    return a complete DFA with n states whose transitions and final states are drawn at random.
+    """
+    rng = random.Random(seed)
+    states = range(n)
+    transitions = dict((q, dict((c, rng.randrange(n)) for c in alphabet)) for q in states)
+    final_states = [q for q in states if rng.random() < final_ratio]
+    return DFA(states, alphabet, transitions, 0, final_states)
+
+
+def random_nfa(n, alphabet="01", seed=0, degree=2, eps_degree=0, final_ratio=0.2):
+    """
+    return an NFA with n states in which every state has about 'degree' random successors per symbol.
+    with eps_degree > 0, an NFAWithEpsTransition with that many random epsilon successors per state is returned.
+    """
+    rng = random.Random(seed)
+    states = range(n)
+    transitions = {}
+    for q in states:
+        transitions[q] = dict((c, set(rng.randrange(n) for _ in range(rng.randint(0, 2 * degree))))
+                              for c in alphabet)
+        if eps_degree > 0:
+            transitions[q][-1] = set(rng.randrange(n) for _ in range(rng.randint(0, 2 * eps_degree)))
+    final_states = [q for q in states if rng.random() < final_ratio]
+    automaton = NFAWithEpsTransition if eps_degree > 0 else NFA
+    return automaton(states, alphabet, transitions, 0, final_states)
+
+
+def nth_from_end_nfa(n, alphabet="01"):
+    """
+    return the NFA accepting the strings whose n-th symbol from the end is the first symbol of the alphabet.
+    it has n + 1 states, and its subset construction has 2 ** n.
+    """
+    transitions = {0: dict((c, {0}) for c in alphabet)}
+    transitions[0][alphabet[0]] = {0, 1}
+    for q in range(1, n):
+        transitions[q] = dict((c, {q + 1}) for c in alphabet)
+    transitions[n] = {}
+    return NFA(range(n + 1), alphabet, transitions, 0, {n})
+
+
+def de_bruijn(order):
+    """
+    return a binary de Bruijn sequence of the given order as a list of 0 and 1.
+    """
+    sequence = []
+    a = [0] * (order + 1)
+
+    def generate(t, p):
+        if t > order:
+            if order % p == 0:
+                sequence.extend(a[1:p + 1])
+        else:
+            a[t] = a[t - p]
+            generate(t + 1, p)
+            for j in range(a[t - p] + 1, 2):
+                a[t] = j
+                generate(t + 1, t)
+
+    generate(1, 1)
+    return sequence
+
+
+def cyclic_dfa(order):
+    """
+    return the unary cyclic DFA with 2 ** order states whose final states follow a de Bruijn sequence.
+    this is the family on which Hopcroft's algorithm needs its full n log n steps (Berstel and Carton).
+    """
+    word = de_bruijn(order)
+    n = len(word)
+    transitions = dict((q, {"a": (q + 1) % n}) for q in range(n))
+    final_states = [q for q in range(n) if word[q] == 1]
+    return DFA(range(n), "a", transitions, 0, final_states)
+
+
+def measure(function, *args):
+    """
+    return the seconds taken by one call of function.
+    """
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def eps_chain(n, cycle=False):
+    """
+    return the eps-NFA whose states 0 .. n - 1 are chained by epsilon transitions, the worst case of the
+    epsilon closures: the closure of state q has n - q states.
+    with cycle, the last state goes back to the first one, and all the states share one closure.
+    """
+    transitions = dict((q, {-1: {q + 1}, "0": {q}}) for q in range(n - 1))
+    transitions[n - 1] = {-1: {0}} if cycle else {"1": {0}}
+    return NFAWithEpsTransition(range(n), "01", transitions, 0, {n - 1})
+
+
+def bench_minimize(sizes, oracle_limit):
+    print("%-8s %8s %12s %12s" % ("family", "states", "hopcroft", "table"))
+    for n in sizes:
+        families = [("random", random_dfa(n)),
+                    ("cyclic", cyclic_dfa(max(1, n.bit_length() - 1)))]
+        for name, dfa in families:
+            dfa.compiled()
+            hopcroft = measure(dfa.minimized)
+            table = "-"
+            if len(dfa.states) <= oracle_limit:
+                table = "%.4f" % measure(dfa.minimized_by_table_filling)
+            print("%-8s %8d %12.4f %12s" % (name, len(dfa.states), hopcroft, table))
+
+
+def bench_determinize(orders, n):
+    print("%-12s %8s %12s" % ("NFA", "DFA", "seconds"))
+    families = [("n-th %d" % order, nth_from_end_nfa(order)) for order in orders]
+    families += [("random %d" % n, random_nfa(n, "0123", degree=1, seed=seed)) for seed in range(3)]
+    families += [("eps %d" % n, random_nfa(n, "0123", degree=1, eps_degree=1, seed=seed)) for seed in range(3)]
+    for name, nfa in families:
+        nfa.compiled()
+        start = time.perf_counter()
+        dfa = nfa.convert_to_dfa()
+        seconds = time.perf_counter() - start
+        print("%-12s %8d %12.4f" % (name, len(dfa.states), seconds))
+
+
+def random_patterns(count, seed=0):
+    """
+    return count random patterns like the rules of a filter: words with digits, options and repetitions.
+    """
+    rng = random.Random(seed)
+    patterns = []
+    for _ in range(count):
+        word = "".join(rng.choice("abcdefghij") for _ in range(rng.randint(3, 10)))
+        cut = rng.randrange(len(word))
+        patterns.append(word[:cut] + rng.choice(["[0-9]+", "(x|y)?", "z*", "."]) + word[cut:])
+    return patterns
+
+
+def bench_regex(count):
+    patterns = random_patterns(count)
+    alphabet = "abcdefghijxyz0123456789"
+    Regex.purge()
+    cold = measure(lambda: [Regex.compile(pattern, alphabet) for pattern in patterns])
+    warm = measure(lambda: [Regex.compile(pattern, alphabet) for pattern in patterns])
+    thompson = measure(lambda: [Regex.compile(pattern, alphabet, epsilon=True) for pattern in patterns])
+    print("%d patterns" % count)
+    print("glushkov         : %.4f s" % cold)
+    print("glushkov, cached : %.4f s" % warm)
+    print("thompson         : %.4f s" % thompson)
+
+
+def random_strings(count, min_length, max_length, alphabet="01", seed=0):
+    """
+    return count random strings over the alphabet.
+    """
+    rng = random.Random(seed)
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(min_length, max_length)))
+            for _ in range(count)]
+
+
+def bench_batch(count, length):
+    dfa = random_dfa(100)
+    strings = random_strings(count, length // 2, length)
+    dfa.compiled()
+    loop = measure(lambda: [dfa.run(x) for x in strings])
+    batch = measure(dfa.run_many, strings)
+    print("%d strings of length %d..%d" % (count, length // 2, length))
+    print("run loop : %.4f s" % loop)
+    print("run_many : %.4f s (x%.1f)" % (batch, loop / batch))
+
+
+def bench_lazy(n, length, max_memory):
+    nfa = nth_from_end_nfa(n)
+    text = random_strings(1, length, length)[0]
+    nfa.compiled()
+    lazy = nfa.lazy_dfa(max_memory)
+    print("n-th from the end NFA, n = %d, input length %d" % (n, length))
+    print("NFA simulation : %.4f s" % measure(nfa.run, text))
+    print("lazy DFA       : %.4f s %s" % (measure(lazy.run, text), lazy.stats()))
+    print("lazy DFA again : %.4f s %s" % (measure(lazy.run, text), lazy.stats()))
+
+
+def bench_parallel(n, length, workers):
+    dfa = random_dfa(n)
+    text = random_strings(1, length, length)[0]
+    dfa.compiled()
+    sequential = measure(dfa.run, text)
+    print("random DFA, %d states, input length %d" % (n, length))
+    print("%8s %10s %8s" % ("workers", "seconds", "speedup"))
+    print("%8s %10.4f %8.2f" % ("run", sequential, 1.0))
+    for count in workers:
+        seconds = measure(dfa.run_parallel, text, count)
+        print("%8d %10.4f %8.2f" % (count, seconds, sequential / seconds))
+
+
+async def load_test(match, requests, clients):
+    """
+    run the requests through match() from 'clients' concurrent stand-in clients, each of which sends
+    its next request when the previous one is answered. a ticker measures how late the event loop runs.
+    :return: (seconds, sorted latencies, largest lag of the event loop)
+    """
+    queue = deque(requests)
+    latencies = []
+    lag = [0.0]
+    done = asyncio.Event()
+
+    async def client():
+        while queue:
+            input_string = queue.popleft()
+            start = time.perf_counter()
+            await match(input_string)
+            latencies.append(time.perf_counter() - start)
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag[0] = max(lag[0], time.perf_counter() - start - 0.001)
+
+    ticking = asyncio.ensure_future(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    seconds = time.perf_counter() - start
+    done.set()
+    await ticking
+    return seconds, sorted(latencies), lag[0]
+
+
+def bench_service(count, clients, length, large, large_ratio, workers):
+    dfa = random_dfa(100).compiled()
+    rng = random.Random(0)
+    requests = [x * (large // length) if rng.random() < large_ratio else x
+                for x in random_strings(count, length // 2, length)]
+
+    async def direct(input_string):
+        return dfa.run(input_string)
+
+    print("%d requests of length %d..%d, %.1f%% of length %d, %d clients" % (count, length // 2, length,
+                                                                            100 * large_ratio, large, clients))
+    print("%-12s %12s %10s %10s %10s %8s" % ("mode", "requests/s", "p50 ms", "p99 ms", "lag ms", "batches"))
+    modes = [("in the loop", None), ("threads", MatchService(dfa, workers)),
+             ("processes", MatchService(dfa, workers, processes=True))]
+    for mode, service in modes:
+        async def run():
+            if service is None:
+                return await load_test(direct, requests, clients)
+            async with service:
+                await service.match("")  # start the workers
+                return await load_test(service.match, requests, clients)
+
+        seconds, latencies, lag = asyncio.run(run())
+        print("%-12s %12.0f %10.3f %10.3f %10.3f %8s" % (mode, count / seconds, 1e3 * latencies[len(latencies) // 2],
+                                                        1e3 * latencies[len(latencies) * 99 // 100], 1e3 * lag,
+                                                        "-" if service is None else service.batches))
+
+
+def bench_load(orders):
+    print("%6s %8s %12s %12s %12s" % ("n", "states", "build", "cache miss", "cache hit"))
+    with tempfile.TemporaryDirectory() as directory:
+        for n in orders:
+            nfa = nth_from_end_nfa(n)
+            build = measure(lambda: nfa.compiled().determinized().minimized())
+            miss = measure(DFACache(directory).dfa, nfa)
+            hit = measure(DFACache(directory).dfa, nth_from_end_nfa(n))
+            print("%6d %8d %12.4f %12.4f %12.4f" % (n, 1 << n, build, miss, hit))
+
+
+def prepare_run(automaton, text):
+    automaton.compiled()
+    return lambda: automaton.run(text)
+
+
+def prepare_short_runs(automaton, strings):
+    automaton.compiled()
+    return lambda: [automaton.run(x) for x in strings]
+
+
+def prepare_lazy_run(nfa, text):
+    lazy = nfa.lazy_dfa()
+    return lambda: lazy.run(text)
+
+
+def prepare_minimized(dfa):
+    dfa.compiled()
+    return dfa.minimized
+
+
+def prepare_convert_to_dfa(nfa):
+    nfa.compiled()
+    return nfa.convert_to_dfa
+
+
+def prepare_eps_closures(nfa):
+    def closures():
+        nfa.invalidate()
+        nfa.eps_closures()
+    return closures
+
+
+def prepare_regex(patterns):
+    def compile_all():
+        Regex.purge()
+        for pattern in patterns:
+            Regex.compile(pattern, "abcdefghijxyz0123456789")
+    return compile_all
+
+
+def suite_cases():
+    """
+    return the cases of the suite as (name, prepare) pairs. prepare() builds the inputs and returns
+    the function to time, so that building them is not measured.
+    """
+    long_text = random_strings(1, 1000000, 1000000, seed=1)[0]
+    text = long_text[:2000]
+    cases = []
+    for n in (100, 10000, 100000):
+        cases.append(("run/dfa/%d" % n, lambda n=n: prepare_run(random_dfa(n), long_text)))
+    # many short inputs, where the cost of a call matters more than the one of a step
+    cases.append(("run/dfa/short", lambda: prepare_short_runs(random_dfa(100), random_strings(100000, 0, 8, seed=2))))
+    for n in (100, 1000):
+        cases.append(("run/nfa/%d" % n, lambda n=n: prepare_run(random_nfa(n), text)))
+        cases.append(("run/eps-nfa/%d" % n, lambda n=n: prepare_run(random_nfa(n, eps_degree=1), text)))
+    cases.append(("run/lazy-dfa/nth-12", lambda: prepare_lazy_run(nth_from_end_nfa(12), long_text)))
+    for n in (1000, 10000):
+        cases.append(("minimized/random/%d" % n, lambda n=n: prepare_minimized(random_dfa(n))))
+    for order in (10, 14):
+        cases.append(("minimized/cyclic/%d" % (1 << order), lambda order=order: prepare_minimized(cyclic_dfa(order))))
+    for order in (10, 14):
+        cases.append(("convert_to_dfa/nth/%d" % order,
+                      lambda order=order: prepare_convert_to_dfa(nth_from_end_nfa(order))))
+    cases.append(("convert_to_dfa/random/16", lambda: prepare_convert_to_dfa(random_nfa(16, "0123", degree=1))))
+    cases.append(("convert_to_dfa/eps/16",
+                  lambda: prepare_convert_to_dfa(random_nfa(16, "0123", degree=1, eps_degree=1))))
+    # the closures of a random epsilon graph are about as large as the graph: their size grows as n ** 2
+    cases.append(("eps_closures/random/1000", lambda: prepare_eps_closures(random_nfa(1000, degree=0, eps_degree=2))))
+    cases.append(("eps_closures/chain/2000", lambda: prepare_eps_closures(eps_chain(2000))))
+    cases.append(("eps_closures/cycle/100000", lambda: prepare_eps_closures(eps_chain(100000, cycle=True))))
+    cases.append(("regex/compile/1000", lambda: prepare_regex(random_patterns(1000))))
+    return cases
+
+
+def calibrate():
+    """
+    return the seconds taken by a fixed loop of Python code. the suite reports its times in this unit,
+    so results taken on different machines can be compared.
+    """
+    def loop():
+        total = 0
+        for i in range(1000000):
+            total += i & 7
+        return total
+
+    return min(measure(loop) for _ in range(5))
+
+
+def run_suite(selected, repeat):
+    """
+    return the results of the suite: the best time of each case over 'repeat' runs, in calibration units.
+    :param selected: run only the cases whose name contains one of these strings (all of them when empty)
+    :param repeat:
+    :return:
+    """
+    unit = calibrate()
+    results = {}
+    for name, prepare in suite_cases():
+        if selected and not any(s in name for s in selected):
+            continue
+        function = prepare()
+        results[name] = min(measure(function) for _ in range(repeat)) / unit
+        print("%-28s %10.3f" % (name, results[name]), flush=True)
+    return {"unit": unit, "python": platform.python_version(), "results": results}
+
+
+def compare(baseline, current, threshold):
+    """
+    print the cases of the current results next to the baseline, and return the names of the cases
+    which got slower by more than the threshold ratio.
+    """
+    print("%-28s %10s %10s %8s" % ("case", "baseline", "current", "ratio"))
+    regressions = []
+    for name, value in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            print("%-28s %10s %10.3f %8s" % (name, "-", value, "new"))
+            continue
+        ratio = value / base
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        print("%-28s %10.3f %10.3f %8.2f%s" % (name, base, value, ratio, flag))
+    return regressions
+
+
+def bench_suite(selected, repeat, save, baseline, threshold):
+    results = run_suite(selected, repeat)
+    if save:
+        with open(save, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write("\n")
+    if baseline:
+        with open(baseline) as file:
+            regressions = compare(json.load(file), results, threshold)
+        if regressions:
+            print("%d regressions: %s" % (len(regressions), ", ".join(regressions)))
+            sys.exit(1)
+
+
+def allocated(build):
+    """
+    return the result of build() and the number of bytes it still holds.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+def bench_memory(orders):
+    print("%6s %8s %14s %14s %14s" % ("n", "states", "DFA dicts", "CompiledDFA", "CompiledNFA"))
+    for n in orders:
+        nfa = nth_from_end_nfa(n)
+        dfa, dict_size = allocated(nfa.convert_to_dfa)
+        compiled, compiled_size = allocated(lambda: CompiledDFA(dfa))
+        _, nfa_size = allocated(lambda: CompiledNFA(dfa))
+        print("%6d %8d %13.1fM %13.1fM %13.1fM" % (n, len(dfa.states), dict_size / 1e6, compiled_size / 1e6,
+                                                     nfa_size / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    minimize = subparsers.add_parser("minimize", help="minimized() on random and worst-case DFAs")
+    minimize.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    minimize.add_argument("--oracle-limit", type=int, default=200,
+                          help="largest DFA also minimized by the pairwise table")
+
+    determinize = subparsers.add_parser("determinize", help="convert_to_dfa() on NFAs with large subset DFAs")
+    determinize.add_argument("--orders", type=int, nargs="+", default=[10, 12, 14, 16],
+                             help="n of the n-th from the end NFAs")
+    determinize.add_argument("-n", type=int, default=16, help="number of states of the random NFAs")
+
+    regex = subparsers.add_parser("regex", help="Regex.compile() on a rule set of random patterns")
+    regex.add_argument("--count", type=int, default=1000)
+
+    batch = subparsers.add_parser("batch", help="run_many() against a loop of run()")
+    batch.add_argument("--count", type=int, default=100000)
+    batch.add_argument("--length", type=int, default=100)
+
+    lazy = subparsers.add_parser("lazy", help="lazy DFA against NFA simulation")
+    lazy.add_argument("-n", type=int, default=12)
+    lazy.add_argument("--length", type=int, default=1000000)
+    lazy.add_argument("--max-memory", type=int, default=1 << 22)
+
+    parallel = subparsers.add_parser("parallel", help="run_parallel() with several worker counts")
+    parallel.add_argument("-n", type=int, default=100, help="number of DFA states")
+    parallel.add_argument("--length", type=int, default=20000000)
+    parallel.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+
+    memory = subparsers.add_parser("memory", help="memory of the dict-based and the compiled DFAs")
+    memory.add_argument("--orders", type=int, nargs="+", default=[8, 10, 12, 14],
+                        help="n of the n-th from the end NFAs whose subset DFAs are measured")
+
+    load = subparsers.add_parser("load", help="building a DFA against loading it from a DFACache")
+    load.add_argument("--orders", type=int, nargs="+", default=[10, 12, 14, 16],
+                      help="n of the n-th from the end NFAs whose minimal DFAs are cached")
+
+    service = subparsers.add_parser("service", help="MatchService under concurrent asyncio clients")
+    service.add_argument("--count", type=int, default=20000, help="number of requests")
+    service.add_argument("--clients", type=int, default=64)
+    service.add_argument("--length", type=int, default=100)
+    service.add_argument("--large", type=int, default=100000, help="length of the large requests")
+    service.add_argument("--large-ratio", type=float, default=0.005)
+    service.add_argument("--workers", type=int, default=None)
+
+    suite = subparsers.add_parser("suite", help="all the cases, compared with stored results")
+    suite.add_argument("cases", nargs="*", help="run only the cases whose name contains one of these")
+    suite.add_argument("--repeat", type=int, default=5, help="runs of each case; the best one counts")
+    suite.add_argument("--save", metavar="FILE", help="store the results in FILE")
+    suite.add_argument("--compare", metavar="FILE", help="compare with the results stored in FILE")
+    suite.add_argument("--threshold", type=float, default=1.5,
+                       help="ratio to the stored time above which a case is a regression")
+
+    args = parser.parse_args()
+    if args.benchmark == "minimize":
+        bench_minimize(args.sizes, args.oracle_limit)
+    elif args.benchmark == "determinize":
+        bench_determinize(args.orders, args.n)
+    elif args.benchmark == "regex":
+        bench_regex(args.count)
+    elif args.benchmark == "batch":
+        bench_batch(args.count, args.length)
+    elif args.benchmark == "lazy":
+        bench_lazy(args.n, args.length, args.max_memory)
+    elif args.benchmark == "parallel":
+        bench_parallel(args.n, args.length, args.workers)
+    elif args.benchmark == "memory":
+        bench_memory(args.orders)
+    elif args.benchmark == "load":
+        bench_load(args.orders)
+    elif args.benchmark == "service":
+        bench_service(args.count, args.clients, args.length, args.large, args.large_ratio, args.workers)
+    elif args.benchmark == "suite":
+        bench_suite(args.cases, args.repeat, args.save, args.compare, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,36 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import contextlib
+import contextvars
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import random
+import re
+import tempfile
+import threading
 import unittest
+from Automaton import numpy
 from Automaton import DeterministicFiniteAutomaton as DFA
 from Automaton import NonDeterministicFiniteAutomaton as NFA
+from Automaton import NFAWithEpsTransition as EpsNFA
+from Automaton import CompiledDFA, CompiledNFA
+from Automaton import DFACache
+from Automaton import Instrumentation
+from Automaton import PatternSet, WordDFA
+from Automaton import DeterminizationAborted
+from Automaton import LazyDFA
+from Automaton import Searcher
+from Automaton import UnknownSymbolError
+from Automaton import SymbolRange
+import Regex
+from Service import MatchService
+from benchmark import random_dfa, random_nfa, random_strings, nth_from_end_nfa, cyclic_dfa
+from benchmark import eps_chain, suite_cases, compare
 
 
 class DFAIsLengthEven(DFA):
@@ -130,6 +158,29 @@ class NFAHas010(NFA):
         super().__init__(states, alphabet, transitions, initial_state, final_states)
 
 
+class EpsNFAZerosThenOnes(EpsNFA):
+    """
+    test whether the eps-NFA can accept the input which is some 0s followed by some 1s.
+    """
+    tests = (("", True),
+             ("0011", True),
+             ("111", True),
+             ("010", False),
+             ("10", False))
+
+    def __init__(self):
+        a, b = range(2)
+        states = {a, b}
+        alphabet = {"0", "1"}
+        transitions = {
+            a: {"0": {a}, -1: {b}},
+            b: {"1": {b}},
+        }
+        initial_state = a
+        final_states = {b}
+        super().__init__(states, alphabet, transitions, initial_state, final_states)
+
+
 class DFAMinimizeTest(DFA):
     """
     check the minimize method works correctly.
@@ -191,6 +242,7 @@ class AutomatonTest(unittest.TestCase):
         DFAMinimizeTest,
         NFAEndsUpWith0xxx,
         NFAHas010,
+        EpsNFAZerosThenOnes,
         NFAtoDFAConvertTest
     ]
 
@@ -217,5 +269,1030 @@ class AutomatonTest(unittest.TestCase):
                     self.assertEqual(expected, dfa_result)
 
 
+def all_strings(alphabet, max_length):
+    """
+    yield every string over the alphabet whose length is at most max_length.
+    """
+    for length in range(max_length + 1):
+        for characters in itertools.product(sorted(alphabet), repeat=length):
+            yield "".join(characters)
+
+
+class CompiledDFATest(unittest.TestCase):
+    dfas = [
+        DFAIsLengthEven,
+        DFAEndsUpWith00,
+        DFAStartsWithOneAndDividableWith5,
+    ]
+
+    def test_same_answers_as_transitions_dict(self):
+        for automaton in self.dfas:
+            instance = automaton()
+            inputs = list(all_strings(instance.alphabet, 8))
+            self.assertEqual([], instance.verify_compiled(inputs))
+
+    def test_unknown_symbol_is_rejected(self):
+        instance = DFAIsLengthEven()
+        self.assertFalse(instance.run("0a"))
+        self.assertFalse(instance.run([0, 1]))
+
+    def test_bytes_input(self):
+        instance = DFAEndsUpWith00()
+        for inputs, expected in instance.tests:
+            self.assertEqual(expected, instance.run(inputs.encode("ascii")))
+
+    def test_recompiled_after_redefinition(self):
+        instance = DFAIsLengthEven()
+        self.assertTrue(instance.run("00"))
+        instance.final_states = frozenset({1})
+        self.assertFalse(instance.run("00"))
+
+    def test_short_inputs_same_as_compiled(self):
+        for dfa in [random_dfa(50, "01", seed=9), identifier_dfa(), DFAEndsUpWith00().minimized()]:
+            for policy in ("reject", "skip"):
+                dfa.on_unknown = policy
+                inputs = ["", "0", "x", "_a9", "0x0", "100" * 20] + random_strings(100, 0, 40, "01a_", seed=10)
+                self.assertEqual([dfa.compiled().run(x) for x in inputs], [dfa.run(x) for x in inputs], policy)
+
+
+class CompactCoreTest(unittest.TestCase):
+
+    def test_slots(self):
+        for compiled in (DFAEndsUpWith00().compiled(), NFAHas010().compiled(), EpsNFAZerosThenOnes().compiled()):
+            self.assertFalse(hasattr(compiled, "__dict__"))
+
+    def test_round_trip(self):
+        for dfa in [DFAStartsWithOneAndDividableWith5(), random_dfa(30, seed=7)]:
+            compiled = dfa.compiled()
+            for automaton in (compiled.to_automaton(), compiled.to_automaton(labels=False),
+                              compiled.minimized().to_automaton()):
+                self.assertTrue(dfa.is_equivalent(automaton))
+            self.assertEqual(dfa.states, compiled.to_automaton().states)
+            self.assertEqual(set(range(len(dfa.states))), compiled.to_automaton(labels=False).states)
+
+    def test_compiled_product(self):
+        a, b = DFAEndsUpWith00(), DFAIsLengthEven()
+        product = a.compiled().product(b.compiled(), lambda x, y: x and y)
+        self.assertIn((2, 0), product.labels)
+        for inputs in all_strings("01", 6):
+            self.assertEqual(a.run(inputs) and b.run(inputs), product.run(inputs))
+
+    def test_large_nfa(self):
+        automaton = random_nfa(CompiledNFA.eager_states + 100, seed=8, eps_degree=1)
+        self.assertIsInstance(automaton.compiled().successors, dict)
+        inputs = random_strings(20, 0, 10, seed=9)
+        self.assertEqual([], automaton.verify_compiled(inputs))
+
+
+def identifier_dfa():
+    """
+    return the DFA of the identifiers over the printable ASCII characters, written with range labels.
+    """
+    alphabet = [chr(c) for c in range(32, 127)]
+    letters = {SymbolRange("a", "z"): 1, SymbolRange("A", "Z"): 1, "_": 1}
+    transitions = {0: letters, 1: dict(letters)}
+    transitions[1][SymbolRange("0", "9")] = 1
+    return DFA({0, 1}, alphabet, transitions, 0, {1})
+
+
+class SymbolClassTest(unittest.TestCase):
+
+    def test_symbols_with_the_same_moves_share_a_class(self):
+        compiled = identifier_dfa().compiled()
+        self.assertEqual(4, compiled.width)  # letters and "_", digits, other characters, unknown symbols
+        self.assertEqual(compiled.classes["a"], compiled.classes["Q"])
+        self.assertEqual(compiled.classes["a"], compiled.classes["_"])
+        self.assertNotEqual(compiled.classes["a"], compiled.classes["0"])
+        self.assertEqual(26 * 2 + 1, len(compiled.members[compiled.classes["a"]]))
+
+    def test_range_labels(self):
+        dfa = identifier_dfa()
+        for inputs, expected in [("", False), ("x", True), ("_x9", True), ("9x", False), ("a-b", False),
+                                 ("Z", True), ("é", False)]:
+            self.assertEqual(expected, dfa.run(inputs), inputs)
+            self.assertEqual(expected, dfa.run(inputs.encode("utf-8")), inputs)
+        expanded = dfa.compiled().to_automaton()
+        self.assertEqual(1, expanded.transitions[0]["m"])
+        self.assertEqual(1, expanded.transitions[1]["5"])
+        self.assertNotIn("5", expanded.transitions[0])
+
+    def test_nfa_range_labels(self):
+        transitions = {0: {SymbolRange(0, 9): {0}, 3: {1}}, 1: {SymbolRange(5, 7): {2}}, 2: {}}
+        nfa = NFA({0, 1, 2}, range(10), transitions, 0, {2})
+        self.assertTrue(nfa.run([1, 3, 6]))
+        self.assertTrue(nfa.run([3, 5]))
+        self.assertFalse(nfa.run([3, 4]))
+        self.assertFalse(nfa.run([3, 6, 0]))
+        self.assertEqual(4, nfa.compiled().width)  # 3, 5 to 7, the other digits, unknown symbols
+
+    def test_reference_paths_expand_ranges(self):
+        dfa = identifier_dfa()
+        inputs = ["", "x", "_a9", "9x", "a-b", "Z", "é"] + random_strings(200, 0, 6, "a_9-Z", seed=8)
+        self.assertEqual([], dfa.verify_compiled(inputs))
+        table = dfa.minimized_by_table_filling()
+        self.assertEqual([dfa.run(x) for x in inputs], [table.run_reference(x) for x in inputs])
+
+        transitions = {0: {SymbolRange(0, 9): {0}, 3: {1}}, 1: {SymbolRange(5, 7): {2}}, 2: {}}
+        nfa = NFA({0, 1, 2}, range(10), transitions, 0, {2})
+        words = [list(word) for word in itertools.product(range(10), repeat=3)]
+        self.assertEqual([], nfa.verify_compiled(words))
+        eps_nfa = EpsNFA({0, 1, 2}, "abc", {0: {-1: {1}}, 1: {SymbolRange("a", "b"): {2}}, 2: {}}, 0, {2})
+        self.assertEqual([], eps_nfa.verify_compiled(list(all_strings("abc", 3))))
+        self.assertTrue(eps_nfa.run("b"))
+        self.assertTrue(eps_nfa.eps_removed().run("b"))
+        self.assertFalse(eps_nfa.eps_removed().run("c"))
+
+    def test_bytes_above_255_classes(self):
+        alphabet = [chr(i) for i in range(300)]
+        wide = DFA(set(range(301)), alphabet, {0: dict((c, i + 1) for i, c in enumerate(alphabet))}, 0,
+                   set(range(2, 301, 2)))
+        compiled = wide.compiled()
+        self.assertGreater(compiled.width, 256)
+        inputs = [b"\x05", b"\x06", b"\xff", b"", b"\x05\x05", bytearray(b"\x07")]
+        expected = [True, False, True, False, False, True]
+        self.assertEqual(expected, [wide.run(x) for x in inputs])
+        self.assertEqual(expected, [compiled.run(x) for x in inputs])
+        self.assertEqual([wide.run(x.decode("latin-1")) for x in inputs], expected)
+        if numpy is not None:
+            self.assertEqual(expected, [bool(x) for x in compiled.run_many(inputs)])
+
+    def test_combined_ranges_keep_their_alphabet(self):
+        letters = DFA({0, 1}, {"a"}, {0: {SymbolRange("a", "z"): 1}, 1: {}}, 0, {1})
+        other = DFA({0, 1}, {"m", "q"}, {0: {"m": 1, "q": 1}, 1: {}}, 0, {1})
+        self.assertFalse(letters.run("m"))
+        serial = EpsNFA.connect_serially([letters, other])
+        parallel = EpsNFA.connect_parallel([letters, other])
+        for inputs in ["am", "aq", "qq", "mq", "q", "m", "a"]:
+            self.assertEqual(letters.run(inputs[:1]) and other.run(inputs[1:]), serial.run(inputs), inputs)
+            self.assertEqual(letters.run(inputs) or other.run(inputs), parallel.run(inputs), inputs)
+        self.assertEqual([(1, 0), (2, 1)], Searcher([letters, other]).findall("am"))
+
+    def test_operations_per_class(self):
+        dfa = identifier_dfa()
+        self.assertTrue(dfa.is_equivalent(dfa.minimized()))
+        self.assertTrue(dfa.is_equivalent(dfa.compiled().to_automaton(labels=False)))
+        digits = DFA({0, 1}, "0123456789", {0: {SymbolRange("0", "9"): 1}, 1: {}}, 0, {1})
+        union = dfa.union(digits)
+        self.assertEqual(4, union.compiled().width)  # the digits are already a class of dfa
+        for inputs in ["", "7", "77", "a7", "7a", "-"]:
+            self.assertEqual(dfa.run(inputs) or digits.run(inputs), union.run(inputs), inputs)
+        self.assertEqual("0", dfa.union(digits).is_equivalent(dfa).counterexample)
+
+    def test_compressed_subset_construction(self):
+        nfa = NFAHas010()
+        nfa.alphabet = frozenset("01234")
+        for trans_dict in nfa.transitions.values():
+            if "1" in trans_dict:
+                trans_dict["2"] = trans_dict["3"] = trans_dict["1"]
+        nfa.invalidate()
+        self.assertEqual(4, nfa.compiled().width)  # "0", "1" to "3", "4", unknown symbols
+        dfa = nfa.convert_to_dfa()
+        for inputs in all_strings("0124", 5):
+            self.assertEqual(nfa.run_reference(inputs), dfa.run(inputs), inputs)
+
+
+class CompiledNFATest(unittest.TestCase):
+
+    def test_same_answers_as_transitions_dict(self):
+        automata = [NFAEndsUpWith0xxx(), NFAHas010(), EpsNFAZerosThenOnes()]
+        automata += [random_nfa(n, seed=seed) for n in (1, 5, 20) for seed in range(3)]
+        automata += [random_nfa(n, seed=seed, eps_degree=1) for n in (1, 5, 20) for seed in range(3)]
+        for automaton in automata:
+            inputs = list(all_strings(automaton.alphabet, 7))
+            self.assertEqual([], automaton.verify_compiled(inputs))
+
+    def test_unknown_symbol_is_rejected(self):
+        self.assertFalse(NFAHas010().run("0102"))
+        self.assertFalse(EpsNFAZerosThenOnes().run("a"))
+
+
+class UnknownSymbolTest(unittest.TestCase):
+
+    automata = [DFAEndsUpWith00, NFAHas010, EpsNFAZerosThenOnes]
+
+    def test_policies(self):
+        expected = {"reject": [False, False, True], "skip": [True, True, True], "default": [True, False, True]}
+        for policy, answers in expected.items():
+            dfa = DFAEndsUpWith00()
+            dfa.on_unknown = policy
+            dfa.default_symbol = "1"
+            self.assertEqual(answers, [dfa.run(x) for x in ["1x00", "10x0", "100"]], policy)
+            self.assertEqual(answers, [dfa.run_reference(x) for x in ["1x00", "10x0", "100"]], policy)
+            self.assertEqual(answers, list(dfa.run_many(["1x00", "10x0", "100"])), policy)
+
+    def test_same_answers_as_transitions_dict(self):
+        for automaton in self.automata:
+            for policy in ("reject", "skip", "default"):
+                instance = automaton()
+                instance.on_unknown = policy
+                instance.default_symbol = "0"
+                inputs = list(all_strings("01x", 6))
+                self.assertEqual([], instance.verify_compiled(inputs), (automaton, policy))
+                self.assertEqual([instance.run(x) for x in inputs], LazyDFA(instance._compiled_nfa()).run_many(inputs))
+                dfa = instance if isinstance(instance, DFA) else instance.convert_to_dfa()
+                self.assertEqual(policy, dfa.on_unknown)
+                self.assertEqual([instance.run(x) for x in inputs], [dfa.minimized().run(x) for x in inputs])
+
+    def test_raise(self):
+        for automaton in self.automata:
+            instance = automaton()
+            instance.on_unknown = "raise"
+            for run in (instance.run, instance.run_reference, LazyDFA(instance._compiled_nfa()).run):
+                with self.assertRaises(UnknownSymbolError) as raised:
+                    run("01x0")
+                self.assertEqual(("x", 2), (raised.exception.symbol, raised.exception.position))
+        dfa = DFAEndsUpWith00()
+        dfa.on_unknown = "raise"
+        with self.assertRaises(UnknownSymbolError):
+            dfa.run_many(["00", "0x"])
+        if numpy is not None:
+            codes = numpy.array([[ord("0"), ord("0")], [ord("1"), ord("x")]])
+            self.assertEqual([True, False], list(dfa.run_many(codes, lengths=[2, 1])))
+            with self.assertRaises(UnknownSymbolError) as raised:
+                dfa.run_many(codes)
+            self.assertEqual((ord("x"), 1), (raised.exception.symbol, raised.exception.position))
+
+    def test_no_output_and_counters(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), Instrumentation() as stats:
+            for automaton in self.automata:
+                self.assertFalse(automaton().run_reference("0x1y"))
+                self.assertFalse(automaton().run("0x1y"))
+        self.assertEqual("", output.getvalue())
+        self.assertEqual(3 + 3 * 2, stats.counters["unknown_symbols"])
+
+    def test_kept_by_operations_and_save(self):
+        a = DFAEndsUpWith00()
+        a.on_unknown = "skip"
+        product = a.intersection(DFAStartsWithOneAndDividableWith5())
+        self.assertEqual("skip", product.on_unknown)
+        self.assertTrue(product.run("1x0100"))
+        buffer = io.BytesIO()
+        a.compiled().minimized().save(buffer)
+        loaded = CompiledDFA.load(buffer.getvalue())
+        self.assertEqual("skip", loaded.on_unknown)
+        self.assertTrue(loaded.run("1x0x0"))
+        self.assertNotEqual(a.fingerprint(), DFAEndsUpWith00().fingerprint())
+
+    def test_bad_policy(self):
+        dfa = DFAEndsUpWith00()
+        dfa.on_unknown = "ignore"
+        with self.assertRaises(ValueError):
+            dfa.compiled()
+        dfa.on_unknown = "default"
+        dfa.default_symbol = "x"
+        with self.assertRaises(ValueError):
+            dfa.compiled()
+
+    def test_searcher_goes_on_after_unknown_symbols(self):
+        self.assertEqual([(3, 0), (8, 0)], Searcher([NFAHas010()]).findall("010 2010"))
+
+
+class DeterminizeTest(unittest.TestCase):
+
+    @staticmethod
+    def subsets(automaton):
+        """
+        return the subsets reachable in the subset construction, searched on the transitions dict.
+        """
+        if isinstance(automaton, EpsNFA):
+            start = automaton.reachable_states_with_multi_eps_from(automaton.initial_state)
+        else:
+            start = frozenset({automaton.initial_state})
+        searched = {start}
+        to_search = [start]
+        while to_search:
+            states = to_search.pop()
+            for character in automaton.alphabet:
+                reachable_states = automaton.next_states(states, character)
+                if reachable_states not in searched:
+                    searched.add(reachable_states)
+                    to_search.append(reachable_states)
+        return searched
+
+    def test_same_subsets_and_language(self):
+        automata = [NFAEndsUpWith0xxx(), NFAHas010(), EpsNFAZerosThenOnes()]
+        automata += [random_nfa(n, seed=seed, degree=1, eps_degree=eps) for n in (1, 6, 12)
+                     for seed in range(3) for eps in (0, 1)]
+        for automaton in automata:
+            dfa = automaton.convert_to_dfa()
+            self.assertEqual(self.subsets(automaton) - {frozenset()}, dfa.states)  # the empty set is the dead row
+            for inputs in all_strings(automaton.alphabet, 6):
+                self.assertEqual(automaton.run_reference(inputs), dfa.run(inputs), inputs)
+
+    def test_limits(self):
+        nfa = nth_from_end_nfa(10)
+        self.assertEqual(1 << 10, len(nfa.convert_to_dfa(max_states=1 << 10).states))
+        with self.assertRaises(DeterminizationAborted) as raised:
+            nfa.convert_to_dfa(max_states=100)
+        self.assertEqual(100, raised.exception.states)
+        with self.assertRaises(DeterminizationAborted):
+            nfa.compiled().determinized(timeout=0)
+
+
+class EpsClosureTest(unittest.TestCase):
+
+    def test_closures_with_cycles(self):
+        a, b, c, d = range(4)
+        automaton = EpsNFA({a, b, c, d}, {"0"},
+                           {a: {-1: {b}}, b: {-1: {c}}, c: {-1: {b, d}}, d: {"0": {a}}}, a, {d})
+        self.assertEqual({a: {a, b, c, d}, b: {b, c, d}, c: {b, c, d}, d: {d}}, automaton.eps_closures())
+
+    def test_closures_follow_redefinition(self):
+        automaton = EpsNFAZerosThenOnes()
+        self.assertEqual({0, 1}, automaton.reachable_states_with_multi_eps_from(0))
+        automaton.transitions = {0: {"0": {0}}, 1: {"1": {1}}}
+        self.assertEqual({0}, automaton.reachable_states_with_multi_eps_from(0))
+
+    def test_eps_removed(self):
+        automata = [EpsNFAZerosThenOnes()]
+        automata += [random_nfa(n, seed=seed, eps_degree=1) for n in (1, 5, 20) for seed in range(3)]
+        for automaton in automata:
+            removed = automaton.eps_removed()
+            self.assertIsInstance(removed, NFA)
+            for inputs in all_strings(automaton.alphabet, 7):
+                self.assertEqual(automaton.run_reference(inputs), removed.run(inputs), inputs)
+
+
+class LazyDFATest(unittest.TestCase):
+
+    def test_same_answers_as_transitions_dict(self):
+        automata = [NFAEndsUpWith0xxx(), NFAHas010(), EpsNFAZerosThenOnes()]
+        automata += [random_nfa(n, seed=seed, eps_degree=seed % 2) for n in (5, 20) for seed in range(4)]
+        for automaton in automata:
+            lazy = automaton.lazy_dfa()
+            for inputs in all_strings(automaton.alphabet, 7):
+                self.assertEqual(automaton.run_reference(inputs), lazy.run(inputs), inputs)
+            self.assertEqual(0, lazy.flushes)
+
+    def test_bounded_cache(self):
+        automaton = nth_from_end_nfa(10)
+        lazy = LazyDFA(automaton, max_memory=0, max_flushes_per_run=2)
+        inputs = list(all_strings(automaton.alphabet, 13))
+        self.assertEqual([automaton.run(x) for x in inputs], lazy.run_many(inputs))
+        stats = lazy.stats()
+        self.assertLessEqual(stats["states"], stats["max_states"])
+        self.assertGreater(stats["flushes"], 0)
+        self.assertGreater(stats["fallbacks"], 0)
+        self.assertGreater(stats["hits"], 0)
+        self.assertEqual(lazy.steps, stats["hits"] + stats["misses"])
+
+    def test_full_cache_keeps_known_targets(self):
+        automaton = nth_from_end_nfa(8)
+        inputs = random_strings(200, 0, 200, seed=4)
+        unbounded = LazyDFA(automaton)
+        unbounded.run_many(inputs)
+        lazy = LazyDFA(automaton)
+        lazy.max_states = unbounded.stats()["states"]  # just room for every state the inputs reach
+        self.assertEqual([automaton.run(x) for x in inputs], lazy.run_many(inputs))
+        self.assertEqual((0, 0), (lazy.flushes, lazy.fallbacks))
+
+
+class MatcherTest(unittest.TestCase):
+    automata = [DFAEndsUpWith00, DFAStartsWithOneAndDividableWith5, NFAHas010, EpsNFAZerosThenOnes]
+
+    def test_chunks(self):
+        for automaton in self.automata:
+            instance = automaton()
+            matchers = [instance.matcher()]
+            if not isinstance(instance, DFA):
+                matchers.append(instance.lazy_dfa().matcher())
+            for matcher in matchers:
+                for inputs in all_strings(instance.alphabet, 6):
+                    matcher.reset()
+                    for i in range(0, len(inputs), 2):
+                        matcher.feed(inputs[i:i + 2])
+                    self.assertEqual(instance.run(inputs), matcher.is_accepting(), inputs)
+
+    def test_unknown_symbol_position(self):
+        for automaton in [DFAEndsUpWith00, NFAHas010]:
+            instance = automaton()
+            instance.on_unknown = "raise"
+            matcher = instance.matcher().feed("0101")
+            with self.assertRaises(UnknownSymbolError) as raised:
+                matcher.feed("0x")
+            self.assertEqual(("x", 5), (raised.exception.symbol, raised.exception.position))
+            with self.assertRaises(UnknownSymbolError) as raised:
+                matcher.reset().feed("x")
+            self.assertEqual(0, raised.exception.position)
+
+    def test_file_and_mmap(self):
+        data = b"1101000110100100" * 1000
+        for automaton in self.automata:
+            instance = automaton()
+            expected = instance.run(data)
+            self.assertEqual(expected, instance.matcher().scan_file(io.BytesIO(data), chunk_size=7))
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "input")
+                with open(path, "wb") as file:
+                    file.write(data)
+                self.assertEqual(expected, instance.matcher().scan_mmap(path, chunk_size=1000))
+                with open(path, "wb"):
+                    pass
+                self.assertEqual(instance.run(""), instance.matcher().scan_mmap(path))
+
+    def test_stream(self):
+        async def scan(instance, data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await instance.matcher().scan_stream(reader, chunk_size=3)
+
+        for automaton in self.automata:
+            instance = automaton()
+            for inputs, expected in instance.tests:
+                self.assertEqual(expected, asyncio.run(scan(instance, inputs.encode("ascii"))))
+
+
+class ProductTest(unittest.TestCase):
+    operations = {
+        "intersection": lambda x, y: x and y,
+        "union": lambda x, y: x or y,
+        "difference": lambda x, y: x and not y,
+        "symmetric_difference": lambda x, y: x != y,
+    }
+
+    def test_operations(self):
+        pairs = [(DFAEndsUpWith00(), DFAStartsWithOneAndDividableWith5()),
+                 (random_dfa(8, seed=1), random_dfa(12, seed=2)),
+                 (random_dfa(5, alphabet="01", seed=3), random_dfa(5, alphabet="12", seed=4))]
+        for a, b in pairs:
+            for name, expected in self.operations.items():
+                for minimize in (False, True):
+                    result = getattr(a, name)(b, minimize=minimize)
+                    for inputs in all_strings(result.alphabet, 6):
+                        self.assertEqual(expected(a.run(inputs), b.run(inputs)), result.run(inputs), (name, inputs))
+
+    def test_minimized_result(self):
+        a, b = DFAIsLengthEven(), DFAEndsUpWith00()
+        self.assertEqual(2, len(a.union(a, minimize=True).states))
+        self.assertEqual(len(b.minimized().states), len(b.intersection(b, minimize=True).states))
+        self.assertEqual(len(a.intersection(b).minimized().states), len(a.intersection(b, minimize=True).states))
+        self.assertEqual(set(range(4)), set(a.intersection(b, minimize=True).states))
+
+    def test_union_all(self):
+        dfas = [random_dfa(6, seed=seed) for seed in range(7)]
+        union = DFA.union_all(dfas)
+        for inputs in all_strings("01", 7):
+            self.assertEqual(any(dfa.run(inputs) for dfa in dfas), union.run(inputs), inputs)
+
+
+class LanguageCheckTest(unittest.TestCase):
+
+    def test_is_empty(self):
+        self.assertFalse(NFAHas010().is_empty())
+        self.assertEqual("010", NFAHas010().is_empty().counterexample)
+        self.assertEqual("", DFAIsLengthEven().is_empty().counterexample)
+        self.assertTrue(DFAIsLengthEven().intersection(DFAIsLengthEven().flipped_dfa()).is_empty())
+        for automaton in [random_nfa(8, seed=seed, eps_degree=seed % 2, final_ratio=0.1) for seed in range(10)]:
+            check = automaton.is_empty()
+            if check:
+                self.assertFalse(any(automaton.run(x) for x in all_strings(automaton.alphabet, 6)))
+            else:
+                self.assertTrue(automaton.run(check.counterexample))
+
+    def test_is_equivalent(self):
+        dfa = DFAEndsUpWith00()
+        self.assertTrue(dfa.is_equivalent(dfa.minimized().renumbered()))
+        self.assertTrue(NFAHas010().is_equivalent(NFAHas010().convert_to_dfa()))
+        check = dfa.is_equivalent(DFAIsLengthEven())
+        self.assertFalse(check)
+        self.assertNotEqual(dfa.run(check.counterexample), DFAIsLengthEven().run(check.counterexample))
+        for seed in range(10):
+            a, b = random_nfa(6, seed=seed, eps_degree=1), random_nfa(6, seed=seed + 100)
+            self.assertTrue(a.is_equivalent(a.eps_removed()))
+            check = a.is_equivalent(b)
+            if not check:
+                self.assertNotEqual(a.run(check.counterexample), b.run(check.counterexample))
+
+    def test_is_subset_of(self):
+        a, b = DFAEndsUpWith00(), DFAStartsWithOneAndDividableWith5()
+        self.assertTrue(a.intersection(b).is_subset_of(a))
+        self.assertTrue(b.is_subset_of(a.union(b)))
+        self.assertTrue(NFAEndsUpWith0xxx().is_subset_of(NFAEndsUpWith0xxx().convert_to_dfa()))
+        for seed in range(20):
+            a, b = random_nfa(6, seed=seed, eps_degree=seed % 2), random_nfa(6, seed=seed + 100, degree=3)
+            check = a.is_subset_of(b)
+            if check:
+                self.assertFalse(any(a.run(x) and not b.run(x) for x in all_strings("01", 6)))
+            else:
+                self.assertTrue(a.run(check.counterexample))
+                self.assertFalse(b.run(check.counterexample))
+
+
+class ParallelRunTest(unittest.TestCase):
+
+    def test_transition_map(self):
+        dfa = random_dfa(30, seed=3)
+        compiled = dfa.compiled()
+        for text in random_strings(10, 0, 200, seed=4):
+            classes = compiled.classify(text)
+            expected = [compiled.advance(q * compiled.width, text) for q in range(len(compiled.accepting))]
+            self.assertEqual(expected, compiled.transition_map(classes))
+
+    def test_same_answers_as_run(self):
+        for dfa in [DFAStartsWithOneAndDividableWith5(), random_dfa(50, seed=5)]:
+            for text in random_strings(5, 1000, 3000, seed=6) + ["1" + "0" * 5000]:
+                self.assertEqual(dfa.run(text), dfa.compiled().run_parallel(text, workers=3, min_chunk=100))
+
+    def test_start_methods(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dfa")
+            DFAStartsWithOneAndDividableWith5().compiled().save(path)
+            loaded = CompiledDFA.load(path)
+            copied = pickle.loads(pickle.dumps(loaded))
+            self.assertEqual(list(loaded.table), list(copied.table))
+            texts = ["1" + "0" * 3000, "1" + "01" * 1500]
+            for method in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context(method)
+                for text in texts:
+                    self.assertEqual(loaded.run(text), loaded.run_parallel(text, workers=2, min_chunk=100,
+                                                                           mp_context=context), method)
+
+
+class SearcherTest(unittest.TestCase):
+
+    @staticmethod
+    def brute_force(patterns, text):
+        return [(end, i) for end in range(len(text) + 1) for i, pattern in enumerate(patterns)
+                if any(pattern.run(text[start:end]) for start in range(end + 1))]
+
+    def test_same_matches_as_brute_force(self):
+        patterns = [DFAStartsWithOneAndDividableWith5(), NFAHas010(), EpsNFAZerosThenOnes(), random_dfa(6, seed=1)]
+        texts = ["", "0", "1010", "0001111", "1101000110100100"] + random_strings(20, 0, 30, seed=2)
+        for max_memory in (1 << 22, 0):
+            searcher = Searcher(patterns, max_memory)
+            for text in texts:
+                self.assertEqual(self.brute_force(patterns, text), searcher.findall(text), text)
+
+    def test_leftmost_starts(self):
+        patterns = [DFAStartsWithOneAndDividableWith5(), NFAHas010(), EpsNFAZerosThenOnes(), random_dfa(6, seed=1)]
+        searcher = Searcher(patterns)
+        for text in ["", "1010", "0001111", "10 0101x1"] + random_strings(20, 0, 30, seed=3):
+            expected = [(min(start for start in range(end + 1) if patterns[i].run(text[start:end])), end, i)
+                        for end, i in self.brute_force(patterns, text)]
+            self.assertEqual(expected, searcher.findall(text, starts=True), text)
+
+    def test_single_pattern(self):
+        self.assertEqual([4, 5, 6], list(DFAEndsUpWith00().finditer("1100001")))
+        self.assertEqual([(3, 5), (3, 6)], list(DFAEndsUpWith00().finditer("11 0001", starts=True)))
+        self.assertEqual([], list(NFAHas010().finditer("0110")))
+        self.assertEqual([(3, 0), (4, 0)], Searcher(x for x in [NFAHas010()]).findall("0101"))
+
+
+class RunManyTest(unittest.TestCase):
+
+    def test_same_answers_as_run(self):
+        for automaton in [DFAIsLengthEven, DFAEndsUpWith00, DFAStartsWithOneAndDividableWith5, NFAHas010]:
+            instance = automaton()
+            inputs = list(all_strings(instance.alphabet, 6)) + ["01a0", "0" * 100]
+            self.assertEqual([instance.run(x) for x in inputs], list(instance.run_many(inputs)))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_code_array(self):
+        instance = DFAEndsUpWith00()
+        codes = numpy.frombuffer(b"00100" + b"11000" + b"1100x", dtype=numpy.uint8).reshape(3, 5)
+        self.assertEqual([True, True, False], list(instance.accepts_batch(codes)))
+        self.assertEqual([True, False, False], list(instance.accepts_batch(codes, lengths=[2, 3, 0])))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_str_and_bytes_arrays(self):
+        dfa = random_dfa(20, seed=0)
+        inputs = ["01", "10", "0", "11", "", "0110100"]
+        expected = [dfa.run(x) for x in inputs]
+        self.assertEqual(expected, list(dfa.run_many(numpy.array(inputs))))
+        self.assertEqual(expected, list(dfa.run_many(numpy.array([x.encode("ascii") for x in inputs]))))
+        with self.assertRaises(TypeError):
+            dfa.run_many(numpy.array([0.0, 1.0]))
+
+
+class MinimizeTest(unittest.TestCase):
+
+    def assertSameLanguage(self, expected, actual, max_length=7):
+        for inputs in all_strings(expected.alphabet, max_length):
+            self.assertEqual(expected.run(inputs), actual.run(inputs), inputs)
+
+    def test_same_result_as_table_filling(self):
+        automata = [DFAIsLengthEven(), DFAEndsUpWith00(), DFAStartsWithOneAndDividableWith5()]
+        automata += [random_dfa(n, seed=seed) for n in (1, 5, 20, 40) for seed in range(5)]
+        for dfa in automata:
+            hopcroft = dfa.minimized()
+            table = dfa.minimized_by_table_filling()
+            self.assertEqual(table.states, hopcroft.states)
+            self.assertSameLanguage(dfa, hopcroft)
+            self.assertSameLanguage(dfa, table)
+
+    def test_minimize_example(self):
+        dfa = DFAMinimizeTest()
+        self.assertEqual(5, len(dfa.states))
+        self.assertIn(frozenset({0, 4}), dfa.states)
+        self.assertIn(frozenset({1, 7}), dfa.states)
+
+    def test_cyclic_family(self):
+        dfa = cyclic_dfa(6)
+        self.assertEqual(64, len(dfa.minimized().states))
+
+
+class TrimTest(unittest.TestCase):
+
+    def test_useless_states_dropped(self):
+        # 3 is unreachable, 4 is reachable but leads to no final state
+        transitions = {0: {"a": 1, "b": 4}, 1: {"a": 2, "b": 0}, 2: {"a": 2, "b": 2}, 3: {"a": 2, "b": 2},
+                       4: {"a": 4, "b": 4}}
+        dfa = DFA(range(5), "ab", transitions, 0, {2})
+        trimmed = dfa.trimmed()
+        self.assertEqual({0, 1, 2}, trimmed.states)
+        self.assertEqual({"a": 1}, trimmed.transitions[0])
+        self.assertIs(trimmed, trimmed.trimmed())
+        self.assertEqual(3, dfa.compiled().trimmed().dead)
+        self.assertEqual(3, len(dfa.minimized().states))
+        for automaton in (trimmed, dfa.compiled().trimmed().to_automaton(), dfa.minimized()):
+            for inputs in all_strings("ab", 6):
+                self.assertEqual(dfa.run_reference(inputs), automaton.run_reference(inputs), inputs)
+                self.assertEqual(dfa.run(inputs), automaton.run(inputs), inputs)
+
+        nfa = NFA(range(4), "01", {0: {"0": {0, 1, 3}}, 1: {"1": {2}}, 3: {"1": {3}}}, 0, {2})
+        self.assertEqual({0, 1, 2}, nfa.trimmed().states)
+        self.assertEqual({"0": {0, 1}}, nfa.trimmed().transitions[0])
+        eps_nfa = EpsNFA(range(4), "0", {0: {-1: {1, 3}}, 1: {"0": {2}}, 3: {"0": {3}}}, 0, {2})
+        self.assertEqual({0, 1, 2}, eps_nfa.trimmed().states)
+        self.assertTrue(eps_nfa.trimmed().run("0"))
+
+    def test_same_language(self):
+        automata = [random_dfa(n, seed=seed) for n in (1, 10, 30) for seed in range(3)]
+        automata += [random_nfa(n, seed=seed, degree=1, eps_degree=eps) for n in (1, 8) for seed in range(3)
+                     for eps in (0, 1)]
+        automata += [NFAEndsUpWith0xxx().convert_to_dfa()]
+        for automaton in automata:
+            trimmed = automaton.trimmed()
+            self.assertLessEqual(len(trimmed.states), len(automaton.states))
+            for inputs in all_strings(automaton.alphabet, 6):
+                self.assertEqual(automaton.run_reference(inputs), trimmed.run_reference(inputs), inputs)
+            if isinstance(automaton, DFA):
+                self.assertEqual(len(trimmed.states), automaton.compiled().trimmed().dead)
+
+    def test_no_empty_subset(self):
+        dfa = Regex.compile("ab|ba").convert_to_dfa()
+        self.assertNotIn(frozenset(), dfa.states)
+        self.assertEqual(5, len(dfa.states))
+
+    def test_product_and_complement(self):
+        a, b = Regex.compile("(ab)*", "abc").convert_to_dfa(), Regex.compile("a(b|c)*", "abc").convert_to_dfa()
+        self.assertEqual({"a", "b", "c"}, set(a.flipped_dfa().transitions[a.initial_state]))
+        for inputs in all_strings("abc", 5):
+            self.assertEqual(not a.run(inputs), a.flipped_dfa().run(inputs), inputs)
+            self.assertEqual(a.run(inputs) and not b.run(inputs), a.difference(b).run(inputs), inputs)
+        with self.assertRaises(ValueError):
+            a.completed(a.initial_state)
+        flipped = a.flipped_dfa()
+        self.assertIs(flipped, flipped.completed())
+
+    def test_instrumented(self):
+        dfa = DFA(range(3), "a", {0: {"a": 0}, 1: {"a": 2}, 2: {}}, 0, {0})
+        with Instrumentation() as stats:
+            self.assertEqual(1, dfa.compiled().minimized().dead)
+        self.assertEqual((3, 1), (stats.counters["trim.states"], stats.counters["trim.trimmed_states"]))
+
+
+class SerializeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_round_trip(self):
+        for dfa in [DFAStartsWithOneAndDividableWith5(), random_dfa(50, "abc", seed=3), identifier_dfa()]:
+            compiled = dfa.compiled()
+            path = os.path.join(self.directory.name, "dfa")
+            compiled.save(path)
+            buffer = io.BytesIO()
+            compiled.save(buffer)
+            for loaded in (CompiledDFA.load(path), CompiledDFA.load(buffer.getvalue())):
+                self.assertEqual(compiled.members, loaded.members)
+                self.assertEqual(list(compiled.table), list(loaded.table))
+                self.assertEqual(range(len(dfa.states)), loaded.labels)
+                inputs = random_strings(50, 0, 12, "".join(sorted(dfa.alphabet))[:20], seed=4)
+                self.assertEqual([compiled.run(x) for x in inputs], [loaded.run(x) for x in inputs])
+                self.assertEqual(list(compiled.run_many(inputs)), list(loaded.run_many(inputs)))
+                self.assertTrue(dfa.is_equivalent(loaded.minimized().to_automaton()))
+
+    def test_mapped_in_place(self):
+        path = os.path.join(self.directory.name, "dfa")
+        DFAEndsUpWith00().compiled().save(path)
+        loaded = CompiledDFA.load(path)
+        self.assertIsInstance(loaded.table, memoryview)
+        self.assertTrue(loaded.table.readonly)
+        self.assertTrue(loaded.run("1100"))
+
+    def test_bad_files(self):
+        buffer = io.BytesIO()
+        DFAEndsUpWith00().compiled().save(buffer)
+        data = buffer.getvalue()
+        for bad in [b"", b"ADFB" + data[4:], data[:4] + bytes([CompiledDFA.format_version + 1]) + data[5:],
+                    data[:-1]]:
+            with self.assertRaises(ValueError):
+                CompiledDFA.load(bad)
+        with self.assertRaises(ValueError):
+            DFA({0}, [(0, 1)], {0: {(0, 1): 0}}, 0, {0}).compiled().save(io.BytesIO())
+
+    def test_cache(self):
+        built = []
+
+        def build():
+            built.append(1)
+            return NFAHas010().convert_to_dfa().compiled()
+
+        for cache in (DFACache(self.directory.name), DFACache(self.directory.name)):
+            dfa = cache.get("has 010", build)
+            self.assertTrue(dfa.run("11010"))
+        self.assertEqual(1, len(built))
+
+        nfa = NFAHas010()
+        dfa = DFACache(self.directory.name).dfa(nfa)
+        self.assertEqual(4, dfa.dead)
+        self.assertTrue(nfa.is_equivalent(dfa.to_automaton()))
+        self.assertEqual(nfa.fingerprint(), NFAtoDFAConvertTest().fingerprint())
+        self.assertNotEqual(nfa.fingerprint(), DFAEndsUpWith00().fingerprint())
+        self.assertTrue(os.path.exists(DFACache(self.directory.name).path("%s:True" % nfa.fingerprint())))
+
+
+class RegexTest(unittest.TestCase):
+    patterns = ["", "0", "01", "0|1", "(0|1)*00", "0*1+0?", "(01|10)*", "((0|)1)*", "0{2}", "1{1,3}0{2,}",
+                "[01]1", "[^1]*", ".1.", "(0|1)*1(0|1){3}", "()|1", "(0*)*"]
+
+    def test_same_matches_as_re(self):
+        for pattern in self.patterns:
+            expected = re.compile(pattern)
+            for epsilon in (False, True):
+                automaton = Regex.compile(pattern, "01", epsilon)
+                self.assertIsInstance(automaton, EpsNFA if epsilon else NFA)
+                for inputs in all_strings("01", 7):
+                    self.assertEqual(expected.fullmatch(inputs) is not None, automaton.run(inputs), (pattern, inputs))
+                    self.assertEqual(automaton.run(inputs), automaton.run_reference(inputs), (pattern, inputs))
+
+    def test_glushkov_states(self):
+        nfa = Regex.compile("(a|b)*abb")
+        self.assertEqual(6, len(nfa.states))
+        self.assertEqual(frozenset("ab"), nfa.alphabet)
+        self.assertEqual({0, 1}, Regex.compile("a*").final_states)
+
+    def test_symbol_sets(self):
+        identifier = Regex.compile(r"[a-zA-Z_]\w*", [chr(c) for c in range(32, 127)])
+        for inputs, expected in [("x", True), ("_x9", True), ("9x", False), ("a-b", False), ("", False)]:
+            self.assertEqual(expected, identifier.run(inputs), inputs)
+        self.assertEqual(4, identifier.compiled().width)
+        self.assertTrue(Regex.compile(r"\d+\.\d*").run("3.14"))
+        self.assertTrue(Regex.compile("[]-]+").run("-]"))
+
+    def test_cache(self):
+        self.assertIs(Regex.compile("(0|1)*00", "01"), Regex.compile("(0|1)*00", {"0", "1"}))
+        self.assertIsNot(Regex.compile("(0|1)*00"), Regex.compile("(0|1)*00", epsilon=True))
+
+    def test_errors(self):
+        for pattern in ["(0", "0)", "*", "0{2", "0{3,1}", "[01", "a\\", "."]:
+            with self.assertRaises(Regex.RegexError, msg=pattern):
+                Regex.compile(pattern)
+        with self.assertRaises(Regex.RegexError):
+            Regex.compile("2", "01")
+
+
+class CombinatorTest(unittest.TestCase):
+
+    def test_connect_serially(self):
+        automaton = EpsNFA.connect_serially([DFAEndsUpWith00(), NFAHas010(), EpsNFAZerosThenOnes()])
+        expected = re.compile("((0|1)*00)((0|1)*010(0|1)*)(0*1*)")
+        for inputs in all_strings("01", 8):
+            self.assertEqual(expected.fullmatch(inputs) is not None, automaton.run(inputs), inputs)
+
+    def test_connect_parallel(self):
+        automaton = EpsNFA.connect_parallel([DFAEndsUpWith00(), Regex.compile("1(0|1)"), DFAIsLengthEven()])
+        for inputs in all_strings("01", 7):
+            expected = inputs.endswith("00") or inputs in ("10", "11") or len(inputs) % 2 == 0
+            self.assertEqual(expected, automaton.run(inputs), inputs)
+
+    def test_star(self):
+        automaton = EpsNFA.star(EpsNFA.connect_serially([Regex.compile("0"), Regex.compile("1*")]))
+        for inputs in all_strings("01", 7):
+            self.assertEqual(re.fullmatch("(01*)*", inputs) is not None, automaton.run(inputs), inputs)
+        self.assertEqual([], automaton.verify_compiled(all_strings("01", 5)))
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def test_construction_phases(self):
+        events = []
+        with Instrumentation([lambda name, data: events.append((name, data))], progress_interval=256) as stats:
+            nfa = nth_from_end_nfa(10)
+            dfa = nfa.convert_to_dfa()
+            minimal = dfa.minimized()
+            EpsNFAZerosThenOnes().run("0011")
+        exported = json.loads(json.dumps(stats.export()))
+        counters = exported["counters"]
+        self.assertEqual(len(dfa.states), counters["determinize.dfa_states"])
+        self.assertEqual(11, counters["determinize.nfa_states"])
+        self.assertEqual(len(minimal.states), counters["minimize.minimized_states"])
+        self.assertGreater(counters["hopcroft.rounds"], 0)
+        self.assertEqual(2, counters["eps_closures.states"])
+        for phase in ("compile", "determinize", "hopcroft", "minimize", "eps_closures"):
+            self.assertGreater(exported["timers"][phase]["calls"], 0)
+        names = [name for name, _ in events]
+        self.assertEqual(3, names.count("determinize.progress"))  # at 256, 512 and 768 states expanded
+        minimize = dict(events)["minimize"]
+        self.assertEqual((len(dfa.states), len(minimal.states)), (minimize["states"], minimize["minimized_states"]))
+
+    def test_runs(self):
+        nfa = NFAHas010()
+        with Instrumentation() as stats:
+            nfa.run("0101")
+            DFAEndsUpWith00().run("100")
+            nfa.run("11")
+        self.assertEqual({"nfa.runs": 2, "nfa.symbols": 6, "nfa.active_states": 1 + 2 + 2 + 3 + 1 + 1,
+                          "dfa.runs": 1, "dfa.symbols": 3, "compile.states": 7, "compile.classes": 4},
+                         stats.counters)
+        self.assertEqual(3, stats.maxima["nfa.active_states"])
+
+    def test_disabled(self):
+        outer = Instrumentation()
+        with outer:
+            with Instrumentation() as inner:
+                DFAIsLengthEven().run("00")
+            DFAIsLengthEven().run("00")
+        DFAIsLengthEven().run("00")
+        self.assertEqual(1, inner.counters["dfa.runs"])
+        self.assertEqual(1, outer.counters["dfa.runs"])
+        self.assertEqual({}, outer.reset().counters)
+
+    def test_disable_out_of_order(self):
+        first, second = Instrumentation().enable(), Instrumentation().enable()
+        with self.assertRaises(RuntimeError):
+            first.disable()
+        second.disable()
+        first.disable().disable()
+        DFAIsLengthEven().run("00")
+        self.assertEqual({}, first.counters)
+        self.assertEqual({}, second.counters)
+
+    def test_contexts(self):
+        async def runs(count):
+            with Instrumentation() as stats:
+                for _ in range(count):
+                    DFAIsLengthEven().run("00")
+                    await asyncio.sleep(0)
+            return stats.counters["dfa.runs"]
+
+        async def main():
+            return await asyncio.gather(runs(3), runs(5))
+
+        self.assertEqual([3, 5], asyncio.run(main()))
+
+    def test_threads(self):
+        dfa = DFAIsLengthEven()
+
+        def runs():
+            for _ in range(20000):
+                dfa.run("00")
+
+        with Instrumentation() as stats:
+            threads = [threading.Thread(target=contextvars.copy_context().run, args=(runs,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(8 * 20000, stats.counters["dfa.runs"])
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def assertMinimal(self, words):
+        dfa = words.to_automaton()
+        self.assertEqual(dfa.compiled().minimized().dead, words.state_count)
+
+    def test_word_dfa(self):
+        words = WordDFA(["tap", "taps", "top", "tops"])
+        self.assertEqual(5, words.state_count)  # t, ta|to, tap|top, taps|tops, and the initial state
+        self.assertTrue(words.add("stop"))
+        self.assertFalse(words.add("top"))
+        self.assertTrue(words.remove("tap"))
+        self.assertFalse(words.remove("ta"))
+        self.assertEqual(4, len(words))
+        self.assertEqual(["taps", "top", "tops", "stop"],
+                         [x for x in ["", "ta", "tap", "taps", "top", "tops", "stop", "stops"] if x in words])
+        self.assertMinimal(words)
+        self.assertTrue(words.compiled().run("tops"))
+
+    def test_random_updates(self):
+        rng = random.Random(0)
+        words = WordDFA()
+        expected = set()
+        for step in range(1500):
+            word = "".join(rng.choice("abc") for _ in range(rng.randint(0, 5)))
+            if rng.random() < 0.6:
+                self.assertEqual(word not in expected, words.add(word))
+                expected.add(word)
+            else:
+                self.assertEqual(word in expected, words.remove(word))
+                expected.discard(word)
+            if step % 250 == 0:
+                self.assertMinimal(words)
+                self.assertEqual(sorted(expected), sorted(x for x in all_strings("abc", 5) if words.run(x)))
+        self.assertEqual(len(expected), len(words))
+
+    def test_pattern_set(self):
+        patterns = dict(enumerate(["a+b", "(ab)*", "c{2,3}", "b|c", "a?c"]))
+        automata = PatternSet(dict((key, Regex.compile(pattern, "abc")) for key, pattern in patterns.items()))
+        automata.remove(1)
+        del patterns[1]
+        patterns[2] = "([abc]{2})*"
+        automata.add(2, Regex.compile(patterns[2], "abc"))
+        automata.add("suffix", Regex.compile("[abc]*ca", "abc"))
+        patterns["suffix"] = "[abc]*ca"
+        self.assertEqual(5, len(automata))
+        for inputs in all_strings("abc", 6):
+            expected = any(re.fullmatch(pattern, inputs) for pattern in patterns.values())
+            self.assertEqual(expected, automata.run(inputs), inputs)
+        for key in list(patterns):
+            automata.remove(key)
+        self.assertFalse(automata.run(""))
+        self.assertIsNone(automata.compiled())
+
+
+class ServiceTest(unittest.TestCase):
+
+    def test_same_answers(self):
+        dfa = random_dfa(30, seed=5)
+        inputs = random_strings(300, 0, 20, seed=6) + random_strings(3, 5000, 5000, seed=7)
+
+        async def match_all(service):
+            async with service:
+                return await asyncio.gather(*[service.match(x) for x in inputs]), service.stats()
+
+        for service in (MatchService(dfa, batch_size=64), MatchService(NFAHas010(), workers=2),
+                        MatchService(dfa.compiled(), batch_delay=0.001)):
+            results, stats = asyncio.run(match_all(service))
+            expected = [service.engine.run(x) for x in inputs]
+            self.assertEqual(expected, results)
+            self.assertEqual(len(inputs), stats["requests"])
+            self.assertLess(stats["batches"], len(inputs) // 4)
+            self.assertEqual(sum(map(len, inputs)), stats["symbols"])
+            self.assertLessEqual(stats["latency"]["p50"], stats["latency"]["max"])
+            self.assertEqual(0, stats["pending"])
+
+    def test_backpressure_and_errors(self):
+        dfa = DFAEndsUpWith00()
+        dfa.on_unknown = "raise"
+
+        async def match_all(service):
+            async with service:
+                return await asyncio.gather(*[service.match(x) for x in ["00", "0x", "10"] * 10],
+                                            return_exceptions=True), service.stats()
+
+        results, stats = asyncio.run(match_all(MatchService(dfa, max_pending=4, batch_size=2)))
+        self.assertEqual([True, False, False] * 10, [r is True for r in results])
+        self.assertTrue(all(isinstance(r, UnknownSymbolError) for r in results[1::3]))
+        self.assertEqual(10, stats["errors"])
+        self.assertEqual(4, stats["most_pending"])
+        with self.assertRaises(TypeError):
+            MatchService(NFAHas010().lazy_dfa())
+
+    def test_processes_share_a_saved_dfa(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dfa")
+            dfa = DFAEndsUpWith00()
+            dfa.on_unknown = "raise"
+            dfa.compiled().save(path)
+
+            async def match_all(service):
+                async with service:
+                    first = await asyncio.gather(*[service.match(x) for x in ["100", "0x", "01", "0" * 10000]],
+                                                 return_exceptions=True)
+                    return first, await service.match("00")
+
+            (found, error, *rest), last = asyncio.run(match_all(MatchService(path, workers=1, processes=True)))
+            self.assertEqual([True, False, True, True], [found] + rest + [last])
+            self.assertIsInstance(error, UnknownSymbolError)
+            self.assertEqual(("x", 1), (error.symbol, error.position))
+        for error in [DeterminizationAborted("too many states", 10), Regex.RegexError("unbalanced (", "(a", 0)]:
+            copy = pickle.loads(pickle.dumps(error))
+            self.assertEqual((str(error), vars(error)), (str(copy), vars(copy)))
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_eps_chain(self):
+        closures = eps_chain(10).eps_closures()
+        self.assertEqual([10 - q for q in range(10)], [len(closures[q]) for q in range(10)])
+        closures = eps_chain(10, cycle=True).eps_closures()
+        self.assertEqual(1, len(set(closures.values())))
+
+    def test_suite(self):
+        names = [name for name, _ in suite_cases()]
+        self.assertEqual(len(names), len(set(names)))
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")) as file:
+            self.assertEqual(set(names), set(json.load(file)["results"]))
+        baseline = {"results": {"a": 1.0, "b": 1.0}}
+        current = {"results": {"a": 1.2, "b": 2.0, "c": 1.0}}
+        self.assertEqual(["b"], compare(baseline, current, 1.5))
+
+
 if __name__ == "__main__":
     unittest.main()